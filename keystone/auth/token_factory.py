@@ -46,80 +46,87 @@ class TokenDataHelper(object):
         self.catalog_api = catalog.Manager()
         self.trust_api = trust.Manager()
         self.context = context
+        self._scopes = {}
+
+    def _get_scope(self, user_id, domain_id=None, project_id=None):
+        """Returns the resolved auth scope of a user, looked up once."""
+        key = (user_id, domain_id, project_id)
+        if key not in self._scopes:
+            self._scopes[key] = self.identity_api.resolve_auth_scope(
+                self.context, user_id, project_id=project_id,
+                domain_id=domain_id)
+        return self._scopes[key]
+
+    def _get_token_scope(self, user_id, domain_id, project_id, trust):
+        """Returns the scope the roles of the token are granted in."""
+        if CONF.trust.enabled and trust:
+            #trusts do not support domains yet
+            return self._get_scope(trust['trustor_user_id'],
+                                   project_id=trust['project_id'])
+        return self._get_scope(user_id, domain_id, project_id)
 
-    def _get_filtered_domain(self, domain_id):
-        domain_ref = self.identity_api.get_domain(self.context,
-                                                  domain_id)
+    def _get_filtered_domain(self, domain_id, scope=None):
+        if scope and domain_id in scope['domains']:
+            domain_ref = scope['domains'][domain_id]
+        else:
+            domain_ref = self.identity_api.get_domain(self.context,
+                                                      domain_id)
         return {'id': domain_ref['id'], 'name': domain_ref['name']}
 
-    def _populate_scope(self, token_data, domain_id, project_id):
+    def _populate_scope(self, token_data, user_id, domain_id, project_id,
+                        trust):
         if 'domain' in token_data or 'project' in token_data:
             return
 
+        if CONF.trust.enabled and trust:
+            user_id = trust['trustor_user_id']
         if domain_id:
-            token_data['domain'] = self._get_filtered_domain(domain_id)
+            scope = self._get_scope(user_id, domain_id=domain_id)
+            token_data['domain'] = self._get_filtered_domain(domain_id,
+                                                             scope)
         if project_id:
-            project_ref = self.identity_api.get_project(
-                self.context, project_id)
+            scope = self._get_scope(user_id, project_id=project_id)
+            project_ref = scope['project']
             filtered_project = {
                 'id': project_ref['id'],
                 'name': project_ref['name']}
             filtered_project['domain'] = self._get_filtered_domain(
-                project_ref['domain_id'])
+                project_ref['domain_id'], scope)
             token_data['project'] = filtered_project
 
-    def _get_project_roles_for_user(self, user_id, project_id):
-        roles = self.identity_api.get_roles_for_user_and_project(
-            self.context, user_id, project_id)
-        roles_ref = []
-        for role_id in roles:
-            role_ref = self.identity_api.get_role(self.context, role_id)
-            role_ref.setdefault('project_id', project_id)
-            roles_ref.append(role_ref)
-        # user have no project roles, therefore access denied
-        if len(roles_ref) == 0:
-            msg = _('User have no access to project')
-            LOG.debug(msg)
-            raise exception.Unauthorized(msg)
-        return roles_ref
-
-    def _get_domain_roles_for_user(self, user_id, domain_id):
-        roles = self.identity_api.get_roles_for_user_and_domain(
-            self.context, user_id, domain_id)
-        roles_ref = []
-        for role_id in roles:
-            role_ref = self.identity_api.get_role(self.context, role_id)
-            role_ref.setdefault('domain_id', domain_id)
-            roles_ref.append(role_ref)
-        # user have no domain roles, therefore access denied
+    def _get_roles_for_user(self, scope):
+        roles_ref = self.identity_api.get_roles(self.context, scope['roles'])
+        for role_ref in roles_ref:
+            if scope['project']:
+                role_ref.setdefault('project_id', scope['project']['id'])
+            else:
+                role_ref.setdefault('domain_id', scope['domain']['id'])
+        # user have no project or domain roles, therefore access denied
         if len(roles_ref) == 0:
-            msg = _('User have no access to domain')
+            if scope['project']:
+                msg = _('User have no access to project')
+            else:
+                msg = _('User have no access to domain')
             LOG.debug(msg)
             raise exception.Unauthorized(msg)
         return roles_ref
 
-    def _get_roles_for_user(self, user_id, domain_id, project_id):
-        roles = []
-        if domain_id:
-            roles = self._get_domain_roles_for_user(user_id, domain_id)
-        if project_id:
-            roles = self._get_project_roles_for_user(user_id, project_id)
-        return roles
-
     def _populate_user(self, token_data, user_id, domain_id, project_id,
                        trust):
         if 'user' in token_data:
             return
 
-        user_ref = self.identity_api.get_user(self.context,
-                                              user_id)
         if CONF.trust.enabled and trust:
-            trustor_user_ref = (self.identity_api.get_user(self.context,
-                                trust['trustor_user_id']))
+            scope = self._get_token_scope(user_id, domain_id, project_id,
+                                          trust)
+            trustor_user_ref = scope['user']
             if not trustor_user_ref['enabled']:
                 raise exception.Forbidden()
             if trust['impersonation']:
                 user_ref = trustor_user_ref
+            else:
+                scope = self._get_scope(user_id)
+                user_ref = scope['user']
             token_data['OS-TRUST:trust'] = (
                 {
                     'id': trust['id'],
@@ -127,10 +134,14 @@ class TokenDataHelper(object):
                     'trustee_user': {'id': trust['trustee_user_id']},
                     'impersonation': trust['impersonation']
                 })
+        else:
+            scope = self._get_scope(user_id, domain_id, project_id)
+            user_ref = scope['user']
         filtered_user = {
             'id': user_ref['id'],
             'name': user_ref['name'],
-            'domain': self._get_filtered_domain(user_ref['domain_id'])}
+            'domain': self._get_filtered_domain(user_ref['domain_id'],
+                                                scope)}
         token_data['user'] = filtered_user
 
     def _populate_roles(self, token_data, user_id, domain_id, project_id,
@@ -138,20 +149,9 @@ class TokenDataHelper(object):
         if 'roles' in token_data:
             return
 
-        if CONF.trust.enabled and trust:
-            token_user_id = trust['trustor_user_id']
-            token_project_id = trust['project_id']
-            #trusts do not support domains yet
-            token_domain_id = None
-        else:
-            token_user_id = user_id
-            token_project_id = project_id
-            token_domain_id = domain_id
-
-        if token_domain_id or token_project_id:
-            roles = self._get_roles_for_user(token_user_id,
-                                             token_domain_id,
-                                             token_project_id)
+        scope = self._get_token_scope(user_id, domain_id, project_id, trust)
+        if scope['domain'] or scope['project']:
+            roles = self._get_roles_for_user(scope)
             filtered_roles = []
             if CONF.trust.enabled and trust:
                 for trust_role in trust['roles']:
@@ -208,7 +208,8 @@ class TokenDataHelper(object):
             if user_id != trust['trustee_user_id']:
                 raise exception.Forbidden()
 
-        self._populate_scope(token_data, domain_id, project_id)
+        self._populate_scope(token_data, user_id, domain_id, project_id,
+                             trust)
         self._populate_user(token_data, user_id, domain_id, project_id, trust)
         self._populate_roles(token_data, user_id, domain_id, project_id, trust)
         self._populate_service_catalog(token_data, user_id, domain_id,
@@ -289,6 +290,27 @@ def recreate_token_data(context, token_data=None, expires=None,
                                             token=token)
 
 
+def _token_ref_data(token_id, token_data, trust):
+    """Return the token reference stored for v3 token data."""
+    expiry = token_data['token']['expires_at']
+    if isinstance(expiry, basestring):
+        expiry = timeutils.normalize_time(timeutils.parse_isotime(expiry))
+    role_ids = []
+    if 'project' in token_data['token']:
+        # project-scoped token, fill in the v2 token data
+        # all we care are the role IDs
+        role_ids = [role['id'] for role in token_data['token']['roles']]
+    metadata_ref = {'roles': role_ids}
+    return dict(key=token_id,
+                id=token_id,
+                expires=expiry,
+                user=token_data['token']['user'],
+                tenant=token_data['token'].get('project'),
+                metadata=metadata_ref,
+                token_data=token_data,
+                trust_id=trust['id'] if trust else None)
+
+
 def create_token(context, auth_context, auth_info):
     token_data_helper = TokenDataHelper(context)
     (domain_id, project_id, trust) = auth_info.get_scope()
@@ -313,30 +335,24 @@ def create_token(context, auth_context, auth_info):
         except subprocess.CalledProcessError:
             raise exception.UnexpectedError(_(
                 'Unable to sign token.'))
+    elif CONF.signing.token_format == 'COMPACT':
+        # compact tokens are not stored
+        data = _token_ref_data(None, token_data, trust)
+        # compact tokens expire on the second
+        data['expires'] = data['expires'].replace(microsecond=0)
+        token_data['token']['expires_at'] = timeutils.isotime(
+            data['expires'], subsecond=True)
+        token_api = token_module.Manager()
+        token_id = token_api.create_compact_token(context, data)
+        return (token_id, token_data)
     else:
         raise exception.UnexpectedError(_(
             'Invalid value for token_format: %s.'
-            '  Allowed values are PKI or UUID.') %
+            '  Allowed values are PKI, UUID or COMPACT.') %
             CONF.signing.token_format)
     token_api = token_module.Manager()
     try:
-        expiry = token_data['token']['expires_at']
-        if isinstance(expiry, basestring):
-            expiry = timeutils.normalize_time(timeutils.parse_isotime(expiry))
-        role_ids = []
-        if 'project' in token_data['token']:
-            # project-scoped token, fill in the v2 token data
-            # all we care are the role IDs
-            role_ids = [role['id'] for role in token_data['token']['roles']]
-        metadata_ref = {'roles': role_ids}
-        data = dict(key=token_id,
-                    id=token_id,
-                    expires=expiry,
-                    user=token_data['token']['user'],
-                    tenant=token_data['token'].get('project'),
-                    metadata=metadata_ref,
-                    token_data=token_data,
-                    trust_id=trust['id'] if trust else None)
+        data = _token_ref_data(token_id, token_data, trust)
         token_api.create_token(context, token_id, data)
     except Exception as e:
         # an identical token may have been created already.
@@ -1,9 +1,20 @@
+import ctypes
+import ctypes.util
+import gettext
 import hashlib
+import os
+import sys
+import threading
 
+from keystone.common import config
 from keystone.common import logging
+from keystone.common import metrics
+from keystone.common import worker_pool
 
 
 subprocess = None
+libcrypto = None
+_signers = {}
 LOG = logging.getLogger(__name__)
 PKI_ANS1_PREFIX = 'MII'
 
@@ -112,32 +123,288 @@ def is_ans1_token(token):
     return token[:3] == PKI_ANS1_PREFIX
 
 
+class SubprocessSigner(object):
+    """Signs documents by running ``openssl cms -sign`` for each one."""
+
+    def __init__(self, signing_cert_file_name, signing_key_file_name):
+        self.signing_cert_file_name = signing_cert_file_name
+        self.signing_key_file_name = signing_key_file_name
+
+    def sign(self, text):
+        _ensure_subprocess()
+        process = subprocess.Popen(["openssl", "cms", "-sign",
+                                    "-signer", self.signing_cert_file_name,
+                                    "-inkey", self.signing_key_file_name,
+                                    "-outform", "PEM",
+                                    "-nosmimecap", "-nodetach",
+                                    "-nocerts", "-noattr"],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        output, err = process.communicate(text)
+        retcode = process.poll()
+        if retcode or "Error" in err:
+            if retcode == 3:
+                LOG.error(_("Signing error: Unable to load certificate - "
+                          "ensure you've configured PKI with "
+                          "'keystone-manage pki_setup'"))
+            else:
+                LOG.error(_('Signing error: %s') % err)
+            raise subprocess.CalledProcessError(retcode, "openssl")
+        return output
+
+
+def _load_libcrypto():
+    """Load libcrypto and declare the prototypes used for signing.
+
+    :returns: the loaded library, or None if it is unavailable
+
+    """
+    global libcrypto
+    if libcrypto is not None:
+        return libcrypto or None
+
+    libcrypto = False
+    path = ctypes.util.find_library('crypto')
+    if not path:
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+        c_void_p = ctypes.c_void_p
+        prototypes = {
+            'BIO_new_mem_buf': (c_void_p, [ctypes.c_char_p, ctypes.c_int]),
+            'BIO_s_mem': (c_void_p, []),
+            'BIO_new': (c_void_p, [c_void_p]),
+            'BIO_free': (ctypes.c_int, [c_void_p]),
+            'BIO_ctrl': (ctypes.c_long,
+                         [c_void_p, ctypes.c_int, ctypes.c_long, c_void_p]),
+            'PEM_read_bio_X509': (c_void_p,
+                                  [c_void_p, c_void_p, c_void_p, c_void_p]),
+            'PEM_read_bio_PrivateKey': (c_void_p, [c_void_p, c_void_p,
+                                                   c_void_p, c_void_p]),
+            'X509_free': (None, [c_void_p]),
+            'EVP_PKEY_free': (None, [c_void_p]),
+            'CMS_sign': (c_void_p, [c_void_p, c_void_p, c_void_p, c_void_p,
+                                    ctypes.c_uint]),
+            'PEM_write_bio_CMS_stream': (ctypes.c_int, [c_void_p, c_void_p,
+                                                        c_void_p,
+                                                        ctypes.c_int]),
+            'CMS_ContentInfo_free': (None, [c_void_p]),
+            'ERR_get_error': (ctypes.c_ulong, []),
+            'ERR_error_string_n': (None, [ctypes.c_ulong, ctypes.c_char_p,
+                                          ctypes.c_size_t]),
+        }
+        for name, (restype, argtypes) in prototypes.iteritems():
+            func = getattr(lib, name)
+            func.restype = restype
+            func.argtypes = argtypes
+    except (OSError, AttributeError) as e:
+        LOG.warning(_('Unable to load libcrypto for in-process signing: %s'),
+                    e)
+        return None
+    libcrypto = lib
+    return libcrypto
+
+
+class LibcryptoSigner(object):
+    """Signs documents in process through libcrypto.
+
+    The signing certificate and key are parsed once and only reloaded when
+    either file changes on disk. The output is byte-identical to that of
+    ``SubprocessSigner``, since the same CMS flags are used and neither RSA
+    PKCS#1 v1.5 signatures nor attribute-less SignedData carry any
+    randomness.
+
+    """
+
+    # CMS_NOCERTS | CMS_NOATTR | CMS_NOSMIMECAP, the library equivalent of
+    # "-nocerts -noattr -nosmimecap"
+    CMS_FLAGS = 0x2 | 0x100 | 0x200
+    BIO_CTRL_INFO = 3
+
+    def __init__(self, signing_cert_file_name, signing_key_file_name):
+        self.signing_cert_file_name = signing_cert_file_name
+        self.signing_key_file_name = signing_key_file_name
+        self._cert = None
+        self._key = None
+        self._mtimes = None
+        self._lock = threading.Lock()
+        self._lib = _load_libcrypto()
+        if self._lib is None:
+            raise OSError(_('libcrypto is not available'))
+
+    def __del__(self):
+        self._free_credentials()
+
+    def _free_credentials(self):
+        if self._lib is None:
+            return
+        if self._cert:
+            self._lib.X509_free(self._cert)
+            self._cert = None
+        if self._key:
+            self._lib.EVP_PKEY_free(self._key)
+            self._key = None
+
+    def _read_pem(self, file_name, reader):
+        with open(file_name) as pem_file:
+            data = pem_file.read()
+        bio = self._lib.BIO_new_mem_buf(data, len(data))
+        try:
+            return reader(bio, None, None, None)
+        finally:
+            self._lib.BIO_free(bio)
+
+    def _load_credentials(self):
+        try:
+            mtimes = (os.path.getmtime(self.signing_cert_file_name),
+                      os.path.getmtime(self.signing_key_file_name))
+            if mtimes == self._mtimes:
+                return
+            self._free_credentials()
+            self._cert = self._read_pem(self.signing_cert_file_name,
+                                        self._lib.PEM_read_bio_X509)
+            self._key = self._read_pem(self.signing_key_file_name,
+                                       self._lib.PEM_read_bio_PrivateKey)
+        except (IOError, OSError):
+            self._cert = self._key = None
+        if not self._cert or not self._key:
+            self._free_credentials()
+            self._mtimes = None
+            LOG.error(_("Signing error: Unable to load certificate - "
+                      "ensure you've configured PKI with "
+                      "'keystone-manage pki_setup'"))
+            raise subprocess.CalledProcessError(3, "openssl")
+        self._mtimes = mtimes
+
+    def _last_error(self):
+        buf = ctypes.create_string_buffer(256)
+        self._lib.ERR_error_string_n(self._lib.ERR_get_error(), buf, len(buf))
+        return buf.value
+
+    def sign(self, text):
+        _ensure_subprocess()
+        lib = self._lib
+        with self._lock:
+            self._load_credentials()
+            in_bio = lib.BIO_new_mem_buf(text, len(text))
+            out_bio = lib.BIO_new(lib.BIO_s_mem())
+            cms = None
+            try:
+                cms = lib.CMS_sign(self._cert, self._key, None, in_bio,
+                                   self.CMS_FLAGS)
+                if (not cms or
+                        lib.PEM_write_bio_CMS_stream(out_bio, cms, in_bio,
+                                                     self.CMS_FLAGS) != 1):
+                    LOG.error(_('Signing error: %s') % self._last_error())
+                    raise subprocess.CalledProcessError(1, "libcrypto")
+                data = ctypes.c_char_p()
+                length = lib.BIO_ctrl(out_bio, self.BIO_CTRL_INFO, 0,
+                                      ctypes.byref(data))
+                return ctypes.string_at(data, length)
+            finally:
+                if cms:
+                    lib.CMS_ContentInfo_free(cms)
+                lib.BIO_free(out_bio)
+                lib.BIO_free(in_bio)
+
+
+class PoolSigner(object):
+    """Signs documents through a pool of long-lived worker processes.
+
+    Each worker loads the certificate and key once and signs in process when
+    libcrypto is available, so no process is forked per token. Pool size,
+    the number of requests allowed to wait for a worker and the per-request
+    timeout come from the ``[signing]`` section; queue wait and signing
+    latency are recorded under the ``signing`` metrics collector.
+
+    """
+
+    def __init__(self, signing_cert_file_name, signing_key_file_name):
+        _ensure_subprocess()
+        self.signing_cert_file_name = signing_cert_file_name
+        self.signing_key_file_name = signing_key_file_name
+        self.timeout = config.CONF.signing.worker_timeout
+        self.stats = metrics.collector('signing')
+        try:
+            self._pool = worker_pool.WorkerPool(
+                config.CONF.signing.worker_pool_size, __name__,
+                [signing_cert_file_name, signing_key_file_name],
+                _('Signing worker'), self.stats,
+                queue_depth=config.CONF.signing.worker_queue_depth)
+        except OSError as e:
+            raise OSError(_('Unable to start signing worker: %s') % e)
+
+    def sign(self, text):
+        try:
+            status, output = self._pool.call('sign', text, self.timeout)
+        except (worker_pool.PoolBusy, worker_pool.WorkerError) as e:
+            LOG.error(_('Signing error: %s') % e)
+            raise subprocess.CalledProcessError(1, "openssl")
+        if status != '0':
+            LOG.error(_('Signing error: %s') % output)
+            raise subprocess.CalledProcessError(1, "openssl")
+        self.stats.incr('signed')
+        return output
+
+    def close(self):
+        self._pool.close()
+
+
+def _worker_main(argv):
+    """Serve signing requests from a parent PoolSigner until stdin closes."""
+    gettext.install('keystone', unicode=1)
+    signing_cert_file_name, signing_key_file_name = argv[1:3]
+    try:
+        signer = LibcryptoSigner(signing_cert_file_name,
+                                 signing_key_file_name)
+    except OSError:
+        signer = SubprocessSigner(signing_cert_file_name,
+                                  signing_key_file_name)
+    worker_pool.serve(signer.sign)
+
+
+SIGNERS = {'subprocess': SubprocessSigner,
+           'libcrypto': LibcryptoSigner,
+           'pool': PoolSigner}
+
+
+def get_signer(signing_cert_file_name, signing_key_file_name, backend=None):
+    """Return a signer for the given certificate and key.
+
+    Signers are cached per backend, certificate and key, so an in-process
+    signer only parses its credentials once. If the configured backend
+    cannot be loaded, this falls back to forking ``openssl``.
+
+    """
+    backend = backend or config.CONF.signing.signer
+    key = (backend, signing_cert_file_name, signing_key_file_name)
+    signer = _signers.get(key)
+    if signer is None:
+        try:
+            signer = SIGNERS[backend](signing_cert_file_name,
+                                      signing_key_file_name)
+        except KeyError:
+            LOG.error(_('Unknown signer %s, falling back to subprocess'),
+                      backend)
+        except OSError as e:
+            LOG.warning(_('Unable to use %(backend)s signer, falling back '
+                          'to subprocess: %(error)s'),
+                        {'backend': backend, 'error': e})
+        if signer is None:
+            signer = SubprocessSigner(signing_cert_file_name,
+                                      signing_key_file_name)
+        _signers[key] = signer
+    return signer
+
+
 def cms_sign_text(text, signing_cert_file_name, signing_key_file_name):
     """Uses OpenSSL to sign a document
     Produces a Base64 encoding of a DER formatted CMS Document
     http://en.wikipedia.org/wiki/Cryptographic_Message_Syntax
     """
-    _ensure_subprocess()
-    process = subprocess.Popen(["openssl", "cms", "-sign",
-                                "-signer", signing_cert_file_name,
-                                "-inkey", signing_key_file_name,
-                                "-outform", "PEM",
-                                "-nosmimecap", "-nodetach",
-                                "-nocerts", "-noattr"],
-                               stdin=subprocess.PIPE,
-                               stdout=subprocess.PIPE,
-                               stderr=subprocess.PIPE)
-    output, err = process.communicate(text)
-    retcode = process.poll()
-    if retcode or "Error" in err:
-        if retcode == 3:
-            LOG.error(_("Signing error: Unable to load certificate - "
-                      "ensure you've configured PKI with "
-                      "'keystone-manage pki_setup'"))
-        else:
-            LOG.error(_('Signing error: %s') % err)
-        raise subprocess.CalledProcessError(retcode, "openssl")
-    return output
+    signer = get_signer(signing_cert_file_name, signing_key_file_name)
+    return signer.sign(text)
 
 
 def cms_sign_token(text, signing_cert_file_name, signing_key_file_name):
@@ -172,3 +439,7 @@ def cms_hash_token(token_id):
         return hasher.hexdigest()
     else:
         return token_id
+
+
+if __name__ == '__main__':
+    _worker_main(sys.argv)
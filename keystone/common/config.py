@@ -175,6 +175,12 @@ def register_cli_int(*args, **kw):
     return conf.register_cli_opt(cfg.IntOpt(*args, **kw), group=group)
 
 
+def register_float(*args, **kw):
+    conf = kw.pop('conf', CONF)
+    group = kw.pop('group', None)
+    return conf.register_opt(cfg.FloatOpt(*args, **kw), group=group)
+
+
 def configure():
     CONF.register_cli_opts(COMMON_CLI_OPTS)
     CONF.register_cli_opts(LOGGING_CLI_OPTS)
@@ -231,6 +237,11 @@ def configure():
     # signing
     register_str(
         'token_format', group='signing', default="PKI")
+    register_list('compact_keys', group='signing', default=[])
+    register_str('signer', group='signing', default='libcrypto')
+    register_int('worker_pool_size', group='signing', default=4)
+    register_int('worker_queue_depth', group='signing', default=128)
+    register_int('worker_timeout', group='signing', default=10)
     register_str(
         'certfile',
         group='signing',
@@ -251,6 +262,12 @@ def configure():
     register_str('cert_subject', group='signing',
                  default='/C=US/ST=Unset/L=Unset/O=Unset/CN=www.example.com')
 
+    # memcache
+    register_int('pool_maxsize', group='memcache', default=10)
+    register_int('pool_connection_get_timeout', group='memcache', default=10)
+    register_int('socket_timeout', group='memcache', default=3)
+    register_int('dead_retry', group='memcache', default=300)
+
     # sql
     register_str('connection', group='sql', secret=True,
                  default='sqlite:///keystone.db')
@@ -60,9 +60,9 @@ def _build_policy_check_credentials(self, action, context, kwargs):
             creds['project_id'] = token_ref['tenant'].get('id')
         except AttributeError:
             LOG.debug(_('RBAC: Proceeding without tenant'))
-        # NOTE(vish): this is pretty inefficient
-        creds['roles'] = [self.identity_api.get_role(context, role)['name']
-                          for role in creds.get('roles', [])]
+        creds['roles'] = [role['name']
+                          for role in self.identity_api.get_roles(
+                              context, creds.get('roles', []))]
 
     return creds
 
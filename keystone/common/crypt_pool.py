@@ -0,0 +1,172 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Password hashing in a pool of worker processes.
+
+Hashing or checking a sha512_crypt password takes tens of milliseconds of
+CPU, during which an eventlet hub runs nothing else, so it is handed to a
+:class:`keystone.common.worker_pool.WorkerPool`. Requests are a JSON list
+of the operation and its arguments; replies are the JSON result or, on
+failure, the exception class name and message.
+
+"""
+
+import gettext
+import json
+import threading
+
+import passlib.hash
+
+from keystone.common import config
+from keystone.common import logging
+from keystone.common import metrics
+from keystone.common import worker_pool
+from keystone import exception
+
+
+CONF = config.CONF
+config.register_int('crypt_workers', default=0)
+config.register_int('crypt_worker_timeout', default=10)
+
+LOG = logging.getLogger(__name__)
+
+# exceptions raised by the operations that callers expect to see as such
+_RERAISED = {'TypeError': TypeError, 'ValueError': ValueError}
+
+
+def _hash(password, rounds):
+    return passlib.hash.sha512_crypt.encrypt(password, rounds=rounds)
+
+
+def _check(password, hashed):
+    return passlib.hash.sha512_crypt.verify(password, hashed)
+
+
+def _ldap_hash(password):
+    return passlib.hash.ldap_salted_sha1.encrypt(password)
+
+
+def _ldap_check(password, hashed):
+    return passlib.hash.ldap_salted_sha1.verify(password, hashed)
+
+
+OPERATIONS = {'hash': _hash,
+              'check': _check,
+              'ldap_hash': _ldap_hash,
+              'ldap_check': _ldap_check}
+
+
+class CryptPool(object):
+    """Runs password hashing operations in a pool of worker processes.
+
+    Pool size and the time a request may take, waiting for a worker
+    included, come from ``crypt_workers`` and ``crypt_worker_timeout``;
+    queue wait and hashing latency are recorded under the ``crypt`` metrics
+    collector.
+
+    """
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.stats = metrics.collector('crypt')
+        try:
+            self._pool = worker_pool.WorkerPool(
+                size, __name__, [], _('Password hashing worker'),
+                self.stats)
+        except OSError as e:
+            raise exception.UnexpectedError(
+                _('Unable to start password hashing worker: %s') % e)
+
+    def call(self, operation, *args):
+        request = json.dumps([operation] + list(args))
+        try:
+            status, reply = self._pool.call(operation, request, self.timeout)
+        except worker_pool.PoolBusy:
+            raise exception.UnexpectedError(
+                _('Timed out waiting for a password hashing worker'))
+        except worker_pool.WorkerError as e:
+            LOG.error(_('Password hashing error: %s') % e)
+            raise exception.UnexpectedError(
+                _('Password hashing worker failed'))
+        except OSError as e:
+            raise exception.UnexpectedError(
+                _('Unable to start password hashing worker: %s') % e)
+        result = json.loads(reply)
+        if status != '0':
+            error, message = result
+            raise _RERAISED.get(error, exception.UnexpectedError)(message)
+        return result
+
+    def close(self):
+        self._pool.close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, or None to hash in process."""
+    global _pool
+    with _pool_lock:
+        size, timeout = CONF.crypt_workers, CONF.crypt_worker_timeout
+        if _pool is not None and (_pool.size, _pool.timeout) != (size,
+                                                                 timeout):
+            _pool.close()
+            _pool = None
+        if _pool is None and size > 0:
+            _pool = CryptPool(size, timeout)
+        return _pool
+
+
+def run(operation, *args):
+    """Run one of the OPERATIONS, in a worker process if there are any.
+
+    :param args: the byte string arguments of the operation
+
+    """
+    pool = get_pool()
+    if pool is None:
+        return OPERATIONS[operation](*args)
+    # JSON carries text; the worker encodes it back to UTF-8
+    args = [arg.decode('utf-8') if isinstance(arg, str) else arg
+            for arg in args]
+    result = pool.call(operation, *args)
+    if isinstance(result, unicode):
+        result = result.encode('utf-8')
+    return result
+
+
+def _handle(request):
+    request = json.loads(request)
+    args = [arg.encode('utf-8') if isinstance(arg, unicode) else arg
+            for arg in request[1:]]
+    return json.dumps(OPERATIONS[request[0]](*args))
+
+
+def _describe_error(e):
+    return json.dumps([type(e).__name__, str(e)])
+
+
+def _worker_main():
+    """Serve hashing requests from a parent CryptPool until stdin closes."""
+    gettext.install('keystone', unicode=1)
+    worker_pool.serve(_handle, _describe_error)
+
+
+if __name__ == '__main__':
+    _worker_main()
@@ -14,13 +14,20 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+from keystone.common import utils
 from keystone import exception
 
 
+# values that can be shared instead of copied
+_IMMUTABLE = (utils.FrozenDict, utils.FrozenList)
+
+
 class DictKvs(dict):
     def get(self, key, default=None):
         try:
-            if isinstance(self[key], dict):
+            if isinstance(self[key], _IMMUTABLE):
+                return self[key]
+            elif isinstance(self[key], dict):
                 return self[key].copy()
             else:
                 return self[key][:]
@@ -30,7 +37,9 @@ class DictKvs(dict):
             raise exception.NotFound(target=key)
 
     def set(self, key, value):
-        if isinstance(value, dict):
+        if isinstance(value, _IMMUTABLE):
+            self[key] = value
+        elif isinstance(value, dict):
             self[key] = value.copy()
         else:
             self[key] = value[:]
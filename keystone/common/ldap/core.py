@@ -367,6 +367,17 @@ class BaseLdap(object):
         return [self._ldap_res_to_model(x)
                 for x in self._ldap_get_all(filter)]
 
+    def get_all_by_ids(self, ids):
+        """Return the objects with any of the given ids in one search."""
+        if not ids:
+            return []
+        query = '%s(|%s)' % (
+            self.filter or '',
+            ''.join('(%s=%s)' % (self.id_attr,
+                                 ldap_filter.escape_filter_chars(str(x)))
+                    for x in set(ids)))
+        return self.get_all(query)
+
     def update(self, id, values, old_obj=None):
         if not self.allow_update:
             action = _('LDAP %s update') % self.options_name
@@ -14,11 +14,41 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import copy
 import functools
 
+from keystone.common import metrics
 from keystone.openstack.common import importutils
 
 
+# driver methods with these prefixes only read, all others may write
+READ_PREFIXES = ('get_', 'list_', 'check_', 'resolve_')
+
+# where the reads of a request are remembered in its context
+_REQUEST_CACHE_KEY = 'request_cache'
+
+
+def invalidate_request_cache(context):
+    """Forget the driver reads remembered for a request."""
+    if isinstance(context, dict):
+        context.pop(_REQUEST_CACHE_KEY, None)
+
+
+def invalidates_request_cache(f):
+    """Mark a Manager method that writes to its driver without forwarding.
+
+    Methods forwarded to the driver invalidate the request cache on their
+    own; methods a Manager defines itself need this decorator if they
+    change what the driver would return.
+
+    """
+    @functools.wraps(f)
+    def wrapper(self, context, *args, **kw):
+        invalidate_request_cache(context)
+        return f(self, context, *args, **kw)
+    return wrapper
+
+
 class Manager(object):
     """Base class for intermediary request layer.
 
@@ -30,8 +60,17 @@ class Manager(object):
 
     An example of a probable use case is logging all the calls.
 
+    Managers that list driver reads in ``request_cache`` remember what those
+    return for the rest of the request, in its context, and forget it all on
+    any forwarded call that is not a read (see ``READ_PREFIXES``). Each hit
+    costs a deep copy, as does each miss, so only small refs that a request
+    looks up repeatedly are worth listing. Hits and misses are recorded
+    under the ``request_cache`` metrics collector.
+
     """
 
+    request_cache = ()
+
     def __init__(self, driver_name):
         self.driver = importutils.import_object(driver_name)
 
@@ -42,8 +81,43 @@ class Manager(object):
         #               logging and whatnot in this class
         f = getattr(self.driver, name)
 
-        @functools.wraps(f)
-        def _wrapper(context, *args, **kw):
-            return f(*args, **kw)
+        if not self.request_cache:
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return f(*args, **kw)
+        elif name in self.request_cache:
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return self._cached_read(context, f, args, kw)
+        elif name.startswith(READ_PREFIXES):
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                return f(*args, **kw)
+        else:
+            @functools.wraps(f)
+            def _wrapper(context, *args, **kw):
+                invalidate_request_cache(context)
+                return f(*args, **kw)
         setattr(self, name, _wrapper)
         return _wrapper
+
+    def _cached_read(self, context, f, args, kw):
+        key = (self.__module__, f.__name__, args, tuple(sorted(kw.items())))
+        try:
+            hash(key)
+        except TypeError:
+            key = None
+        if key is None or not isinstance(context, dict):
+            return f(*args, **kw)
+
+        cache = context.setdefault(_REQUEST_CACHE_KEY, {})
+        stats = metrics.collector('request_cache')
+        if key in cache:
+            stats.incr('hits')
+            # callers are free to change what they are given
+            return copy.deepcopy(cache[key])
+        stats.incr('misses')
+        result = f(*args, **kw)
+        cache = context.setdefault(_REQUEST_CACHE_KEY, {})
+        cache[key] = copy.deepcopy(result)
+        return result
@@ -0,0 +1,176 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""A pool of memcache clients shared by the green threads of a process.
+
+``memcache.Client`` keeps its sockets in thread local storage, so a single
+client used by every green thread of ``keystone-all`` either opens
+connections per green thread or, without monkey patching, lets requests
+interleave on one socket. The pool hands each caller a client of its own
+for the duration of an operation.
+
+"""
+
+from __future__ import absolute_import
+import contextlib
+import Queue
+import threading
+import time
+
+import memcache
+
+from keystone.common import logging
+from keystone.common import metrics
+from keystone.common import worker_pool
+from keystone import config
+from keystone import exception
+
+
+CONF = config.CONF
+LOG = logging.getLogger(__name__)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class _MemcacheClient(memcache.Client):
+    """A memcache client that is not bound to the thread that created it.
+
+    ``memcache.Client`` derives from ``threading.local``; restoring the
+    plain object attribute access lets a pooled client move between
+    threads with its connections intact.
+
+    """
+    __delattr__ = object.__delattr__
+    __getattribute__ = object.__getattribute__
+    __new__ = object.__new__
+    __setattr__ = object.__setattr__
+
+    def __del__(self):
+        pass
+
+
+class ClientPool(object):
+    """A bounded pool of memcache clients for one set of servers.
+
+    Clients are created on demand, up to ``[memcache] pool_maxsize``; a
+    caller finding none free waits up to ``[memcache]
+    pool_connection_get_timeout`` seconds. Servers that fail are skipped
+    for ``[memcache] dead_retry`` seconds and every socket operation,
+    including connecting, is bounded by ``[memcache] socket_timeout``.
+    Checkout waits and failures are recorded under the ``memcache`` metrics
+    collector. Under eventlet a caller waiting for a client waits on a green
+    queue, so other green threads run meanwhile.
+
+    Any ``memcache.Client`` method can be called on the pool itself and
+    runs on a client checked out for that call; use :meth:`acquire` for
+    sequences, such as gets and cas, that need the same client.
+
+    """
+
+    def __init__(self, servers, cache_cas=False):
+        self.servers = servers
+        self.cache_cas = cache_cas
+        self.maxsize = CONF.memcache.pool_maxsize
+        self.timeout = CONF.memcache.pool_connection_get_timeout
+        self.stats = metrics.collector('memcache')
+        self._lock = threading.Lock()
+        self._created = 0
+        # most recently used first, so idle clients keep warm connections
+        if worker_pool.is_green():
+            from eventlet import queue
+            self._idle = queue.LifoQueue()
+            self._empty = queue.Empty
+        else:
+            self._idle = Queue.LifoQueue()
+            self._empty = Queue.Empty
+
+    def _create(self):
+        self.stats.incr('connections_created')
+        return _MemcacheClient(self.servers,
+                               debug=0,
+                               cache_cas=self.cache_cas,
+                               socket_timeout=CONF.memcache.socket_timeout,
+                               dead_retry=CONF.memcache.dead_retry)
+
+    def _checkout(self):
+        start = time.time()
+        try:
+            client = self._idle.get_nowait()
+        except self._empty:
+            with self._lock:
+                create = self._created < self.maxsize
+                if create:
+                    self._created += 1
+            if create:
+                try:
+                    client = self._create()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                try:
+                    client = self._idle.get(timeout=self.timeout)
+                except self._empty:
+                    self.stats.incr('timeouts')
+                    msg = _('Timed out waiting for a memcache connection.')
+                    LOG.error(msg)
+                    raise exception.UnexpectedError(msg)
+        self.stats.timing('checkout_wait', time.time() - start)
+        return client
+
+    def _discard(self, client):
+        with self._lock:
+            self._created -= 1
+        try:
+            client.disconnect_all()
+        except Exception:
+            pass
+
+    @contextlib.contextmanager
+    def acquire(self):
+        """Check out a client for the duration of the block."""
+        client = self._checkout()
+        try:
+            yield client
+        except Exception:
+            # the client may be left mid-exchange with a server
+            self.stats.incr('errors')
+            self._discard(client)
+            raise
+        else:
+            if self.cache_cas:
+                client.reset_cas()
+            self._idle.put(client)
+
+    def __getattr__(self, name):
+        if not hasattr(memcache.Client, name) or name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            with self.acquire() as client:
+                return getattr(client, name)(*args, **kwargs)
+        return call
+
+
+def get_pool(servers, cache_cas=False):
+    """Return the process-wide client pool for the given servers."""
+    key = (tuple(servers), cache_cas)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ClientPool(list(servers), cache_cas=cache_cas)
+        return _pools[key]
@@ -0,0 +1,80 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""In-process counters and timings for keystone's internal subsystems.
+
+Collectors live for the lifetime of the process and are reported, together
+with the request statistics, by the ``OS-STATS`` extension.
+
+"""
+
+import threading
+
+
+COLLECTORS = {}
+_lock = threading.Lock()
+
+
+class Collector(object):
+    """Counters and timing summaries for a single subsystem."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {}
+            self.timings = {}
+
+    def incr(self, counter, value=1):
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def timing(self, timer, seconds):
+        """Record one observation, in seconds, of the named timer."""
+        with self._lock:
+            summary = self.timings.setdefault(
+                timer, {'count': 0, 'total': 0.0, 'max': 0.0})
+            summary['count'] += 1
+            summary['total'] += seconds
+            summary['max'] = max(summary['max'], seconds)
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            for timer, summary in self.timings.iteritems():
+                stats[timer] = dict(summary)
+                stats[timer]['avg'] = summary['total'] / summary['count']
+        return stats
+
+
+def collector(name):
+    """Return the process-wide collector for a subsystem, creating it."""
+    with _lock:
+        if name not in COLLECTORS:
+            COLLECTORS[name] = Collector(name)
+        return COLLECTORS[name]
+
+
+def get_stats():
+    return dict((name, c.get_stats()) for name, c in COLLECTORS.items())
+
+
+def reset_stats():
+    for c in COLLECTORS.values():
+        c.reset()
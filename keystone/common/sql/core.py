@@ -54,6 +54,9 @@ Text = sql.Text
 BigInt=sql.BIGINT
 Enum=sql.Enum
 UniqueConstraint = sql.UniqueConstraint
+or_ = sql.or_
+and_ = sql.and_
+aliased = sql.orm.aliased
 
 
 def initialize_decorator(init):
@@ -210,6 +213,24 @@ class MySQLPingListener(object):
                 raise
 
 
+def new_engine(connection):
+    """Return a new SQLAlchemy engine for the given database URL."""
+    connection_dict = sql.engine.url.make_url(connection)
+
+    engine_config = {
+        'convert_unicode': True,
+        'echo': CONF.debug and CONF.verbose,
+        'pool_recycle': CONF.sql.idle_timeout,
+    }
+
+    if 'sqlite' in connection_dict.drivername:
+        engine_config['poolclass'] = sqlalchemy.pool.StaticPool
+    elif 'mysql' in connection_dict.drivername:
+        engine_config['listeners'] = [MySQLPingListener()]
+
+    return sql.create_engine(connection, **engine_config)
+
+
 # Backends
 class Base(object):
     _engine = None
@@ -230,23 +251,7 @@ class Base(object):
         engine.
 
         """
-        def new_engine():
-            connection_dict = sql.engine.url.make_url(CONF.sql.connection)
-
-            engine_config = {
-                'convert_unicode': True,
-                'echo': CONF.debug and CONF.verbose,
-                'pool_recycle': CONF.sql.idle_timeout,
-            }
-
-            if 'sqlite' in connection_dict.drivername:
-                engine_config['poolclass'] = sqlalchemy.pool.StaticPool
-            elif 'mysql' in connection_dict.drivername:
-                engine_config['listeners'] = [MySQLPingListener()]
-
-            return sql.create_engine(CONF.sql.connection, **engine_config)
-
-        engine = get_global_engine() or new_engine()
+        engine = get_global_engine() or new_engine(CONF.sql.connection)
 
         # auto-build the db to support wsgi server w/ in-memory backend
         if allow_global_engine and CONF.sql.connection == 'sqlite://':
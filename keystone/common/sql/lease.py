@@ -0,0 +1,75 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Named leases held in a row of the ``lease`` table.
+
+A lease elects one process, among all those sharing the database, to do a
+piece of work such as flushing expired tokens. The holder renews the lease
+each time it does the work; if it stops doing so, the lease expires and
+another process takes it over.
+
+"""
+
+import datetime
+
+from keystone.common import sql
+from keystone.openstack.common import timeutils
+
+
+class LeaseModel(sql.ModelBase, sql.DictBase):
+    __tablename__ = 'lease'
+    attributes = ['name', 'holder', 'expires']
+    name = sql.Column(sql.String(64), primary_key=True)
+    holder = sql.Column(sql.String(255), nullable=False)
+    expires = sql.Column(sql.DateTime(), nullable=False)
+
+
+class Lease(sql.Base):
+    def acquire(self, name, holder, duration):
+        """Take or renew the named lease for ``duration`` seconds.
+
+        :returns: True if ``holder`` now holds the lease, False if another
+                  holder has it
+
+        """
+        now = timeutils.utcnow()
+        expires = now + datetime.timedelta(seconds=duration)
+        session = self.get_session()
+        with session.begin():
+            # a single conditional UPDATE, so two processes racing for an
+            # expired lease cannot both win it
+            query = session.query(LeaseModel)
+            query = query.filter_by(name=name)
+            query = query.filter(sql.or_(LeaseModel.holder == holder,
+                                         LeaseModel.expires < now))
+            if query.update({'holder': holder, 'expires': expires},
+                            synchronize_session=False):
+                return True
+        try:
+            with session.begin():
+                session.add(LeaseModel(name=name, holder=holder,
+                                       expires=expires))
+        except sql.IntegrityError:
+            return False
+        return True
+
+    def release(self, name, holder):
+        """Give up the named lease, if ``holder`` holds it."""
+        session = self.get_session()
+        with session.begin():
+            query = session.query(LeaseModel)
+            query = query.filter_by(name=name, holder=holder)
+            query.delete(synchronize_session=False)
@@ -0,0 +1,64 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import json
+
+import sqlalchemy as sql
+
+
+BATCH_SIZE = 1000
+
+
+def upgrade(migrate_engine):
+    meta = sql.MetaData()
+    meta.bind = migrate_engine
+    token = sql.Table('token', meta, autoload=True)
+    tenant_id = sql.Column('tenant_id', sql.String(64), nullable=True)
+    token.create_column(tenant_id)
+    idx = sql.Index('ix_token_tenant_id', token.c.tenant_id)
+    idx.create(migrate_engine)
+
+    # only tokens that can still be listed or revoked are filtered on the
+    # column; copy their tenant ids out of the extra blob in batches
+    now = datetime.datetime.utcnow()
+    last_id = ''
+    while True:
+        query = sql.select([token.c.id, token.c.valid, token.c.extra])
+        query = query.where(sql.and_(token.c.expires > now,
+                                     token.c.id > last_id))
+        rows = migrate_engine.execute(
+            query.order_by(token.c.id).limit(BATCH_SIZE)).fetchall()
+        for row in rows:
+            if not row.valid:
+                continue
+            tenant = json.loads(row.extra).get('tenant') or {}
+            if tenant.get('id'):
+                migrate_engine.execute(
+                    token.update().where(token.c.id == row.id).values(
+                        tenant_id=tenant['id']))
+        if len(rows) < BATCH_SIZE:
+            break
+        last_id = rows[-1].id
+
+
+def downgrade(migrate_engine):
+    meta = sql.MetaData()
+    meta.bind = migrate_engine
+    token = sql.Table('token', meta, autoload=True)
+    idx = sql.Index('ix_token_tenant_id', token.c.tenant_id)
+    idx.drop(migrate_engine)
+    token.drop_column('tenant_id')
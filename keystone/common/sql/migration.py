@@ -39,33 +39,36 @@ except ImportError:
         sys.exit('python-migrate is not installed. Exiting.')
 
 
-def db_sync(version=None):
+def db_sync(version=None, connection=None):
+    """Migrate a database, by default ``[sql] connection``."""
     if version is not None:
         try:
             version = int(version)
         except ValueError:
             raise Exception(_('version should be an integer'))
 
-    current_version = db_version()
+    connection = connection or CONF.sql.connection
+    current_version = db_version(connection)
     repo_path = _find_migrate_repo()
     if version is None or version > current_version:
-        return versioning_api.upgrade(CONF.sql.connection, repo_path, version)
+        return versioning_api.upgrade(connection, repo_path, version)
     else:
-        return versioning_api.downgrade(
-            CONF.sql.connection, repo_path, version)
+        return versioning_api.downgrade(connection, repo_path, version)
 
 
-def db_version():
+def db_version(connection=None):
+    connection = connection or CONF.sql.connection
     repo_path = _find_migrate_repo()
     try:
-        return versioning_api.db_version(CONF.sql.connection, repo_path)
+        return versioning_api.db_version(connection, repo_path)
     except versioning_exceptions.DatabaseNotControlledError:
-        return db_version_control(0)
+        return db_version_control(0, connection)
 
 
-def db_version_control(version=None):
+def db_version_control(version=None, connection=None):
+    connection = connection or CONF.sql.connection
     repo_path = _find_migrate_repo()
-    versioning_api.version_control(CONF.sql.connection, repo_path, version)
+    versioning_api.version_control(connection, repo_path, version)
     return version
 
 
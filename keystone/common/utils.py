@@ -18,6 +18,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
 import hashlib
 import json
 import os
@@ -27,8 +28,10 @@ import time
 import passlib.hash
 
 from keystone.common import config
+from keystone.common import crypt_pool
 from keystone.common import logging
 from keystone import exception
+from keystone.openstack.common import timeutils
 
 
 CONF = config.CONF
@@ -103,23 +106,20 @@ def hash_password(password):
     password_utf8 = trunc_password(password).encode('utf-8')
     if passlib.hash.sha512_crypt.identify(password_utf8):
         return password_utf8
-    h = passlib.hash.sha512_crypt.encrypt(password_utf8,
-                                          rounds=CONF.crypt_strength)
-    return h
+    return crypt_pool.run('hash', password_utf8, CONF.crypt_strength)
 
 
 def ldap_hash_password(password):
     """Hash a password. Hard."""
     password_utf8 = trunc_password(password).encode('utf-8')
-    h = passlib.hash.ldap_salted_sha1.encrypt(password_utf8)
-    return h
+    return crypt_pool.run('ldap_hash', password_utf8)
 
 
 def ldap_check_password(password, hashed):
     if password is None:
         return False
     password_utf8 = trunc_password(password).encode('utf-8')
-    return passlib.hash.ldap_salted_sha1.verify(password_utf8, hashed)
+    return crypt_pool.run('ldap_check', password_utf8, hashed)
 
 
 def check_password(password, hashed):
@@ -132,7 +132,7 @@ def check_password(password, hashed):
     if password is None:
         return False
     password_utf8 = trunc_password(password).encode('utf-8')
-    return passlib.hash.sha512_crypt.verify(password_utf8, hashed)
+    return crypt_pool.run('check', password_utf8, hashed)
 
 
 # From python 2.7
@@ -262,3 +262,166 @@ class LimitingReader(object):
         if self.bytes_read > self.limit:
             raise exception.RequestTooLarge()
         return result
+
+
+def _immutable(self, *args, **kwargs):
+    raise TypeError(_('%s object is immutable') % type(self).__name__)
+
+
+class FrozenDict(dict):
+    """A dict, with frozen contents, that raises TypeError on modification.
+
+    Being immutable, it can be handed out without being copied. Copies made
+    with ``copy()``, ``copy.copy`` or ``copy.deepcopy`` are ordinary,
+    modifiable dicts, and it pickles as one.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(FrozenDict, self).__init__(*args, **kwargs)
+        for key, value in self.iteritems():
+            dict.__setitem__(self, key, freeze(value))
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return dict((copy.deepcopy(k, memo), copy.deepcopy(v, memo))
+                    for k, v in self.iteritems())
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """A list, with frozen contents, that raises TypeError on modification.
+
+    See :class:`FrozenDict`.
+
+    """
+
+    def __init__(self, iterable=()):
+        super(FrozenList, self).__init__(freeze(x) for x in iterable)
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _immutable
+    __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        return [copy.deepcopy(x, memo) for x in self]
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(value):
+    """Return an immutable equivalent of nested dicts and lists."""
+    if isinstance(value, (FrozenDict, FrozenList)):
+        return value
+    if isinstance(value, dict):
+        return FrozenDict(value)
+    if isinstance(value, list):
+        return FrozenList(value)
+    return value
+
+
+class LRUCache(object):
+    """A mapping that keeps its keys in the order they were last used.
+
+    Entries may carry an expiry, past which ``get`` drops them; ``set`` can
+    bound the number of entries by evicting the least recently used. Unlike
+    ``collections.OrderedDict``, this is available on Python 2.6. It is not
+    thread-safe: callers serialize every call.
+
+    """
+
+    def __init__(self):
+        # a circular doubly linked list of [prev, next, key, expires, value]
+        # links, in order of use, and the links by key
+        self._root = []
+        self._links = {}
+        self.clear()
+
+    def __len__(self):
+        return len(self._links)
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        root = self._root
+        link[0] = root[0]
+        link[1] = root
+        root[0][1] = link
+        root[0] = link
+
+    def get(self, key, default=None):
+        """Return the value of an unexpired entry and mark it as used."""
+        link = self._links.get(key)
+        if link is None:
+            return default
+        if link[3] is not None and timeutils.utcnow() >= link[3]:
+            self.pop(key)
+            return default
+        self._unlink(link)
+        self._append(link)
+        return link[4]
+
+    def peek(self, key, default=None):
+        """Return the value of an entry, expired or not, leaving its place."""
+        link = self._links.get(key)
+        if link is None:
+            return default
+        return link[4]
+
+    def set(self, key, value, expires=None, size=None):
+        """Store a value as the most recently used entry.
+
+        :param expires: when the entry expires, or None
+        :param size: evict the least recently used entries beyond this many
+        :returns: the number of entries evicted
+
+        """
+        self.pop(key)
+        link = [None, None, key, expires, value]
+        self._append(link)
+        self._links[key] = link
+        evicted = 0
+        while size is not None and len(self._links) > size:
+            self.pop(self._root[1][2])
+            evicted += 1
+        return evicted
+
+    def pop(self, key, default=None):
+        link = self._links.pop(key, None)
+        if link is None:
+            return default
+        self._unlink(link)
+        return link[4]
+
+    def items(self, limit=None):
+        """Return (key, value) pairs, least recently used first.
+
+        Expired entries are included.
+
+        :param limit: return at most this many pairs
+
+        """
+        items = []
+        link = self._root[1]
+        while link is not self._root and (limit is None or
+                                          len(items) < limit):
+            items.append((link[2], link[4]))
+            link = link[1]
+        return items
+
+    def clear(self):
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None, None]
@@ -0,0 +1,234 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Pools of long-lived worker processes.
+
+CPU-bound work such as signing or password hashing holds the interpreter
+lock throughout, so an eventlet hub runs nothing else meanwhile, and a
+native thread would stall it just the same. Such work is instead handed
+to worker processes over pipes, and the calling green thread only waits on
+the pipe.
+
+Each worker runs a module with ``python -m``, whose main calls
+:func:`serve`. Requests are a 4 byte big-endian length followed by the
+request; replies are a status byte ('0' for success), a length and the
+reply or, on failure, the error.
+
+"""
+
+import os
+import Queue
+import select
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+_TOPDIR = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))
+
+
+def is_green():
+    """Whether the process runs under eventlet, as keystone-all does."""
+    if 'eventlet' not in sys.modules:
+        return False
+    from eventlet import patcher
+    return patcher.is_monkey_patched('socket')
+
+
+class WorkerError(Exception):
+    """A worker failed, or timed out, in the middle of a request."""
+
+
+class PoolBusy(Exception):
+    """No worker could be checked out for a request."""
+
+
+class Worker(object):
+    """A long-lived worker process talking length-prefixed frames."""
+
+    def __init__(self, module, args, name):
+        self.name = name
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [_TOPDIR] + filter(None, [env.get('PYTHONPATH')]))
+        self.process = subprocess.Popen([sys.executable, '-m', module] +
+                                        list(args),
+                                        stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE,
+                                        env=env,
+                                        close_fds=True)
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+        self.process.wait()
+
+    def _read(self, size, deadline, select):
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select([self.process.stdout], [], [],
+                                        remaining)[0]:
+            raise WorkerError(_('%s timed out') % self.name)
+        data = self.process.stdout.read(size)
+        if len(data) != size:
+            raise WorkerError(_('%s exited unexpectedly') % self.name)
+        return data
+
+    def call(self, request, deadline, select):
+        """Send a request and return the status and reply."""
+        try:
+            self.process.stdin.write(struct.pack('>I', len(request)) +
+                                     request)
+            self.process.stdin.flush()
+        except IOError as e:
+            raise WorkerError(e)
+        header = self._read(5, deadline, select)
+        (length,) = struct.unpack('>I', header[1:])
+        reply = self._read(length, deadline, select) if length else ''
+        return header[0], reply
+
+
+class WorkerPool(object):
+    """Hands requests to a fixed number of workers, one request each.
+
+    Dead workers are replaced when checked out, and workers that fail in
+    the middle of a request right away. Under eventlet the caller waits on
+    green select and queues, so other green threads run meanwhile. Queue
+    wait is timed, and timeouts, rejected requests, worker restarts and
+    errors counted, in the given metrics collector.
+
+    """
+
+    def __init__(self, size, module, args, name, stats, queue_depth=None):
+        """Start the workers.
+
+        :param module: the module each worker runs, with ``args``
+        :param name: what error messages call a worker
+        :param queue_depth: how many requests may wait for a worker, or
+                            None for no limit
+        :raises: OSError if a worker cannot be started
+
+        """
+        self.size = size
+        self.module = module
+        self.args = args
+        self.name = name
+        self.stats = stats
+        self.queue_depth = queue_depth
+        self._lock = threading.Lock()
+        self._waiting = 0
+        if is_green():
+            from eventlet.green import select as green_select
+            from eventlet import queue
+            self._select = green_select.select
+            self._idle = queue.Queue()
+            self._empty = queue.Empty
+        else:
+            self._select = select.select
+            self._idle = Queue.Queue()
+            self._empty = Queue.Empty
+        for i in range(size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return Worker(self.module, self.args, self.name)
+
+    def _replace(self, worker):
+        worker.kill()
+        return self._spawn()
+
+    def _checkout(self, deadline):
+        with self._lock:
+            if (self.queue_depth is not None and
+                    self._waiting >= self.queue_depth and
+                    self._idle.empty()):
+                self.stats.incr('rejected')
+                raise PoolBusy(_('%d requests already waiting for a worker')
+                               % self._waiting)
+            self._waiting += 1
+        try:
+            worker = self._idle.get(timeout=max(deadline - time.time(), 0))
+        except self._empty:
+            self.stats.incr('timeouts')
+            raise PoolBusy(_('Timed out waiting for a worker'))
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        if not worker.is_alive():
+            self.stats.incr('worker_restarts')
+            worker = self._replace(worker)
+        return worker
+
+    def call(self, operation, request, timeout):
+        """Hand a request to a worker and return the status and reply.
+
+        :param operation: the name the worker's latency is timed under
+        :param timeout: seconds the request may take, waiting for a worker
+                        included
+        :raises: PoolBusy if no worker is free in time, WorkerError if the
+                 worker fails, OSError if it cannot be replaced
+
+        """
+        start = time.time()
+        deadline = start + timeout
+        worker = self._checkout(deadline)
+        checked_out = time.time()
+        self.stats.timing('queue_wait', checked_out - start)
+        try:
+            status, reply = worker.call(request, deadline, self._select)
+        except BaseException as e:
+            exc_info = sys.exc_info()
+            if isinstance(e, WorkerError):
+                self.stats.incr('errors')
+            # anything else, such as a green thread timeout, may also leave
+            # the worker halfway through a frame
+            worker = self._replace(worker)
+            raise exc_info[0], exc_info[1], exc_info[2]
+        finally:
+            self._idle.put(worker)
+        self.stats.timing(operation, time.time() - checked_out)
+        return status, reply
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().kill()
+
+
+def serve(handle, describe_error=str):
+    """Answer the requests of a parent WorkerPool until stdin closes.
+
+    :param handle: returns the reply to a request
+    :param describe_error: returns the reply to an exception raised by
+                           ``handle``
+
+    """
+    stdin = os.fdopen(sys.stdin.fileno(), 'rb', 0)
+    stdout = os.fdopen(sys.stdout.fileno(), 'wb', 0)
+    while True:
+        header = stdin.read(4)
+        if len(header) != 4:
+            return
+        (length,) = struct.unpack('>I', header)
+        request = stdin.read(length)
+        try:
+            status, reply = '0', handle(request)
+        except Exception as e:
+            status, reply = '1', describe_error(e)
+        stdout.write(status + struct.pack('>I', len(reply)) + reply)
@@ -165,6 +165,7 @@ class Application(BaseApplication):
         context = req.environ.get(CONTEXT_ENV, {})
         context['query_string'] = dict(req.params.iteritems())
         context['path'] = req.environ['PATH_INFO']
+        context['headers'] = dict(req.headers.iteritems())
         params = req.environ.get(PARAMS_ENV, {})
         if 'REMOTE_USER' in req.environ:
             context['REMOTE_USER'] = req.environ['REMOTE_USER']
@@ -244,9 +245,9 @@ class Application(BaseApplication):
                 LOG.debug('Invalid tenant')
                 raise exception.Unauthorized()
 
-            # NOTE(vish): this is pretty inefficient
-            creds['roles'] = [self.identity_api.get_role(context, role)['name']
-                              for role in creds.get('roles', [])]
+            creds['roles'] = [role['name']
+                              for role in self.identity_api.get_roles(
+                                  context, creds.get('roles', []))]
             # Accept either is_admin or the admin role
             self.policy_api.enforce(context, creds, 'admin_required', {})
 
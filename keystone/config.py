@@ -33,6 +33,7 @@ register_bool = config.register_bool
 register_cli_bool = config.register_cli_bool
 register_int = config.register_int
 register_cli_int = config.register_cli_int
+register_float = config.register_float
 setup_authentication = config.setup_authentication
 
 
@@ -16,6 +16,7 @@
 
 from keystone.common import logging
 from keystone.common import manager
+from keystone.common import metrics
 from keystone.common import wsgi
 from keystone import config
 from keystone import exception
@@ -84,25 +85,28 @@ class StatsController(wsgi.Application):
 
     def get_stats(self, context):
         self.assert_admin(context)
-        return {
-            'OS-STATS:stats': [
-                {
-                    'type': 'identity',
-                    'api': 'admin',
-                    'extra': self.stats_api.get_stats(context, 'admin'),
-                },
-                {
-                    'type': 'identity',
-                    'api': 'public',
-                    'extra': self.stats_api.get_stats(context, 'public'),
-                },
-            ]
-        }
+        stats = [
+            {
+                'type': 'identity',
+                'api': 'admin',
+                'extra': self.stats_api.get_stats(context, 'admin'),
+            },
+            {
+                'type': 'identity',
+                'api': 'public',
+                'extra': self.stats_api.get_stats(context, 'public'),
+            },
+        ]
+        # in-process subsystems (signing, caches, ...) of this worker
+        for name, extra in sorted(metrics.get_stats().iteritems()):
+            stats.append({'type': name, 'api': 'internal', 'extra': extra})
+        return {'OS-STATS:stats': stats}
 
     def reset_stats(self, context):
         self.assert_admin(context)
         self.stats_api.set_stats(context, 'public', dict())
         self.stats_api.set_stats(context, 'admin', dict())
+        metrics.reset_stats()
 
 
 class StatsMiddleware(wsgi.Middleware):
@@ -173,6 +173,14 @@ class Identity(identity.Driver):
     def get_role(self, role_id):
         return self.role.get(role_id)
 
+    def get_roles(self, role_ids):
+        role_refs = dict((x['id'], x)
+                         for x in self.role.get_all_by_ids(role_ids))
+        for role_id in role_ids:
+            if role_id not in role_refs:
+                raise exception.RoleNotFound(role_id=role_id)
+        return [role_refs[x] for x in role_ids]
+
     def list_roles(self):
         return self.role.get_all()
 
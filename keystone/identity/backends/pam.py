@@ -92,6 +92,9 @@ class PamIdentity(identity.Driver):
     def get_role(self, role_id):
         raise NotImplementedError()
 
+    def get_roles(self, role_ids):
+        raise NotImplementedError()
+
     def list_users(self):
         raise NotImplementedError()
 
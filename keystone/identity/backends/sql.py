@@ -153,7 +153,8 @@ class Identity(sql.Base, identity.Driver):
         https://blueprints.launchpad.net/keystone/+spec/sql-identiy-pam
 
         """
-        return utils.check_password(password, user_ref.password)
+        return identity.check_password(user_ref.id, password,
+                                       user_ref.password)
 
     # Identity interface
     def authenticate_user(self, user_id=None, password=None):
@@ -387,6 +388,87 @@ class Identity(sql.Base, identity.Driver):
         self._get_user_group_project_roles(metadata_ref, user_id, tenant_id)
         return list(set(metadata_ref.get('roles', [])))
 
+    def resolve_auth_scope(self, user_id, project_id=None, domain_id=None):
+        session = self.get_session()
+        user_domain = sql.aliased(Domain)
+        scope_domain = sql.aliased(Domain)
+        if project_id:
+            scope, scope_id = Project, project_id
+            user_grant, group_grant = UserProjectGrant, GroupProjectGrant
+            user_grant_scope = UserProjectGrant.project_id
+            group_grant_scope = GroupProjectGrant.project_id
+        elif domain_id:
+            scope, scope_id = scope_domain, domain_id
+            user_grant, group_grant = UserDomainGrant, GroupDomainGrant
+            user_grant_scope = UserDomainGrant.domain_id
+            group_grant_scope = GroupDomainGrant.domain_id
+        else:
+            scope = None
+
+        # one row per group of the user, each carrying the user, the scope
+        # and whatever grants the user and that group have on it
+        if scope is None:
+            query = session.query(User, user_domain)
+        elif scope is Project:
+            query = session.query(User, user_domain, Project, scope_domain,
+                                  user_grant, group_grant)
+        else:
+            query = session.query(User, user_domain, scope_domain,
+                                  scope_domain, user_grant, group_grant)
+        query = query.outerjoin(user_domain, user_domain.id == User.domain_id)
+        if scope is Project:
+            query = query.outerjoin(Project, Project.id == project_id)
+            query = query.outerjoin(scope_domain,
+                                    scope_domain.id == Project.domain_id)
+        elif scope is not None:
+            query = query.outerjoin(scope_domain, scope_domain.id == domain_id)
+        if scope is not None:
+            query = query.outerjoin(user_grant, sql.and_(
+                user_grant.user_id == User.id, user_grant_scope == scope_id))
+            query = query.outerjoin(UserGroupMembership,
+                                    UserGroupMembership.user_id == User.id)
+            query = query.outerjoin(group_grant, sql.and_(
+                group_grant.group_id == UserGroupMembership.group_id,
+                group_grant_scope == scope_id))
+        rows = query.filter(User.id == user_id).all()
+        if not rows:
+            raise exception.UserNotFound(user_id=user_id)
+
+        user_ref, user_domain_ref = rows[0][:2]
+        if user_domain_ref is None:
+            raise exception.DomainNotFound(domain_id=user_ref.domain_id)
+        domains = {user_domain_ref.id: user_domain_ref.to_dict()}
+        result = {'user': identity.filter_user(user_ref.to_dict()),
+                  'project': None,
+                  'domain': None,
+                  'domains': domains,
+                  'member': False,
+                  'metadata': {},
+                  'roles': []}
+        if scope is None:
+            return result
+
+        scope_ref, scope_domain_ref, user_grant_ref = rows[0][2:5]
+        if scope_ref is None and scope is Project:
+            raise exception.ProjectNotFound(project_id=project_id)
+        if scope_domain_ref is None:
+            raise exception.DomainNotFound(domain_id=(
+                scope_ref.domain_id if scope is Project else domain_id))
+        domains[scope_domain_ref.id] = scope_domain_ref.to_dict()
+        if scope is Project:
+            result['project'] = scope_ref.to_dict()
+        else:
+            result['domain'] = scope_ref.to_dict()
+        if user_grant_ref is not None:
+            result['member'] = scope is Project
+            result['metadata'] = dict(user_grant_ref.data)
+        roles = set(result['metadata'].get('roles', []))
+        for row in rows:
+            if row[5] is not None:
+                roles.update(row[5].data.get('roles', []))
+        result['roles'] = list(roles)
+        return result
+
     def add_role_to_user_and_project(self, user_id, tenant_id, role_id):
         session = self.get_session()
         self._get_user(session, user_id)
@@ -677,6 +759,7 @@ class Identity(sql.Base, identity.Driver):
                     setattr(user_ref, attr, getattr(new_user, attr))
             user_ref.extra = new_user.extra
             session.flush()
+        identity.invalidate_password_cache(user_id)
         return identity.filter_user(user_ref.to_dict(include_extra_dict=True))
 
     def add_user_to_group(self, user_id, group_id):
@@ -755,6 +838,7 @@ class Identity(sql.Base, identity.Driver):
 
             session.delete(ref)
             session.flush()
+        identity.invalidate_password_cache(user_id)
 
     # group crud
 
@@ -846,6 +930,17 @@ class Identity(sql.Base, identity.Driver):
         session = self.get_session()
         return self._get_role(session, role_id).to_dict()
 
+    def get_roles(self, role_ids):
+        if not role_ids:
+            return []
+        session = self.get_session()
+        query = session.query(Role).filter(Role.id.in_(set(role_ids)))
+        role_refs = dict((x.id, x) for x in query)
+        for role_id in role_ids:
+            if role_id not in role_refs:
+                raise exception.RoleNotFound(role_id=role_id)
+        return [role_refs[x].to_dict() for x in role_ids]
+
     @sql.handle_conflicts(type='role')
     def update_role(self, role_id, role):
         session = self.get_session()
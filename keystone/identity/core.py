@@ -16,18 +16,115 @@
 
 """Main entry point into the Identity service."""
 
+import datetime
+import hashlib
+import hmac
+import os
+import struct
+import threading
+
 from keystone.common import dependency
 from keystone.common import logging
 from keystone.common import manager
+from keystone.common import metrics
+from keystone.common import utils
 from keystone import config
 from keystone import exception
+from keystone.openstack.common import timeutils
 
 
 CONF = config.CONF
+config.register_int('password_cache_size', group='identity', default=0)
+config.register_int('password_cache_time', group='identity', default=60)
 
 LOG = logging.getLogger(__name__)
 
 
+class _PasswordCache(object):
+    """Passwords recently verified against their stored hash.
+
+    A successful check is remembered under an HMAC-SHA256, keyed with a
+    secret random to this process, of the user id, the password and the
+    stored hash; the password itself is never kept. Holds up to
+    ``[identity] password_cache_size`` entries, evicting the least recently
+    used, each for ``[identity] password_cache_time`` seconds. A new
+    password is stored under a new hash, so old entries no longer match it;
+    updating or deleting a user through this process also evicts its entries
+    at once. Hits and misses are recorded under the ``password_cache``
+    metrics collector.
+
+    """
+
+    def __init__(self):
+        self._secret = os.urandom(32)
+        self._lock = threading.Lock()
+        self._entries = utils.LRUCache()
+        self.stats = metrics.collector('password_cache')
+
+    def _digest(self, user_id, password, hashed):
+        mac = hmac.new(self._secret, digestmod=hashlib.sha256)
+        for value in (user_id, password, hashed):
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            mac.update(struct.pack('>I', len(value)) + value)
+        return mac.digest()
+
+    def check(self, user_id, password, hashed):
+        """Check a password as utils.check_password does, through the cache.
+
+        Failed checks are not remembered, and always pay the full cost.
+
+        """
+        size = CONF.identity.password_cache_size
+        if size <= 0 or password is None or hashed is None:
+            return utils.check_password(password, hashed)
+        digest = self._digest(user_id, password, hashed)
+        with self._lock:
+            cached = self._entries.get(digest) is not None
+        if cached:
+            self.stats.incr('hits')
+            return True
+        self.stats.incr('misses')
+        if not utils.check_password(password, hashed):
+            return False
+        valid_until = timeutils.utcnow() + datetime.timedelta(
+            seconds=CONF.identity.password_cache_time)
+        with self._lock:
+            self._entries.set(digest, user_id, valid_until, size)
+        return True
+
+    def delete_user(self, user_id):
+        with self._lock:
+            for digest, entry_user_id in self._entries.items():
+                if entry_user_id == user_id:
+                    self._entries.pop(digest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_password_cache = _PasswordCache()
+
+
+def check_password(user_id, password, hashed):
+    """Check the password of a user against its stored hash.
+
+    Successful checks are cached when ``[identity] password_cache_size`` is
+    set, so that repeated authentication skips hashing.
+
+    """
+    return _password_cache.check(user_id, password, hashed)
+
+
+def invalidate_password_cache(user_id=None):
+    """Forget the verified passwords of a user, or of every user."""
+    if user_id is None:
+        _password_cache.clear()
+    else:
+        _password_cache.delete_user(user_id)
+
+
 def filter_user(user_ref):
     """Filter out private items in a user dict.
 
@@ -59,6 +156,9 @@ class Manager(manager.Manager):
 
     """
 
+    request_cache = ('get_user', 'get_project', 'get_domain', 'get_role',
+                     'get_roles', 'get_metadata')
+
     def __init__(self):
         super(Manager, self).__init__(CONF.identity.driver)
 
@@ -72,18 +172,21 @@ class Manager(manager.Manager):
         user_ref = self.driver.authenticate_user(user_id, password)
         return self.driver.authorize_for_project(user_ref, tenant_id)
 
+    @manager.invalidates_request_cache
     def create_user(self, context, user_id, user_ref):
         user = user_ref.copy()
         if 'enabled' not in user:
             user['enabled'] = True
         return self.driver.create_user(user_id, user)
 
+    @manager.invalidates_request_cache
     def create_group(self, context, group_id, group_ref):
         group = group_ref.copy()
         if 'description' not in group:
             group['description'] = ''
         return self.driver.create_group(group_id, group)
 
+    @manager.invalidates_request_cache
     def create_project(self, context, tenant_id, tenant_ref):
         tenant = tenant_ref.copy()
         if 'enabled' not in tenant:
@@ -180,6 +283,66 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def resolve_auth_scope(self, user_id, project_id=None, domain_id=None):
+        """Get what authenticating a user within a scope needs to know.
+
+        Drivers may override this to look everything up at once; this
+        implementation is built on the other driver methods.
+
+        :returns: a dictionary with the ``user``, the ``project`` or
+                  ``domain`` of the scope if any, ``domains``, the refs of
+                  the domains of the user and scope by id, ``member``,
+                  whether the user was added to the project itself,
+                  ``metadata``, the user's own metadata in the scope, and
+                  ``roles``, the ids of the roles the user has in the scope
+                  directly or through its groups.
+        :raises: keystone.exception.UserNotFound,
+                 keystone.exception.ProjectNotFound,
+                 keystone.exception.DomainNotFound
+
+        """
+        user_ref = filter_user(self.get_user(user_id))
+        domains = {}
+
+        def get_domain(domain_id):
+            if domain_id not in domains:
+                domains[domain_id] = self.get_domain(domain_id)
+            return domains[domain_id]
+
+        get_domain(user_ref['domain_id'])
+        scope = {'user': user_ref,
+                 'project': None,
+                 'domain': None,
+                 'domains': domains,
+                 'member': False,
+                 'metadata': {},
+                 'roles': []}
+        if project_id:
+            scope['project'] = self.get_project(project_id)
+            get_domain(scope['project']['domain_id'])
+            scope['member'] = project_id in self.get_projects_for_user(
+                user_id)
+        elif domain_id:
+            scope['domain'] = get_domain(domain_id)
+        else:
+            return scope
+
+        try:
+            scope['metadata'] = dict(self.get_metadata(
+                user_id=user_id, tenant_id=project_id, domain_id=domain_id))
+        except exception.MetadataNotFound:
+            pass
+        roles = set(scope['metadata'].get('roles', []))
+        for group_ref in self.list_groups_for_user(user_id):
+            try:
+                roles.update(self.get_metadata(
+                    group_id=group_ref['id'], tenant_id=project_id,
+                    domain_id=domain_id).get('roles', []))
+            except exception.MetadataNotFound:
+                pass
+        scope['roles'] = list(roles)
+        return scope
+
     def get_roles_for_user_and_domain(self, user_id, domain_id):
         """Get the roles associated with a user within given domain.
 
@@ -474,6 +637,21 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def get_roles(self, role_ids):
+        """Get several roles by ID at once.
+
+        Drivers may override this to look the roles up at once; this
+        implementation gets them one at a time.
+
+        :returns: a list of role_refs, in the order of role_ids.
+        :raises: keystone.exception.RoleNotFound
+
+        """
+        if self.get_role.im_func is Driver.get_role.im_func:
+            # the driver does not support roles
+            raise exception.NotImplemented()
+        return [self.get_role(x) for x in role_ids]
+
     def update_role(self, role_id, role):
         """Updates an existing role.
 
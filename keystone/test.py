@@ -223,6 +223,10 @@ class TestCase(NoModule, unittest.TestCase):
                 if path in sys.path:
                     sys.path.remove(path)
             kvs.INMEMDB.clear()
+            token.invalidate_revocation_list()
+            token.discard_write_behind()
+            token.invalidate_token_cache()
+            identity.invalidate_password_cache()
             CONF.reset()
 
     def opt_in_group(self, group, **kw):
@@ -233,6 +237,21 @@ class TestCase(NoModule, unittest.TestCase):
         for k, v in kw.iteritems():
             CONF.set_override(k, v)
 
+    def set_timezone(self, tz):
+        """Run the rest of the test in the local timezone ``tz``."""
+        old_tz = os.environ.get('TZ')
+
+        def restore():
+            if old_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = old_tz
+            time.tzset()
+
+        self.addCleanup(restore)
+        os.environ['TZ'] = tz
+        time.tzset()
+
     def load_backends(self):
         """Create shortcut references to each driver for data manipulation."""
         for name, manager in initialize_drivers().iteritems():
@@ -14,15 +14,57 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import copy
+import heapq
 
 from keystone.common import kvs
+from keystone.common import utils
 from keystone import exception
 from keystone.openstack.common import timeutils
 from keystone import token
 
 
 class Token(kvs.Base, token.Driver):
+    """Token driver storing tokens in the in-memory key value store.
+
+    Besides ``token-<id>`` and ``revoked-token-<id>``, the store holds
+    indexes of the tokens of each user (``usertokens-<user_id>``) and trust
+    (``trusttokens-<trust_id>``) and of the revoked tokens
+    (``revoked-tokens``), plus a heap of token expiry times, so listing and
+    flushing tokens never scans the whole store. ``revocation-events`` lists
+    the revocation events of compact tokens.
+
+    """
+
+    def _index_add(self, key, token_id, value):
+        index = self.db.get(key, {})
+        index[token_id] = value
+        self.db.set(key, index)
+
+    def _index_remove(self, key, token_id):
+        try:
+            index = self.db.get(key)
+        except exception.NotFound:
+            return
+        if index.pop(token_id, None) is None:
+            return
+        if index:
+            self.db.set(key, index)
+        else:
+            self.db.delete(key)
+
+    def _token_indexes(self, ref):
+        keys = []
+        if ref.get('user') and ref['user'].get('id'):
+            keys.append('usertokens-%s' % ref['user']['id'])
+        if ref.get('trust_id'):
+            keys.append('trusttokens-%s' % ref['trust_id'])
+        return keys
+
+    @property
+    def _expiry_heap(self):
+        # updated in place: copying it on every access would make each
+        # token operation cost O(all tokens)
+        return self.db.setdefault('token-expiry-heap', [])
 
     # Public interface
     def get_token(self, token_id):
@@ -36,29 +78,39 @@ class Token(kvs.Base, token.Driver):
         if expiry is None:
             raise exception.TokenNotFound(token_id=token_id)
         if expiry > now:
-            return copy.deepcopy(ref)
+            return ref
         else:
             raise exception.TokenNotFound(token_id=token_id)
 
     def create_token(self, token_id, data):
         token_id = token.unique_id(token_id)
-        data_copy = copy.deepcopy(data)
+        data_copy = dict(data)
         data_copy['id'] = token_id
         if not data_copy.get('expires'):
             data_copy['expires'] = token.default_expire_time()
         if not data_copy.get('user_id'):
             data_copy['user_id'] = data_copy['user']['id']
-        self.db.set('token-%s' % token_id, data_copy)
-        return copy.deepcopy(data_copy)
+        # the one copy of the record; it is shared, not copied, from now on
+        token_ref = utils.freeze(data_copy)
+        self.db.set('token-%s' % token_id, token_ref)
+        for key in self._token_indexes(token_ref):
+            self._index_add(key, token_id, token_ref['expires'])
+        heapq.heappush(self._expiry_heap, (token_ref['expires'], token_id))
+        return token_ref
 
     def delete_token(self, token_id):
         token_id = token.unique_id(token_id)
         try:
-            token_ref = self.get_token(token_id)
+            token_ref = utils.FrozenDict(self.get_token(token_id),
+                                         revoked_at=timeutils.utcnow())
             self.db.delete('token-%s' % token_id)
             self.db.set('revoked-token-%s' % token_id, token_ref)
         except exception.NotFound:
             raise exception.TokenNotFound(token_id=token_id)
+        for key in self._token_indexes(token_ref):
+            self._index_remove(key, token_id)
+        self._index_add('revoked-tokens', token_id,
+                        (token_ref['expires'], token_ref['revoked_at']))
 
     def is_not_expired(self, now, ref):
         return not ref.get('expires') and ref.get('expires') < now
@@ -69,14 +121,22 @@ class Token(kvs.Base, token.Driver):
     def trust_matches(self, trust_id, ref):
         return ref.get('trust_id') and ref['trust_id'] == trust_id
 
-    def _list_tokens_for_trust(self, trust_id):
-        tokens = []
+    def _list_live_tokens(self, key):
         now = timeutils.utcnow()
-        for token, ref in self.db.items():
-            if not token.startswith('token-') or self.is_expired(now, ref):
+        for token_id, expires in self.db.get(key, {}).iteritems():
+            if expires < now:
                 continue
+            try:
+                yield token_id, self.db.get('token-%s' % token_id)
+            except exception.NotFound:
+                pass
+
+    def _list_tokens_for_trust(self, trust_id):
+        tokens = []
+        for token_id, ref in self._list_live_tokens('trusttokens-%s' %
+                                                    trust_id):
             if self.trust_matches(trust_id, ref):
-                tokens.append(token.split('-', 1)[1])
+                tokens.append(token_id)
         return tokens
 
     def _list_tokens_for_user(self, user_id, tenant_id=None):
@@ -89,14 +149,11 @@ class Token(kvs.Base, token.Driver):
                      ref['tenant'].get('id') == tenant_id))
 
         tokens = []
-        now = timeutils.utcnow()
-        for token, ref in self.db.items():
-            if not token.startswith('token-') or self.is_expired(now, ref):
-                continue
-            else:
-                if (user_matches(user_id, ref) and
-                        tenant_matches(tenant_id, ref)):
-                        tokens.append(token.split('-', 1)[1])
+        for token_id, ref in self._list_live_tokens('usertokens-%s' %
+                                                    user_id):
+            if (user_matches(user_id, ref) and
+                    tenant_matches(tenant_id, ref)):
+                tokens.append(token_id)
         return tokens
 
     def list_tokens(self, user_id, tenant_id=None, trust_id=None):
@@ -105,19 +162,46 @@ class Token(kvs.Base, token.Driver):
         else:
             return self._list_tokens_for_user(user_id, tenant_id)
 
-    def list_revoked_tokens(self):
+    def list_revoked_tokens(self, since=None):
         tokens = []
-        for token, token_ref in self.db.items():
-            if not token.startswith('revoked-token-'):
+        now = timeutils.utcnow()
+        revoked = self.db.get('revoked-tokens', {})
+        for token_id, (expires, revoked_at) in revoked.iteritems():
+            if expires < now:
                 continue
-            record = {}
-            record['id'] = token_ref['id']
-            record['expires'] = token_ref['expires']
-            tokens.append(record)
+            if since is not None and revoked_at < since:
+                continue
+            tokens.append({'id': token_id, 'expires': expires})
         return tokens
 
+    def create_revocation_event(self, event):
+        events = self.list_revocation_events()
+        events.append(utils.freeze(dict(event)))
+        self.db.set('revocation-events', events)
+
+    def list_revocation_events(self):
+        now = timeutils.utcnow()
+        return [event for event in self.db.get('revocation-events', [])
+                if event['expires'] > now]
+
     def flush_expired_tokens(self):
         now = timeutils.utcnow()
-        for token, token_ref in self.db.items():
-            if self.is_expired(now, token_ref):
-                self.db.delete(token)
+        heap = self._expiry_heap
+        flushed = 0
+        while heap and heap[0][0] < now:
+            expires, token_id = heapq.heappop(heap)
+            for key in ('token-%s' % token_id, 'revoked-token-%s' % token_id):
+                try:
+                    ref = self.db.get(key)
+                except exception.NotFound:
+                    continue
+                if ref['expires'] != expires:
+                    # the token was created again since; a later heap
+                    # entry covers it
+                    continue
+                self.db.delete(key)
+                flushed += 1
+                for index_key in self._token_indexes(ref):
+                    self._index_remove(index_key, token_id)
+                self._index_remove('revoked-tokens', token_id)
+        return flushed
@@ -15,23 +15,54 @@
 # under the License.
 
 from __future__ import absolute_import
-import copy
-
-import memcache
+import calendar
+import datetime
 
+from keystone.common import logging
+from keystone.common import memcache_pool
 from keystone.common import utils
 from keystone import config
 from keystone import exception
 from keystone.openstack.common import jsonutils
+from keystone.openstack.common import timeutils
 from keystone import token
 
 
 CONF = config.CONF
 config.register_str('servers', group='memcache', default='localhost:11211')
+config.register_int('revocation_shard_interval', group='memcache',
+                    default=900)
+LOG = logging.getLogger(__name__)
 
 
 class Token(token.Driver):
+    """Token driver storing tokens in memcache.
+
+    Revoked tokens are sharded by expiry: each ``revocation-list-<n>`` item
+    holds the tokens that expire within the same ``[memcache]
+    revocation_shard_interval`` seconds and is itself set to expire with the
+    last of them, so memcache discards revocations once they can no longer
+    matter. ``revocation-horizon`` records the highest shard still held, so
+    tokens that outlive ``[token] expiration`` are not overlooked; it
+    expires with that shard, after which only the shards within ``[token]
+    expiration`` are read.
+
+    The revocation events of compact tokens are sharded by expiry the same
+    way, in ``revocation-events-<n>`` items, with ``revocation-events-
+    horizon``. Memcache may evict any of these items early when it runs
+    short of memory, and the revocations in them are then lost: revoked
+    tokens validate again.
+
+    ``usertokens-<user_id>`` indexes the tokens of a user together with
+    their expiry. Expired entries are dropped whenever a token is added, so
+    the index only grows with the number of live tokens.
+
+    """
+    # written by older releases, read until its entries have expired
     revocation_key = 'revocation-list'
+    revocation_horizon_key = 'revocation-horizon'
+    revocation_events_key = 'revocation-events'
+    revocation_events_horizon_key = 'revocation-events-horizon'
 
     def __init__(self, client=None):
         self._memcache_client = client
@@ -42,7 +73,8 @@ class Token(token.Driver):
 
     def _get_memcache_client(self):
         memcache_servers = CONF.memcache.servers.split(',')
-        self._memcache_client = memcache.Client(memcache_servers, debug=0)
+        self._memcache_client = memcache_pool.get_pool(memcache_servers,
+                                                       cache_cas=True)
         return self._memcache_client
 
     def _prefix_token_id(self, token_id):
@@ -62,7 +94,7 @@ class Token(token.Driver):
         return token_ref
 
     def create_token(self, token_id, data):
-        data_copy = copy.deepcopy(data)
+        data_copy = dict(data)
         ptk = self._prefix_token_id(token.unique_id(token_id))
         if not data_copy.get('expires'):
             data_copy['expires'] = token.default_expire_time()
@@ -70,64 +102,268 @@ class Token(token.Driver):
             data_copy['user_id'] = data_copy['user']['id']
         kwargs = {}
         if data_copy['expires'] is not None:
-            expires_ts = utils.unixtime(data_copy['expires'])
-            kwargs['time'] = expires_ts
+            kwargs['time'] = calendar.timegm(
+                data_copy['expires'].utctimetuple())
         self.client.set(ptk, data_copy, **kwargs)
         if 'id' in data['user']:
-            token_data = jsonutils.dumps(token_id)
-            user_id = data['user']['id']
-            user_key = self._prefix_user_id(user_id)
-            if not self.client.append(user_key, ',%s' % token_data):
-                if not self.client.add(user_key, token_data):
-                    if not self.client.append(user_key, ',%s' % token_data):
-                        msg = _('Unable to add token user list.')
-                        raise exception.UnexpectedError(msg)
-        return copy.deepcopy(data_copy)
-
-    def _add_to_revocation_list(self, data):
-        data_json = jsonutils.dumps(data)
-        if not self.client.append(self.revocation_key, ',%s' % data_json):
-            if not self.client.add(self.revocation_key, data_json):
-                if not self.client.append(self.revocation_key,
-                                          ',%s' % data_json):
-                    msg = _('Unable to add token to revocation list.')
+            self._add_to_user_index(data['user']['id'],
+                                    token.unique_id(token_id),
+                                    data_copy['expires'])
+        return utils.freeze(data_copy)
+
+    def _format_user_index_entry(self, token_id, expires):
+        return jsonutils.dumps([token_id,
+                                timeutils.isotime(expires, subsecond=True)])
+
+    def _parse_user_index(self, record):
+        """Return the (token_id, expires) pairs of a user's token index.
+
+        Entries written by older releases hold just the token id, their
+        expiry is None.
+
+        """
+        index = []
+        for entry in jsonutils.loads('[%s]' % record):
+            if isinstance(entry, basestring):
+                index.append((entry, None))
+            else:
+                token_id, expires = entry
+                index.append((token_id, timeutils.normalize_time(
+                    timeutils.parse_isotime(expires))))
+        return index
+
+    def _compact_user_index(self, client, index):
+        """Return the entries of a token index that are still live."""
+        now = timeutils.utcnow()
+        legacy_ids = [token_id for token_id, expires in index
+                      if expires is None]
+        legacy_refs = {}
+        if legacy_ids:
+            legacy_refs = client.get_multi(
+                [self._prefix_token_id(token.unique_id(token_id))
+                 for token_id in legacy_ids])
+
+        entries = []
+        for token_id, expires in index:
+            if expires is None:
+                token_id = token.unique_id(token_id)
+                token_ref = legacy_refs.get(self._prefix_token_id(token_id))
+                if not token_ref or not token_ref.get('expires'):
+                    continue
+                expires = token_ref['expires']
+            if expires > now:
+                entries.append(self._format_user_index_entry(token_id,
+                                                             expires))
+        return entries
+
+    def _add_to_user_index(self, user_id, token_id, expires):
+        user_key = self._prefix_user_id(user_id)
+        entry = self._format_user_index_entry(token_id, expires)
+
+        # gets and cas must go through the same client
+        with self.client.acquire() as client:
+            record = client.gets(user_key)
+            if record:
+                index = self._parse_user_index(record)
+                now = timeutils.utcnow()
+                if any(e is None or e <= now for i, e in index):
+                    entries = self._compact_user_index(client, index)
+                    entries.append(entry)
+                    if client.cas(user_key, ','.join(entries)):
+                        return
+
+        # either there was nothing to prune, or the index changed under us
+        # and pruning is left to the next write
+        if not self.client.append(user_key, ',%s' % entry):
+            if not self.client.add(user_key, entry):
+                if not self.client.append(user_key, ',%s' % entry):
+                    msg = _('Unable to add token user list.')
+                    raise exception.UnexpectedError(msg)
+
+    def _prefix_revocation_shard(self, shard, key=None):
+        return '%s-%d' % (key or self.revocation_key, shard)
+
+    def _revocation_shard(self, expires):
+        return calendar.timegm(expires.utctimetuple()) // (
+            CONF.memcache.revocation_shard_interval)
+
+    def _revocation_shard_expiry(self, shard):
+        return (shard + 1) * CONF.memcache.revocation_shard_interval
+
+    def _revocation_shards(self, now, horizon_key):
+        """Return the shards that may hold revocations still in force."""
+        first = self._revocation_shard(now)
+        last = self._revocation_shard(
+            now + datetime.timedelta(seconds=CONF.token.expiration))
+        horizon = self.client.get(horizon_key)
+        if horizon is not None:
+            last = max(last, horizon)
+        return xrange(first, last + 1)
+
+    def _extend_revocation_horizon(self, shard, key=None):
+        key = key or self.revocation_horizon_key
+        expires = self._revocation_shard_expiry(shard)
+        # gets and cas must go through the same client
+        with self.client.acquire() as client:
+            while True:
+                horizon = client.gets(key)
+                if horizon is None:
+                    if client.add(key, shard, time=expires):
+                        return
+                elif horizon >= shard:
+                    return
+                elif client.cas(key, shard, time=expires):
+                    return
+
+    def _add_to_revocation_list(self, token_refs):
+        """Record the revocation of tokens, given by unique token id."""
+        revoked_at = timeutils.isotime()
+        shards = {}
+        for token_id, token_ref in token_refs.iteritems():
+            shard = self._revocation_shard(token_ref['expires'])
+            shards.setdefault(shard, []).append(jsonutils.dumps({
+                'id': token_id,
+                'expires': timeutils.isotime(token_ref['expires'],
+                                             subsecond=True),
+                'revoked_at': revoked_at}))
+        self._extend_revocation_horizon(max(shards))
+
+        for shard, records in shards.iteritems():
+            self._append_to_shard(self._prefix_revocation_shard(shard), shard,
+                                  ','.join(records),
+                                  _('Unable to add token to revocation list.'))
+
+    def _append_to_shard(self, shard_key, shard, data_json, msg):
+        shard_expires = self._revocation_shard_expiry(shard)
+        if not self.client.append(shard_key, ',%s' % data_json):
+            if not self.client.add(shard_key, data_json, time=shard_expires):
+                if not self.client.append(shard_key, ',%s' % data_json):
+                    LOG.error(_('Unable to append to %s, it may have '
+                                'reached the memcache item size limit.'),
+                              shard_key)
                     raise exception.UnexpectedError(msg)
 
     def delete_token(self, token_id):
+        token_id = token.unique_id(token_id)
         # Test for existence
-        data = self.get_token(token.unique_id(token_id))
-        ptk = self._prefix_token_id(token.unique_id(token_id))
+        data = self.get_token(token_id)
+        ptk = self._prefix_token_id(token_id)
         result = self.client.delete(ptk)
-        self._add_to_revocation_list(data)
+        self._add_to_revocation_list({token_id: data})
         return result
 
+    def _list_token_refs(self, user_id, tenant_id=None, trust_id=None):
+        """Return the live tokens of a user, keyed by unique token id."""
+        user_record = self.client.get(self._prefix_user_id(user_id))
+        if not user_record:
+            return {}
+        now = timeutils.utcnow()
+        token_ids = set(token.unique_id(token_id) for token_id, expires
+                        in self._parse_user_index(user_record)
+                        if expires is None or expires > now)
+        token_refs = self.client.get_multi(
+            [self._prefix_token_id(token_id) for token_id in token_ids])
+
+        refs = {}
+        for token_id in token_ids:
+            token_ref = token_refs.get(self._prefix_token_id(token_id))
+            if not token_ref:
+                continue
+            if tenant_id is not None:
+                tenant = token_ref.get('tenant')
+                if not tenant:
+                    continue
+                if tenant.get('id') != tenant_id:
+                    continue
+            if trust_id is not None:
+                trust = token_ref.get('trust_id')
+                if not trust:
+                    continue
+                if trust != trust_id:
+                    continue
+            refs[token_id] = token_ref
+        return refs
+
     def list_tokens(self, user_id, tenant_id=None, trust_id=None):
+        token_refs = self._list_token_refs(user_id, tenant_id, trust_id)
+        return [token_ref['id'] for token_ref in token_refs.itervalues()]
+
+    def delete_tokens(self, user_id, tenant_id=None, trust_id=None):
+        token_refs = self._list_token_refs(user_id, tenant_id, trust_id)
+        if not token_refs:
+            return
+        self.client.delete_multi(
+            [self._prefix_token_id(token_id) for token_id in token_refs])
+        self._add_to_revocation_list(token_refs)
+
+    def _parse_revocation_list(self, list_json, now, since):
         tokens = []
-        user_key = self._prefix_user_id(user_id)
-        user_record = self.client.get(user_key) or ""
-        token_list = jsonutils.loads('[%s]' % user_record)
-        for token_id in token_list:
-            ptk = self._prefix_token_id(token.unique_id(token_id))
-            token_ref = self.client.get(ptk)
-            if token_ref:
-                if tenant_id is not None:
-                    tenant = token_ref.get('tenant')
-                    if not tenant:
-                        continue
-                    if tenant.get('id') != tenant_id:
-                        continue
-                if trust_id is not None:
-                    trust = token_ref.get('trust_id')
-                    if not trust:
-                        continue
-                    if trust != trust_id:
-                        continue
-
-                tokens.append(token_id)
+        for record in jsonutils.loads('[%s]' % list_json):
+            if not record.get('expires'):
+                continue
+            expires = timeutils.normalize_time(
+                timeutils.parse_isotime(record['expires']))
+            if expires <= now:
+                continue
+            if since is not None:
+                revoked_at = record.get('revoked_at')
+                if not revoked_at:
+                    continue
+                revoked_at = timeutils.normalize_time(
+                    timeutils.parse_isotime(revoked_at))
+                if revoked_at < since:
+                    continue
+            tokens.append({'id': record['id'], 'expires': expires})
         return tokens
 
-    def list_revoked_tokens(self):
-        list_json = self.client.get(self.revocation_key)
-        if list_json:
-            return jsonutils.loads('[%s]' % list_json)
-        return []
+    def create_revocation_event(self, event):
+        record = dict(event)
+        for attr in ('issued_before', 'expires'):
+            record[attr] = timeutils.isotime(record[attr], subsecond=True)
+        shard = self._revocation_shard(event['expires'])
+        self._extend_revocation_horizon(shard,
+                                        self.revocation_events_horizon_key)
+        self._append_to_shard(
+            self._prefix_revocation_shard(shard, self.revocation_events_key),
+            shard, jsonutils.dumps(record),
+            _('Unable to add revocation event.'))
+
+    def _parse_revocation_event(self, record):
+        event = dict(record)
+        for attr in ('issued_before', 'expires'):
+            event[attr] = timeutils.normalize_time(
+                timeutils.parse_isotime(record[attr]))
+        return event
+
+    def list_revocation_events(self):
+        now = timeutils.utcnow()
+        shards = self.client.get_multi(
+            [self._prefix_revocation_shard(shard, self.revocation_events_key)
+             for shard in self._revocation_shards(
+                 now, self.revocation_events_horizon_key)])
+        events = []
+        for events_json in shards.itervalues():
+            for record in jsonutils.loads('[%s]' % events_json):
+                event = self._parse_revocation_event(record)
+                if event['expires'] > now:
+                    events.append(event)
+        return events
+
+    def list_revoked_tokens(self, since=None):
+        now = timeutils.utcnow()
+        keys = [self._prefix_revocation_shard(shard)
+                for shard in self._revocation_shards(
+                    now, self.revocation_horizon_key)]
+        keys.append(self.revocation_key)
+        shards = self.client.get_multi(keys)
+
+        tokens = []
+        for key, list_json in shards.iteritems():
+            tokens.extend(self._parse_revocation_list(list_json, now, since))
+
+        if (self.revocation_key in shards and since is None and
+                not self._parse_revocation_list(shards[self.revocation_key],
+                                                now, None)):
+            # every token revoked by an older release has expired
+            self.client.delete(self.revocation_key)
+        return tokens
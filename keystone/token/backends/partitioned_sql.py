@@ -0,0 +1,311 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import calendar
+import copy
+import datetime
+import re
+import threading
+
+import sqlalchemy
+
+from keystone.common import logging
+from keystone.common import sql
+from keystone import config
+from keystone import exception
+from keystone.openstack.common import timeutils
+from keystone import token
+from keystone.token.backends import sql as token_sql
+
+
+CONF = config.CONF
+config.register_int('partition_interval', group='token', default=3600)
+LOG = logging.getLogger(__name__)
+
+# a partition is dropped this many seconds after its last token expired, so
+# processes whose clocks lag behind never read a dropped table
+DROP_DELAY = 60
+
+_TABLE_NAME = re.compile(r'^token_(\d+)_(\d+)$')
+
+
+def _partition_end(partition):
+    interval, bucket = partition
+    return datetime.datetime.utcfromtimestamp((bucket + 1) * interval)
+
+
+def _define_table(metadata, partition):
+    name = 'token_%d_%d' % partition
+    table = sqlalchemy.Table(
+        name, metadata,
+        sql.Column('id', sql.String(64), primary_key=True),
+        sql.Column('expires', sql.DateTime(), nullable=False),
+        sql.Column('extra', sql.JsonBlob()),
+        sql.Column('valid', sql.Boolean(), default=True),
+        sql.Column('user_id', sql.String(64)),
+        sql.Column('trust_id', sql.String(64), nullable=True),
+        sql.Column('tenant_id', sql.String(64), nullable=True),
+        sql.Column('revoked_at', sql.DateTime(), nullable=True))
+    sqlalchemy.Index('ix_%s_user_id' % name, table.c.user_id)
+    sqlalchemy.Index('ix_%s_trust_id' % name, table.c.trust_id)
+    return table
+
+
+class Token(sql.Base, token.Driver):
+    """Token driver storing tokens in tables partitioned by expiry time.
+
+    A token is stored in the ``token_<interval>_<n>`` table, which covers
+    the n-th span of ``[token] partition_interval`` seconds since the epoch
+    and holds the tokens expiring in it. With a fixed token lifetime only
+    the last few tables hold live tokens, and flushing expired tokens drops
+    whole tables rather than deleting rows. Reads look at every table that
+    may still hold live tokens, in a single ``UNION ALL`` query. Revocation
+    events are kept as by the SQL token driver.
+
+    Tables are created ahead of time for every partition that a token
+    issued now may expire in, so each process knows which tables to read
+    without asking the database. Other tables, such as those created under
+    a previous partition_interval, are learned of when the driver is first
+    used and whenever a token is not found; they are read and dropped by
+    the interval in their name.
+
+    """
+
+    def __init__(self):
+        self._metadata = sqlalchemy.MetaData()
+        self._tables = {}
+        self._lock = threading.Lock()
+        self._discovered = False
+        self._events = token_sql.Token()
+
+    def _partition(self, when):
+        interval = CONF.token.partition_interval
+        return interval, calendar.timegm(when.utctimetuple()) // interval
+
+    def _known_table(self, partition):
+        """Return the table of a partition that exists in the database."""
+        with self._lock:
+            if partition not in self._tables:
+                self._tables[partition] = _define_table(self._metadata,
+                                                        partition)
+            return self._tables[partition]
+
+    def _create_table(self, partition):
+        with self._lock:
+            table = self._tables.get(partition)
+        if table is not None:
+            return table
+        table = _define_table(sqlalchemy.MetaData(), partition)
+        engine = self.get_engine()
+        try:
+            table.create(engine, checkfirst=True)
+        except sqlalchemy.exc.SQLAlchemyError:
+            # another process may have created it since the check
+            if not engine.has_table(table.name):
+                raise
+        return self._known_table(partition)
+
+    def _refresh(self):
+        """Learn of the live tables this process did not create.
+
+        :returns: True if any table was previously unknown
+
+        """
+        now = timeutils.utcnow()
+        found = False
+        for name in self.get_engine().table_names():
+            match = _TABLE_NAME.match(name)
+            if not match:
+                continue
+            partition = (int(match.group(1)), int(match.group(2)))
+            with self._lock:
+                known = partition in self._tables
+            if not known and _partition_end(partition) > now:
+                self._known_table(partition)
+                found = True
+        self._discovered = True
+        return found
+
+    def _live_tables(self, now):
+        if not self._discovered:
+            self._refresh()
+        # allowing for processes whose clocks run ahead of this one
+        first = self._partition(now)
+        last = self._partition(now + datetime.timedelta(
+            seconds=CONF.token.expiration + DROP_DELAY))
+        for bucket in xrange(first[1], last[1] + 1):
+            self._create_table((first[0], bucket))
+        with self._lock:
+            for partition in [p for p in self._tables
+                              if _partition_end(p) <= now]:
+                self._metadata.remove(self._tables.pop(partition))
+            return [self._tables[p] for p in sorted(self._tables)]
+
+    def _select(self, session, columns, where):
+        """Run one select over every live table."""
+        now = timeutils.utcnow()
+        selects = [sqlalchemy.select([table.c[c] for c in columns],
+                                     where(table, now))
+                   for table in self._live_tables(now)]
+        if not selects:
+            return []
+        if len(selects) == 1:
+            return session.execute(selects[0]).fetchall()
+        return session.execute(sqlalchemy.union_all(*selects)).fetchall()
+
+    def _update(self, session, where, values):
+        """Update matching rows in every live table, in one transaction."""
+        now = timeutils.utcnow()
+        updated = 0
+        with session.begin():
+            for table in self._live_tables(now):
+                result = session.execute(
+                    table.update().where(where(table, now)).values(**values))
+                updated += result.rowcount
+        return updated
+
+    def _to_dict(self, row):
+        ref = copy.deepcopy(row['extra'])
+        for attr in token_sql.TokenModel.attributes:
+            ref[attr] = row[attr]
+        return ref
+
+    # Public interface
+    def get_token(self, token_id):
+        if token_id is None:
+            raise exception.TokenNotFound(token_id=token_id)
+        key = token.unique_id(token_id)
+        columns = token_sql.TokenModel.attributes + ['extra', 'valid']
+        session = self.get_session()
+
+        def where(table, now):
+            return table.c.id == key
+
+        rows = self._select(session, columns, where)
+        if not rows and self._refresh():
+            rows = self._select(session, columns, where)
+        now = timeutils.utcnow()
+        if not rows or not rows[0]['valid'] or now >= rows[0]['expires']:
+            raise exception.TokenNotFound(token_id=token_id)
+        return self._to_dict(rows[0])
+
+    def create_token(self, token_id, data):
+        data_copy = copy.deepcopy(data)
+        if not data_copy.get('expires'):
+            data_copy['expires'] = token.default_expire_time()
+        if not data_copy.get('user_id'):
+            data_copy['user_id'] = data_copy['user']['id']
+        data_copy['id'] = token.unique_id(token_id)
+
+        attributes = token_sql.TokenModel.attributes
+        values = dict((attr, data_copy.get(attr)) for attr in attributes)
+        values['extra'] = dict((k, v) for k, v in data_copy.iteritems()
+                               if k not in attributes and k != 'extra')
+        values['valid'] = True
+        if data_copy.get('tenant'):
+            values['tenant_id'] = data_copy['tenant'].get('id')
+
+        table = self._create_table(self._partition(values['expires']))
+        session = self.get_session()
+        with session.begin():
+            session.execute(table.insert().values(**values))
+        return self._to_dict(values)
+
+    def delete_token(self, token_id):
+        key = token.unique_id(token_id)
+        session = self.get_session()
+
+        def where(table, now):
+            return sqlalchemy.and_(table.c.id == key, table.c.valid)
+
+        values = {'valid': False, 'revoked_at': timeutils.utcnow()}
+        revoked = self._update(session, where, values)
+        if not revoked and self._refresh():
+            revoked = self._update(session, where, values)
+        if not revoked:
+            raise exception.TokenNotFound(token_id=token_id)
+
+    def delete_tokens(self, user_id, tenant_id=None, trust_id=None):
+        """Deletes all tokens in one session
+
+        The user_id will be ignored if the trust_id is specified. user_id
+        will always be specified.
+        If using a trust, the token's user_id is set to the trustee's user ID
+        or the trustor's user ID, so will use trust_id to query the tokens.
+
+        """
+        def where(table, now):
+            clauses = [table.c.valid, table.c.expires > now]
+            if trust_id:
+                clauses.append(table.c.trust_id == trust_id)
+            else:
+                clauses.append(table.c.user_id == user_id)
+            if tenant_id:
+                clauses.append(table.c.tenant_id == tenant_id)
+            return sqlalchemy.and_(*clauses)
+
+        self._update(self.get_session(), where,
+                     {'valid': False, 'revoked_at': timeutils.utcnow()})
+
+    def list_tokens(self, user_id, tenant_id=None, trust_id=None):
+        def where(table, now):
+            clauses = [table.c.valid, table.c.expires > now]
+            if trust_id:
+                clauses.append(table.c.trust_id == trust_id)
+            else:
+                clauses.append(table.c.user_id == user_id)
+                if tenant_id:
+                    clauses.append(table.c.tenant_id == tenant_id)
+            return sqlalchemy.and_(*clauses)
+
+        return [row['id'] for row in
+                self._select(self.get_session(), ['id'], where)]
+
+    def list_revoked_tokens(self, since=None):
+        def where(table, now):
+            clauses = [sqlalchemy.not_(table.c.valid), table.c.expires > now]
+            if since is not None:
+                clauses.append(table.c.revoked_at >= since)
+            return sqlalchemy.and_(*clauses)
+
+        rows = self._select(self.get_session(), ['id', 'expires'], where)
+        return [{'id': row['id'], 'expires': row['expires']} for row in rows]
+
+    def create_revocation_event(self, event):
+        self._events.create_revocation_event(event)
+
+    def list_revocation_events(self):
+        return self._events.list_revocation_events()
+
+    def flush_expired_tokens(self):
+        """Drop the tables whose tokens have all expired.
+
+        :returns: None, as the tokens of a dropped table are not counted
+
+        """
+        self._events.flush_expired_revocation_events()
+        cutoff = timeutils.utcnow() - datetime.timedelta(seconds=DROP_DELAY)
+        engine = self.get_engine()
+        for name in engine.table_names():
+            match = _TABLE_NAME.match(name)
+            if not match:
+                continue
+            partition = (int(match.group(1)), int(match.group(2)))
+            if _partition_end(partition) > cutoff:
+                continue
+            _define_table(sqlalchemy.MetaData(), partition).drop(
+                engine, checkfirst=True)
+            LOG.info(_('Dropped expired token table %s.'), name)
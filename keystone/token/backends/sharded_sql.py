@@ -0,0 +1,158 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import bisect
+import hashlib
+
+import eventlet
+
+from keystone.common import sql
+from keystone.common.sql import migration
+from keystone import config
+from keystone import exception
+from keystone import token
+from keystone.token.backends import sql as token_sql
+
+
+CONF = config.CONF
+config.register_list('shard_connections', group='token', default=[])
+
+# points each shard owns on the hash ring; more points spread tokens more
+# evenly between shards
+RING_POINTS = 128
+
+
+def _hash(value):
+    return int(hashlib.md5(value).hexdigest()[:16], 16)
+
+
+class Shard(token_sql.Token):
+    """The SQL token driver, bound to one shard's database."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get_engine(self, allow_global_engine=True):
+        if self._engine is None:
+            self._engine = sql.new_engine(self.connection)
+        return self._engine
+
+    def flush_expired_revocation_events(self):
+        # kept in [sql] connection rather than in the shards
+        pass
+
+
+class Token(sql.Base, token.Driver):
+    """Token driver spreading tokens over several SQL databases.
+
+    Each token is stored in one of the databases listed in ``[token]
+    shard_connections``, chosen by consistent hashing of its unique id, so
+    only one database is involved in creating, validating or revoking a
+    token. Listing, bulk revocation and flushing fan out to every shard
+    concurrently. Without any ``shard_connections``, ``[sql] connection``
+    is the only shard.
+
+    Leases, such as the token reaper's, and the revocation events of
+    compact tokens are kept in ``[sql] connection``.
+    Shards are identified by their position in the list. Appending a shard
+    moves about 1/N of the token ids to it; tokens already issued under
+    those ids are no longer found.
+
+    """
+
+    def __init__(self):
+        connections = CONF.token.shard_connections or [CONF.sql.connection]
+        self.shards = [Shard(connection) for connection in connections]
+        self._ring = sorted((_hash('shard-%d-%d' % (index, point)), index)
+                            for index in range(len(self.shards))
+                            for point in range(RING_POINTS))
+        self._points = [point for point, index in self._ring]
+        self._events = token_sql.Token()
+
+    def _shard(self, token_id):
+        key = token.unique_id(token_id)
+        i = bisect.bisect(self._points, _hash(key)) % len(self._ring)
+        return self.shards[self._ring[i][1]]
+
+    def _map(self, call, shards):
+        """Call a function on each shard concurrently, listing the results.
+
+        Each call has a pile of its own, so concurrent requests do not
+        wait for each other's shards.
+
+        """
+        pile = eventlet.GreenPile(len(shards))
+        for shard in shards:
+            pile.spawn(call, shard)
+        return list(pile)
+
+    def _fan_out(self, method, *args, **kwargs):
+        """Call a method on every shard concurrently, listing the results."""
+        return self._map(lambda shard: getattr(shard, method)(*args,
+                                                              **kwargs),
+                         self.shards)
+
+    def db_sync(self, version=None):
+        for shard in self.shards:
+            migration.db_sync(version=version, connection=shard.connection)
+
+    # Public interface
+    def get_token(self, token_id):
+        if token_id is None:
+            raise exception.TokenNotFound(token_id=token_id)
+        return self._shard(token_id).get_token(token_id)
+
+    def create_token(self, token_id, data):
+        return self._shard(token_id).create_token(token_id, data)
+
+    def create_tokens(self, tokens):
+        by_shard = {}
+        for token_id, data in tokens:
+            by_shard.setdefault(self._shard(token_id), []).append(
+                (token_id, data))
+        self._map(lambda shard: shard.create_tokens(by_shard[shard]),
+                  list(by_shard))
+
+    def delete_token(self, token_id):
+        return self._shard(token_id).delete_token(token_id)
+
+    def delete_tokens(self, user_id, tenant_id=None, trust_id=None):
+        self._fan_out('delete_tokens', user_id, tenant_id=tenant_id,
+                      trust_id=trust_id)
+
+    def list_tokens(self, user_id, tenant_id=None, trust_id=None):
+        tokens = []
+        for shard_tokens in self._fan_out('list_tokens', user_id,
+                                          tenant_id=tenant_id,
+                                          trust_id=trust_id):
+            tokens.extend(shard_tokens)
+        return tokens
+
+    def list_revoked_tokens(self, since=None):
+        tokens = []
+        for shard_tokens in self._fan_out('list_revoked_tokens', since=since):
+            tokens.extend(shard_tokens)
+        return tokens
+
+    def create_revocation_event(self, event):
+        self._events.create_revocation_event(event)
+
+    def list_revocation_events(self):
+        return self._events.list_revocation_events()
+
+    def flush_expired_tokens(self):
+        self._events.flush_expired_revocation_events()
+        return sum(self._fan_out('flush_expired_tokens'))
@@ -16,14 +16,24 @@
 
 import copy
 import datetime
+import time
+import uuid
 
-
+from keystone.common import logging
 from keystone.common import sql
+from keystone import config
 from keystone import exception
 from keystone.openstack.common import timeutils
 from keystone import token
 
 
+CONF = config.CONF
+config.register_int('flush_batch_size', group='token', default=1000)
+config.register_float('flush_batch_pause', group='token', default=0.0)
+config.register_int('flush_max_runtime', group='token', default=0)
+LOG = logging.getLogger(__name__)
+
+
 class TokenModel(sql.ModelBase, sql.DictBase):
     __tablename__ = 'token'
     attributes = ['id', 'expires', 'user_id', 'trust_id']
@@ -33,6 +43,26 @@ class TokenModel(sql.ModelBase, sql.DictBase):
     valid = sql.Column(sql.Boolean(), default=True)
     user_id = sql.Column(sql.String(64))
     trust_id = sql.Column(sql.String(64), nullable=True)
+    revoked_at = sql.Column(sql.DateTime(), nullable=True)
+    # copied from the tenant in extra, so tokens can be filtered by tenant
+    # without decoding it; not one of the attributes returned to callers
+    tenant_id = sql.Column(sql.String(64), nullable=True)
+
+
+class RevocationEventModel(sql.ModelBase, sql.DictBase):
+    __tablename__ = 'revocation_event'
+    attributes = ['token_id', 'user_id', 'tenant_id', 'trust_id',
+                  'issued_before', 'expires']
+    id = sql.Column(sql.String(64), primary_key=True)
+    token_id = sql.Column(sql.String(64), nullable=True)
+    user_id = sql.Column(sql.String(64), nullable=True)
+    tenant_id = sql.Column(sql.String(64), nullable=True)
+    trust_id = sql.Column(sql.String(64), nullable=True)
+    issued_before = sql.Column(sql.DateTime(), nullable=False)
+    expires = sql.Column(sql.DateTime(), nullable=False)
+
+    def to_dict(self):
+        return dict((attr, getattr(self, attr)) for attr in self.attributes)
 
 
 class Token(sql.Base, token.Driver):
@@ -51,7 +81,7 @@ class Token(sql.Base, token.Driver):
             raise exception.TokenNotFound(token_id=token_id)
         return token_ref.to_dict()
 
-    def create_token(self, token_id, data):
+    def _token_model(self, token_id, data):
         data_copy = copy.deepcopy(data)
         if not data_copy.get('expires'):
             data_copy['expires'] = token.default_expire_time()
@@ -60,22 +90,44 @@ class Token(sql.Base, token.Driver):
 
         token_ref = TokenModel.from_dict(data_copy)
         token_ref.id = token.unique_id(token_id)
+        if data_copy.get('tenant'):
+            token_ref.tenant_id = data_copy['tenant'].get('id')
         token_ref.valid = True
+        return token_ref
+
+    def create_token(self, token_id, data):
+        token_ref = self._token_model(token_id, data)
         session = self.get_session()
         with session.begin():
             session.add(token_ref)
             session.flush()
         return token_ref.to_dict()
 
+    def create_tokens(self, tokens):
+        """Insert several tokens in one transaction.
+
+        The rows are flushed together, so they are inserted by a single
+        executemany rather than a statement per token.
+
+        """
+        token_refs = [self._token_model(token_id, data)
+                      for token_id, data in tokens]
+        session = self.get_session()
+        with session.begin():
+            session.add_all(token_refs)
+            session.flush()
+
     def delete_token(self, token_id):
         session = self.get_session()
         key = token.unique_id(token_id)
         with session.begin():
-            token_ref = session.query(TokenModel).get(key)
-            if not token_ref or not token_ref.valid:
-                raise exception.TokenNotFound(token_id=token_id)
-            token_ref.valid = False
-            session.flush()
+            query = session.query(TokenModel)
+            query = query.filter_by(id=key, valid=True)
+            revoked = query.update({'valid': False,
+                                    'revoked_at': timeutils.utcnow()},
+                                   synchronize_session=False)
+        if not revoked:
+            raise exception.TokenNotFound(token_id=token_id)
 
     def delete_tokens(self, user_id, tenant_id=None, trust_id=None):
         """Deletes all tokens in one session
@@ -96,49 +148,32 @@ class Token(sql.Base, token.Driver):
                 query = query.filter(TokenModel.trust_id == trust_id)
             else:
                 query = query.filter(TokenModel.user_id == user_id)
-
-            for token_ref in query.all():
-                if tenant_id:
-                    token_ref_dict = token_ref.to_dict()
-                    if not self._tenant_matches(tenant_id, token_ref_dict):
-                        continue
-                token_ref.valid = False
-
-            session.flush()
-
-    def _tenant_matches(self, tenant_id, token_ref_dict):
-        return ((tenant_id is None) or
-                (token_ref_dict.get('tenant') and
-                 token_ref_dict['tenant'].get('id') == tenant_id))
+            if tenant_id:
+                query = query.filter(TokenModel.tenant_id == tenant_id)
+            query.update({'valid': False, 'revoked_at': now},
+                         synchronize_session=False)
 
     def _list_tokens_for_trust(self, trust_id):
         session = self.get_session()
-        tokens = []
         now = timeutils.utcnow()
-        query = session.query(TokenModel)
+        query = session.query(TokenModel.id)
         query = query.filter(TokenModel.expires > now)
         query = query.filter(TokenModel.trust_id == trust_id)
 
         token_references = query.filter_by(valid=True)
-        for token_ref in token_references:
-            token_ref_dict = token_ref.to_dict()
-            tokens.append(token_ref_dict['id'])
-        return tokens
+        return [token_ref.id for token_ref in token_references]
 
     def _list_tokens_for_user(self, user_id, tenant_id=None):
         session = self.get_session()
-        tokens = []
         now = timeutils.utcnow()
-        query = session.query(TokenModel)
+        query = session.query(TokenModel.id)
         query = query.filter(TokenModel.expires > now)
         query = query.filter(TokenModel.user_id == user_id)
+        if tenant_id:
+            query = query.filter(TokenModel.tenant_id == tenant_id)
 
         token_references = query.filter_by(valid=True)
-        for token_ref in token_references:
-            token_ref_dict = token_ref.to_dict()
-            if self._tenant_matches(tenant_id, token_ref_dict):
-                tokens.append(token_ref['id'])
-        return tokens
+        return [token_ref.id for token_ref in token_references]
 
     def list_tokens(self, user_id, tenant_id=None, trust_id=None):
         if trust_id:
@@ -146,26 +181,89 @@ class Token(sql.Base, token.Driver):
         else:
             return self._list_tokens_for_user(user_id, tenant_id)
 
-    def list_revoked_tokens(self):
+    def list_revoked_tokens(self, since=None):
         session = self.get_session()
-        tokens = []
         now = timeutils.utcnow()
-        query = session.query(TokenModel)
+        # only the columns reported, leaving the extra blob in the database
+        query = session.query(TokenModel.id, TokenModel.expires)
         query = query.filter(TokenModel.expires > now)
+        if since is not None:
+            query = query.filter(TokenModel.revoked_at >= since)
         token_references = query.filter_by(valid=False)
-        for token_ref in token_references:
-            record = {
-                'id': token_ref['id'],
-                'expires': token_ref['expires'],
-            }
-            tokens.append(record)
-        return tokens
+        return [{'id': token_ref.id, 'expires': token_ref.expires}
+                for token_ref in token_references]
+
+    def create_revocation_event(self, event):
+        event_ref = RevocationEventModel(id=uuid.uuid4().hex)
+        for attr in RevocationEventModel.attributes:
+            setattr(event_ref, attr, event.get(attr))
+        session = self.get_session()
+        with session.begin():
+            session.add(event_ref)
+
+    def list_revocation_events(self):
+        session = self.get_session()
+        query = session.query(RevocationEventModel)
+        query = query.filter(RevocationEventModel.expires > timeutils.utcnow())
+        return [event_ref.to_dict() for event_ref in query]
+
+    def flush_expired_revocation_events(self):
+        session = self.get_session()
+        with session.begin():
+            query = session.query(RevocationEventModel)
+            query = query.filter(
+                RevocationEventModel.expires < timeutils.utcnow())
+            query.delete(synchronize_session=False)
 
     def flush_expired_tokens(self):
+        """Delete expired tokens, ``[token] flush_batch_size`` at a time.
+
+        Each batch is deleted in a transaction of its own, followed by a
+        pause of ``[token] flush_batch_pause`` seconds, so the flush does
+        not hold long locks on the token table. The flush stops early once
+        it has run for ``[token] flush_max_runtime`` seconds; whatever is
+        left is deleted by the next run. A batch size of 0 deletes every
+        expired token in a single statement.
+
+        Expired revocation events are deleted too, in a single statement:
+        there are far fewer of them than of tokens.
+
+        :returns: the number of tokens deleted
+
+        """
+        now = timeutils.utcnow()
+        batch_size = CONF.token.flush_batch_size
         session = self.get_session()
+        self.flush_expired_revocation_events()
 
-        query = session.query(TokenModel)
-        query = query.filter(TokenModel.expires < timeutils.utcnow())
-        query.delete(synchronize_session=False)
+        if batch_size <= 0:
+            with session.begin():
+                query = session.query(TokenModel)
+                query = query.filter(TokenModel.expires < now)
+                deleted = query.delete(synchronize_session=False)
+            LOG.info(_('Flushed %d expired tokens.'), deleted)
+            return deleted
 
-        session.flush()
+        max_runtime = CONF.token.flush_max_runtime
+        deadline = time.time() + max_runtime if max_runtime > 0 else None
+        deleted = 0
+        while True:
+            with session.begin():
+                query = session.query(TokenModel.id)
+                query = query.filter(TokenModel.expires < now)
+                token_ids = [row.id for row in query.limit(batch_size)]
+                if token_ids:
+                    query = session.query(TokenModel)
+                    query = query.filter(TokenModel.id.in_(token_ids))
+                    deleted += query.delete(synchronize_session=False)
+            if len(token_ids) < batch_size:
+                break
+            LOG.info(_('Flushed %d expired tokens so far.'), deleted)
+            if deadline is not None and time.time() >= deadline:
+                LOG.warning(_('Stopped flushing expired tokens after '
+                              '%d seconds; the remainder will be flushed by '
+                              'the next run.'), max_runtime)
+                break
+            time.sleep(CONF.token.flush_batch_pause)
+        LOG.info(_('Flushed %d expired tokens.'), deleted)
+        return deleted
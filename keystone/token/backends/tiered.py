@@ -0,0 +1,192 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import copy
+import datetime
+import threading
+import uuid
+
+from keystone.common import sql
+from keystone.common import utils
+from keystone import config
+from keystone import exception
+from keystone.openstack.common import timeutils
+from keystone import token
+from keystone.token.backends import memcache as token_memcache
+from keystone.token.backends import sql as token_sql
+
+
+CONF = config.CONF
+config.register_int('tier_local_size', group='token', default=0)
+config.register_int('tier_local_time', group='token', default=30)
+
+
+class _LocalTier(object):
+    """Token references held by this process, by unique token id.
+
+    Holds up to ``[token] tier_local_size`` entries, evicting the least
+    recently used, each for at most ``[token] tier_local_time`` seconds and
+    never past the token's expiry. Every entry records the revocation marker
+    current when its reference was read, and is only served while that
+    marker is.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = utils.LRUCache()
+
+    def get(self, key, marker):
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry[0] != marker:
+            return None
+        return copy.deepcopy(entry[1])
+
+    def set(self, key, token_ref, marker):
+        size = CONF.token.tier_local_size
+        expires = token_ref.get('expires')
+        if size <= 0 or marker is None:
+            return
+        valid_until = timeutils.utcnow() + datetime.timedelta(
+            seconds=CONF.token.tier_local_time)
+        if isinstance(expires, datetime.datetime):
+            valid_until = min(expires, valid_until)
+        entry = (marker, copy.deepcopy(token_ref))
+        with self._lock:
+            self._entries.set(key, entry, valid_until, size)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key)
+
+
+class Token(sql.Base, token.Driver):
+    """Token driver layering a local, a memcache and an SQL store.
+
+    Tokens are written through to SQL, which is authoritative, and to
+    memcache, which shares them between processes. Reads are served by the
+    first tier holding the token: an in-process store, then memcache, then
+    SQL, and fill the tiers above it. Listing tokens, listing revocations,
+    revocation events and flushing are served by SQL.
+
+    Revoking a token revokes it in SQL first, then in memcache, then
+    replaces the revocation marker kept in memcache, so a token revoked in
+    SQL is never copied back up. The in-process store is off unless
+    ``[token] tier_local_size`` is set; each of its reads costs a memcache
+    read of the marker, and any revocation, by any process, makes every
+    entry read before it stale.
+
+    """
+
+    revocation_marker_key = 'tier-revocation-marker'
+
+    def __init__(self, shared=None, durable=None):
+        self.shared = shared or token_memcache.Token()
+        self.durable = durable or token_sql.Token()
+        self.local = _LocalTier()
+
+    def _revocation_marker(self):
+        """Return the current revocation marker, or None if local is off."""
+        if CONF.token.tier_local_size <= 0:
+            return None
+        client = self.shared.client
+        marker = client.get(self.revocation_marker_key)
+        if marker is None:
+            # a marker lost from memcache comes back as a new value, so the
+            # entries read under the old one are not served again
+            client.add(self.revocation_marker_key, uuid.uuid4().hex)
+            marker = client.get(self.revocation_marker_key)
+        return marker
+
+    def _replace_revocation_marker(self):
+        self.shared.client.set(self.revocation_marker_key, uuid.uuid4().hex)
+
+    def _forget(self, token_id):
+        key = token.unique_id(token_id)
+        self.shared.client.delete(self.shared._prefix_token_id(key))
+        self._replace_revocation_marker()
+        self.local.delete(key)
+
+    # Public interface
+    def get_token(self, token_id):
+        if token_id is None:
+            raise exception.TokenNotFound(token_id=token_id)
+        key = token.unique_id(token_id)
+        # read before the tiers below, so a revocation made while they are
+        # read leaves the entry filled from them stale
+        marker = self._revocation_marker()
+        if marker is not None:
+            token_ref = self.local.get(key, marker)
+            if token_ref is not None:
+                return token_ref
+        try:
+            token_ref = self.shared.get_token(token_id)
+        except exception.TokenNotFound:
+            token_ref = self.durable.get_token(token_id)
+            self.shared.create_token(token_id, token_ref)
+            # a revocation that slipped in between the read and the copy
+            # would not have removed the copy
+            try:
+                self.durable.get_token(token_id)
+            except exception.TokenNotFound:
+                self._forget(token_id)
+                raise
+        self.local.set(key, token_ref, marker)
+        return token_ref
+
+    def create_token(self, token_id, data):
+        marker = self._revocation_marker()
+        token_ref = self.durable.create_token(token_id, data)
+        self.shared.create_token(token_id, token_ref)
+        self.local.set(token.unique_id(token_id), token_ref, marker)
+        return copy.deepcopy(token_ref)
+
+    def create_tokens(self, tokens):
+        # the upper tiers are filled by the first read of each token
+        self.durable.create_tokens(tokens)
+
+    def delete_token(self, token_id):
+        self.durable.delete_token(token_id)
+        self._forget(token_id)
+
+    def delete_tokens(self, user_id, tenant_id=None, trust_id=None):
+        self.durable.delete_tokens(user_id, tenant_id=tenant_id,
+                                   trust_id=trust_id)
+        token_refs = self.shared._list_token_refs(user_id, tenant_id,
+                                                  trust_id)
+        if token_refs:
+            self.shared.client.delete_multi(
+                [self.shared._prefix_token_id(token_id)
+                 for token_id in token_refs])
+        self._replace_revocation_marker()
+
+    def list_tokens(self, user_id, tenant_id=None, trust_id=None):
+        return self.durable.list_tokens(user_id, tenant_id=tenant_id,
+                                        trust_id=trust_id)
+
+    def list_revoked_tokens(self, since=None):
+        return self.durable.list_revoked_tokens(since=since)
+
+    def create_revocation_event(self, event):
+        self.durable.create_revocation_event(event)
+
+    def list_revocation_events(self):
+        return self.durable.list_revocation_events()
+
+    def flush_expired_tokens(self):
+        # memcache and the local store drop expired tokens by themselves
+        return self.durable.flush_expired_tokens()
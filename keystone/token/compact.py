@@ -0,0 +1,328 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compact tokens, validated without reading the token store.
+
+A compact token carries its user, scope, role ids, methods and lifetime in
+a binary payload, authenticated by an HMAC-SHA256 keyed with the first of
+the ``[signing] compact_keys``. Tokens are accepted under any of the keys,
+so keys are rotated by putting a new key first and dropping the last one
+once ``[token] expiration`` has passed. The payload decodes to a slim token
+record (see :mod:`keystone.token.records`), which is filled in like any
+other.
+
+The payload is, in network byte order::
+
+    version     1 byte
+    flags       1 byte
+    issued_at   4 bytes, seconds since the epoch
+    expires     4 bytes, seconds since the epoch
+    user_id     id
+    scope_id    id, if project or domain scoped
+    role_ids    1 byte count, then as many ids
+    methods     1 byte count, then as many strings (v3 only)
+    trust       trust, trustor and trustee ids (trust scoped only)
+    extras      2 byte length, then JSON (v3 only, if not empty)
+
+An id of 32 hex digits takes 17 bytes: a 0xff byte and its 16 bytes. Other
+ids and strings take a byte for their UTF-8 length, then the bytes.
+
+"""
+
+import base64
+import calendar
+import datetime
+import hashlib
+import hmac
+import json
+import re
+import struct
+
+from keystone import config
+from keystone import exception
+from keystone.openstack.common import timeutils
+from keystone.token import records
+
+
+CONF = config.CONF
+
+VERSION = 0xab
+
+# payload flags
+V3 = 0x01
+PROJECT_SCOPED = 0x02
+DOMAIN_SCOPED = 0x04
+TRUST_SCOPED = 0x08
+IMPERSONATION = 0x10
+EXTRAS = 0x20
+
+MAC_SIZE = 16
+_UUID_TAG = 0xff
+_HEX_ID = re.compile(r'^[0-9a-f]{32}$')
+_HEADER = struct.Struct('!BBII')
+
+# the base64 form of every compact token starts with this character, and is
+# at least as long as a token holding just a user id
+PREFIX = base64.urlsafe_b64encode(chr(VERSION))[0]
+MIN_LENGTH = len(base64.urlsafe_b64encode(
+    '\0' * (_HEADER.size + 2 + 1 + MAC_SIZE)).rstrip('='))
+
+
+def is_compact(token_id):
+    return (isinstance(token_id, basestring) and
+            len(token_id) >= MIN_LENGTH and token_id[0] == PREFIX)
+
+
+def _mac(key, payload):
+    return hmac.new(key.encode('utf-8'), payload,
+                    hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def _seconds(when):
+    return calendar.timegm(when.timetuple())
+
+
+class _Writer(object):
+    def __init__(self):
+        self.parts = []
+
+    def byte(self, value):
+        self.parts.append(chr(value))
+
+    def string(self, value):
+        value = value.encode('utf-8')
+        if len(value) >= _UUID_TAG:
+            raise exception.UnexpectedError(
+                _('Value too long for a compact token: %s') % value)
+        self.byte(len(value))
+        self.parts.append(value)
+
+    def id(self, value):
+        if _HEX_ID.match(value):
+            self.byte(_UUID_TAG)
+            self.parts.append(value.decode('hex'))
+        else:
+            self.string(value)
+
+    def ids(self, values):
+        self.byte(len(values))
+        for value in values:
+            self.id(value)
+
+    def strings(self, values):
+        self.byte(len(values))
+        for value in values:
+            self.string(value)
+
+    def blob(self, value):
+        self.parts.append(struct.pack('!H', len(value)))
+        self.parts.append(value)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+
+class _Reader(object):
+    def __init__(self, data, offset):
+        self.data = data
+        self.offset = offset
+
+    def _take(self, size):
+        if self.offset + size > len(self.data):
+            raise ValueError('truncated compact token')
+        value = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return value
+
+    def byte(self):
+        return ord(self._take(1))
+
+    def string(self, size=None):
+        size = self.byte() if size is None else size
+        return self._take(size).decode('utf-8')
+
+    def id(self):
+        size = self.byte()
+        if size == _UUID_TAG:
+            return unicode(self._take(16).encode('hex'))
+        return self.string(size)
+
+    def ids(self):
+        return [self.id() for i in range(self.byte())]
+
+    def strings(self):
+        return [self.string() for i in range(self.byte())]
+
+    def blob(self):
+        size, = struct.unpack('!H', self._take(2))
+        return self._take(size)
+
+
+def encode(record, key):
+    """Return the compact token of a slim token record.
+
+    :param record: a slim token record, from
+                   :func:`keystone.token.records.slim`
+    :param key: the key to authenticate the token with
+
+    """
+    issued_at = timeutils.utcnow()
+    body = record.get('token_data', {}).get('token')
+    metadata = record.get('metadata') or {}
+    flags = 0
+    scope_id = None
+    trust = None
+    if body is not None:
+        flags |= V3
+        issued_at = timeutils.normalize_time(
+            timeutils.parse_isotime(body['issued_at']))
+        if 'project' in body:
+            flags |= PROJECT_SCOPED
+            scope_id = body['project']['id']
+        elif 'domain' in body:
+            flags |= DOMAIN_SCOPED
+            scope_id = body['domain']['id']
+        role_ids = [role['id'] for role in body.get('roles', [])]
+        if 'OS-TRUST:trust' in body:
+            trust = body['OS-TRUST:trust']
+            trust = (trust['id'], trust['trustor_user']['id'],
+                     trust['trustee_user']['id'], trust['impersonation'])
+        if body.get('extras'):
+            flags |= EXTRAS
+    else:
+        if record.get('tenant'):
+            flags |= PROJECT_SCOPED
+            scope_id = record['tenant']['id']
+        role_ids = metadata.get('roles', [])
+        if metadata.get('trust_id'):
+            # v2 tokens only know their trustee
+            trust = (metadata['trust_id'], metadata['trustee_user_id'],
+                     metadata['trustee_user_id'], False)
+    if trust is not None:
+        flags |= TRUST_SCOPED
+        if trust[3]:
+            flags |= IMPERSONATION
+
+    writer = _Writer()
+    writer.parts.append(_HEADER.pack(VERSION, flags, _seconds(issued_at),
+                                     _seconds(record['expires'])))
+    writer.id(record['user']['id'])
+    if scope_id is not None:
+        writer.id(scope_id)
+    writer.ids(role_ids)
+    if flags & V3:
+        writer.strings(body['methods'])
+    if trust is not None:
+        writer.ids(trust[:3])
+    if flags & EXTRAS:
+        writer.blob(json.dumps(body['extras']))
+    payload = writer.getvalue()
+    return base64.urlsafe_b64encode(payload + _mac(key, payload)).rstrip('=')
+
+
+def decode(token_id, keys):
+    """Return the slim token record of a compact token.
+
+    Returns records of expired tokens too; their ``expires`` is in the past.
+
+    :raises: keystone.exception.TokenNotFound if the token is malformed or
+             not authenticated by any of the keys
+
+    """
+    try:
+        data = base64.urlsafe_b64decode(
+            str(token_id) + '=' * (-len(token_id) % 4))
+    except (TypeError, UnicodeEncodeError):
+        raise exception.TokenNotFound(token_id=token_id)
+    # the decoder ignores padding, stray characters and unused bits, so
+    # only the encoding encode() produces is accepted: revocation and
+    # caching go by the token id, which must not have several spellings
+    if base64.urlsafe_b64encode(data).rstrip('=') != token_id:
+        raise exception.TokenNotFound(token_id=token_id)
+    payload, mac = data[:-MAC_SIZE], data[-MAC_SIZE:]
+    # compare against every key, so timing does not reveal which one
+    # matched
+    if not [key for key in keys if _equal(_mac(key, payload), mac)]:
+        raise exception.TokenNotFound(token_id=token_id)
+    try:
+        return _parse(token_id, payload)
+    except (ValueError, struct.error):
+        raise exception.TokenNotFound(token_id=token_id)
+
+
+def _equal(a, b):
+    result = len(a) ^ len(b)
+    for x, y in zip(a, b):
+        result |= ord(x) ^ ord(y)
+    return result == 0
+
+
+def _parse(token_id, payload):
+    version, flags, issued_at, expires = _HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError('unknown compact token version')
+    issued_at = datetime.datetime.utcfromtimestamp(issued_at)
+    expires = datetime.datetime.utcfromtimestamp(expires)
+    reader = _Reader(payload, _HEADER.size)
+    user_id = reader.id()
+    scope_id = None
+    if flags & (PROJECT_SCOPED | DOMAIN_SCOPED):
+        scope_id = reader.id()
+    role_ids = reader.ids()
+    methods = reader.strings() if flags & V3 else None
+    trust_ids = reader.ids() if flags & TRUST_SCOPED else None
+    extras = json.loads(reader.blob()) if flags & EXTRAS else {}
+    if reader.offset != len(payload):
+        raise ValueError('trailing data in compact token')
+
+    project_id = scope_id if flags & PROJECT_SCOPED else None
+    record = {'id': token_id,
+              'key': token_id,
+              'issued_at': issued_at,
+              'expires': expires,
+              'user_id': user_id,
+              'user': {'id': user_id},
+              'tenant': {'id': project_id} if project_id else None,
+              'trust_id': trust_ids[0] if trust_ids else None,
+              'metadata': {'roles': role_ids},
+              'slim': records.SLIM_VERSION}
+    if not flags & V3:
+        if trust_ids:
+            record['metadata']['trust_id'] = trust_ids[0]
+            record['metadata']['trustee_user_id'] = trust_ids[2]
+        return record
+
+    body = {'methods': methods,
+            'extras': extras,
+            'issued_at': timeutils.isotime(issued_at, subsecond=True),
+            'expires_at': timeutils.isotime(expires, subsecond=True),
+            'user': {'id': user_id}}
+    if project_id:
+        body['project'] = {'id': project_id}
+    elif scope_id:
+        body['domain'] = {'id': scope_id}
+    if scope_id:
+        body['roles'] = [{'id': role_id} for role_id in role_ids]
+    else:
+        record['metadata']['roles'] = []
+    if trust_ids:
+        body['OS-TRUST:trust'] = {
+            'id': trust_ids[0],
+            'trustor_user': {'id': trust_ids[1]},
+            'trustee_user': {'id': trust_ids[2]},
+            'impersonation': bool(flags & IMPERSONATION)}
+    record['token_data'] = {'token': body}
+    return record
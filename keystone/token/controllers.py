@@ -7,6 +7,7 @@ from keystone.common import controller
 from keystone.common import dependency
 from keystone.common import logging
 from keystone.common import utils
+from keystone.common import wsgi
 from keystone import config
 from keystone import exception
 from keystone.openstack.common import timeutils
@@ -78,8 +79,8 @@ class Auth(controller.V2Controller):
                 auth_info = self._authenticate_local(
                     context, auth)
 
-        user_ref, tenant_ref, metadata_ref, expiry = auth_info
-        core.validate_auth_info(self, context, user_ref, tenant_ref)
+        user_ref, tenant_ref, metadata_ref, domains, expiry = auth_info
+        core.validate_auth_info(self, context, user_ref, tenant_ref, domains)
         trust_id = metadata_ref.get('trust_id')
         user_ref = self._filter_domain_id(user_ref)
         if tenant_ref:
@@ -100,10 +101,9 @@ class Auth(controller.V2Controller):
 
         auth_token_data['id'] = 'placeholder'
 
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            role_ref = self.identity_api.get_role(context, role_id)
-            roles_ref.append(dict(name=role_ref['name']))
+        roles_ref = [dict(name=role_ref['name'])
+                     for role_ref in self.identity_api.get_roles(
+                         context, metadata_ref.get('roles', []))]
 
         token_data = Auth.format_token(auth_token_data, roles_ref)
 
@@ -120,10 +120,20 @@ class Auth(controller.V2Controller):
             except subprocess.CalledProcessError:
                 raise exception.UnexpectedError(_(
                     'Unable to sign token.'))
+        elif CONF.signing.token_format == 'COMPACT':
+            # compact tokens are not stored
+            token_id = self.token_api.create_compact_token(
+                context, dict(expires=auth_token_data['expires'],
+                              user=user_ref,
+                              tenant=tenant_ref,
+                              metadata=metadata_ref,
+                              trust_id=trust_id))
+            token_data['access']['token']['id'] = token_id
+            return token_data
         else:
             raise exception.UnexpectedError(_(
                 'Invalid value for token_format: %s.'
-                '  Allowed values are PKI or UUID.') %
+                '  Allowed values are PKI, UUID or COMPACT.') %
                 CONF.signing.token_format)
         try:
             self.token_api.create_token(
@@ -192,36 +202,26 @@ class Auth(controller.V2Controller):
                 if expiry < timeutils.parse_isotime(timeutils.isotime()):
                     raise exception.Forbidden()()
             user_id = trust_ref['trustor_user_id']
-            trustor_user_ref = (self.identity_api.get_user(
-                                context=context,
-                                user_id=trust_ref['trustor_user_id']))
+
+        tenant_id = self._get_project_id_from_auth(context, auth)
+
+        # TODO(henry-nash): If no tenant was specified, instead check for a
+        # domain and find any related user/group roles
+
+        (current_user_ref, tenant_ref, metadata_ref, domains) = (
+            self._resolve_scope(context, user_id, tenant_id))
+
+        if CONF.trust.enabled and 'trust_id' in auth:
+            trustor_user_ref = current_user_ref
             if not trustor_user_ref['enabled']:
                 raise exception.Forbidden()()
             trustee_user_ref = self.identity_api.get_user(
                 context, trust_ref['trustee_user_id'])
             if not trustee_user_ref['enabled']:
                 raise exception.Forbidden()()
-            if trust_ref['impersonation'] == 'True':
-                current_user_ref = trustor_user_ref
-            else:
+            if trust_ref['impersonation'] != 'True':
                 current_user_ref = trustee_user_ref
 
-        else:
-            current_user_ref = self.identity_api.get_user(context=context,
-                                                          user_id=user_id)
-
-        tenant_id = self._get_project_id_from_auth(context, auth)
-
-        tenant_ref = self._get_project_ref(context, user_id, tenant_id)
-        metadata_ref = self._get_metadata_ref(context, user_id, tenant_id)
-
-        # TODO(henry-nash): If no tenant was specified, instead check for a
-        # domain and find any related user/group roles
-
-        self._append_roles(metadata_ref,
-                           self._get_group_metadata_ref(
-                               context, user_id, tenant_id))
-
         expiry = old_token_ref['expires']
         if CONF.trust.enabled and 'trust_id' in auth:
             trust_id = auth['trust_id']
@@ -241,7 +241,7 @@ class Auth(controller.V2Controller):
             metadata_ref['trustee_user_id'] = trust_ref['trustee_user_id']
             metadata_ref['trust_id'] = trust_id
 
-        return (current_user_ref, tenant_ref, metadata_ref, expiry)
+        return (current_user_ref, tenant_ref, metadata_ref, domains, expiry)
 
     def _authenticate_local(self, context, auth):
         """Try to authenticate against the identity backend.
@@ -290,28 +290,21 @@ class Auth(controller.V2Controller):
         tenant_id = self._get_project_id_from_auth(context, auth)
 
         try:
-            auth_info = self.identity_api.authenticate(
+            self.identity_api.authenticate(
                 context=context,
                 user_id=user_id,
-                password=password,
-                tenant_id=tenant_id)
+                password=password)
         except AssertionError as e:
             raise exception.Unauthorized(e)
-        (user_ref, tenant_ref, metadata_ref) = auth_info
 
-        # By now we will have authorized and if a tenant/project was
-        # specified, we will have obtained its metadata.  In this case
-        # we just need to add in any group roles.
-        #
         # TODO(henry-nash): If no tenant was specified, instead check for a
         # domain and find any related user/group roles
 
-        self._append_roles(metadata_ref,
-                           self._get_group_metadata_ref(
-                               context, user_id, tenant_id))
+        (user_ref, tenant_ref, metadata_ref, domains) = self._resolve_scope(
+            context, user_id, tenant_id)
 
         expiry = core.default_expire_time()
-        return (user_ref, tenant_ref, metadata_ref, expiry)
+        return (user_ref, tenant_ref, metadata_ref, domains, expiry)
 
     def _authenticate_external(self, context, auth):
         """Try to authenticate an external user via REMOTE_USER variable.
@@ -332,18 +325,14 @@ class Auth(controller.V2Controller):
 
         tenant_id = self._get_project_id_from_auth(context, auth)
 
-        tenant_ref = self._get_project_ref(context, user_id, tenant_id)
-        metadata_ref = self._get_metadata_ref(context, user_id, tenant_id)
-
         # TODO(henry-nash): If no tenant was specified, instead check for a
         # domain and find any related user/group roles
 
-        self._append_roles(metadata_ref,
-                           self._get_group_metadata_ref(
-                               context, user_id, tenant_id))
+        (user_ref, tenant_ref, metadata_ref, domains) = self._resolve_scope(
+            context, user_id, tenant_id)
 
         expiry = core.default_expire_time()
-        return (user_ref, tenant_ref, metadata_ref, expiry)
+        return (user_ref, tenant_ref, metadata_ref, domains, expiry)
 
     def _get_auth_token_data(self, user, tenant, metadata, expiry):
         return dict(user=user,
@@ -395,61 +384,27 @@ class Auth(controller.V2Controller):
                 raise exception.Unauthorized(e)
         return domain_id
 
-    def _get_project_ref(self, context, user_id, tenant_id):
-        """Returns the tenant_ref for the user's tenant."""
-        tenant_ref = None
-        if tenant_id:
-            tenants = self.identity_api.get_projects_for_user(context, user_id)
-            if tenant_id not in tenants:
-                msg = 'User %s is unauthorized for tenant %s' % (
-                    user_id, tenant_id)
-                LOG.warning(msg)
-                raise exception.Unauthorized(msg)
-
-            try:
-                tenant_ref = self.identity_api.get_project(context=context,
-                                                           tenant_id=tenant_id)
-            except exception.ProjectNotFound as e:
-                exception.Unauthorized(e)
-        return tenant_ref
+    def _resolve_scope(self, context, user_id, tenant_id):
+        """Returns the user, tenant, metadata and domain refs of the scope.
 
-    def _get_metadata_ref(self, context, user_id=None, tenant_id=None,
-                          domain_id=None, group_id=None):
-        """Returns metadata_ref for a user or group in a tenant or domain."""
+        The metadata carries the roles the user has on the tenant, directly
+        or through its groups.
 
-        metadata_ref = {}
-        if (user_id or group_id) and (tenant_id or domain_id):
-            try:
-                metadata_ref = self.identity_api.get_metadata(
-                    context=context, user_id=user_id, tenant_id=tenant_id,
-                    domain_id=domain_id, group_id=group_id)
-            except exception.MetadataNotFound:
-                pass
-        return metadata_ref
-
-    def _get_group_metadata_ref(self, context, user_id,
-                                tenant_id=None, domain_id=None):
-        """Return any metadata for this project/domain due to group grants."""
-        group_refs = self.identity_api.list_groups_for_user(context=context,
-                                                            user_id=user_id)
-        metadata_ref = {}
-        for x in group_refs:
-            metadata_ref.update(self._get_metadata_ref(context,
-                                                       group_id=x['id'],
-                                                       tenant_id=tenant_id,
-                                                       domain_id=domain_id))
-        return metadata_ref
-
-    def _append_roles(self, metadata, additional_metadata):
-        """Add additional roles to the roles in metadata.
-
-        The final set of roles represents the union of existing roles and
-        additional roles.
         """
-
-        first = set(metadata.get('roles', []))
-        second = set(additional_metadata.get('roles', []))
-        metadata['roles'] = list(first.union(second))
+        try:
+            scope = self.identity_api.resolve_auth_scope(
+                context=context, user_id=user_id, project_id=tenant_id)
+        except exception.ProjectNotFound as e:
+            raise exception.Unauthorized(e)
+        if tenant_id and not scope['member']:
+            msg = 'User %s is unauthorized for tenant %s' % (
+                user_id, tenant_id)
+            LOG.warning(msg)
+            raise exception.Unauthorized(msg)
+        metadata_ref = scope['metadata']
+        metadata_ref['roles'] = scope['roles']
+        return (scope['user'], scope['project'], metadata_ref,
+                scope['domains'])
 
     def _get_token_ref(self, context, token_id, belongs_to=None):
         """Returns a token if a valid one exists.
@@ -539,9 +494,8 @@ class Auth(controller.V2Controller):
         #               the return for metadata
         # fill out the roles in the metadata
         metadata_ref = token_ref['metadata']
-        roles_ref = []
-        for role_id in metadata_ref.get('roles', []):
-            roles_ref.append(self.identity_api.get_role(context, role_id))
+        roles_ref = self.identity_api.get_roles(
+            context, metadata_ref.get('roles', []))
 
         # Get a service catalog if possible
         # This is needed for on-behalf-of requests
@@ -562,19 +516,43 @@ class Auth(controller.V2Controller):
 
     @controller.protected
     def revocation_list(self, context, auth=None):
-        tokens = self.token_api.list_revoked_tokens(context)
+        """Return the signed list of revoked tokens.
 
-        for t in tokens:
-            expires = t['expires']
-            if not (expires and isinstance(expires, unicode)):
-                    t['expires'] = timeutils.isotime(expires)
-        data = {'revoked': tokens}
-        json_data = json.dumps(data)
-        signed_text = cms.cms_sign_text(json_data,
-                                        CONF.signing.certfile,
-                                        CONF.signing.keyfile)
+        A ``since`` query parameter, normally the ``cursor`` of a previous
+        response, limits the list to tokens revoked from that time on.
 
-        return {'signed': signed_text}
+        """
+        since = context.get('query_string', {}).get('since')
+        if since is not None:
+            try:
+                since = timeutils.normalize_time(
+                    timeutils.parse_isotime(since))
+            except ValueError:
+                raise exception.ValidationError(
+                    attribute='an ISO 8601 timestamp', target='since')
+
+        signed_text, etag, cursor = self.token_api.get_signed_revocation_list(
+            context, since=since)
+
+        headers = [('ETag', etag)]
+        if_none_match = context.get('headers', {}).get('If-None-Match')
+        if if_none_match and self._etag_matches(etag, if_none_match):
+            return wsgi.render_response(status=(304, 'Not Modified'),
+                                        headers=headers)
+        return wsgi.render_response(body={'signed': signed_text,
+                                          'cursor': cursor},
+                                    headers=headers)
+
+    @staticmethod
+    def _etag_matches(etag, if_none_match):
+        """Weakly compare an ETag against an If-None-Match header."""
+        for candidate in if_none_match.split(','):
+            candidate = candidate.strip()
+            if candidate.startswith('W/'):
+                candidate = candidate[2:]
+            if candidate in ('*', etag):
+                return True
+        return False
 
     def endpoints(self, context, token_id):
         """Return a list of endpoints available to the token."""
@@ -620,8 +598,8 @@ class Auth(controller.V2Controller):
                         }
              }
         if 'tenant' in token_ref and token_ref['tenant']:
-            token_ref['tenant']['enabled'] = True
-            o['access']['token']['tenant'] = token_ref['tenant']
+            o['access']['token']['tenant'] = dict(token_ref['tenant'],
+                                                  enabled=True)
         if catalog_ref is not None:
             o['access']['serviceCatalog'] = Auth.format_catalog(catalog_ref)
         if metadata_ref:
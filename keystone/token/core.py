@@ -16,32 +16,364 @@
 
 """Main entry point into the Token service."""
 
+import atexit
+import copy
 import datetime
+import hashlib
+import json
+import threading
+import time
+import weakref
 
 from keystone.common import cms
 from keystone.common import dependency
 from keystone.common import logging
 from keystone.common import manager
+from keystone.common import metrics
+from keystone.common import sql
+from keystone.common import utils
 from keystone import config
 from keystone import exception
 from keystone.openstack.common import timeutils
+from keystone.token import compact
+from keystone.token import records
 
 
 CONF = config.CONF
 config.register_int('expiration', group='token', default=86400)
+config.register_int('revocation_cache_time', group='token', default=60)
+config.register_int('revocation_cursor_overlap', group='token', default=30)
+config.register_int('revocation_events_cache_time', group='token', default=1)
+config.register_int('cache_size', group='token', default=0)
+config.register_int('cache_time', group='token', default=30)
+config.register_bool('write_behind', group='token', default=False)
+config.register_int('write_behind_queue_size', group='token', default=1000)
+config.register_float('write_behind_interval', group='token', default=1.0)
+config.register_int('write_behind_batch_size', group='token', default=100)
+config.register_bool('slim_records', group='token', default=False)
 LOG = logging.getLogger(__name__)
 
 
+# The signed revocation list is shared by every Manager in this process.
+# Revocations made through any of them bump the generation, which marks the
+# cached list as stale and prevents a rebuild that raced with the revocation
+# from being used. Deltas are cached by their ``since``, and signatures by
+# the ETag of what they sign, a few at a time.
+_revocation_list = {'generation': 0, 'cached': None,
+                    'deltas': utils.LRUCache(),
+                    'signatures': utils.LRUCache()}
+_revocation_lock = threading.Lock()
+_REVOCATION_CACHE_SIZE = 16
+
+
+def invalidate_revocation_list():
+    """Mark the cached signed revocation list of this process as stale."""
+    _revocation_list['generation'] += 1
+
+
+# The revocation events compact tokens are checked against, cached for
+# [token] revocation_events_cache_time seconds and made stale by the same
+# revocations as the signed revocation list.
+_revocation_events = {'generation': None, 'events': None,
+                      'valid_until': None}
+
+
+class _TokenCache(object):
+    """Validated token references, by unique id, shared by every Manager.
+
+    Holds up to ``[token] cache_size`` entries, evicting the least recently
+    used, each for at most ``[token] cache_time`` seconds and never past the
+    token's expiry. Revocations made by this process evict entries at once;
+    ``cache_time`` bounds how long revocations made by other processes go
+    unnoticed. Hits, misses and evictions are recorded under the
+    ``token_cache`` metrics collector.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = utils.LRUCache()
+        # bumped by every eviction, so a reference read from the driver
+        # before a revocation is not cached after it
+        self.generation = 0
+        self.stats = metrics.collector('token_cache')
+
+    def get(self, key):
+        if CONF.token.cache_size <= 0:
+            return None
+        with self._lock:
+            token_ref = self._entries.get(key)
+        if token_ref is not None:
+            self.stats.incr('hits')
+            return token_ref
+        self.stats.incr('misses')
+        return None
+
+    def set(self, key, token_ref, generation):
+        """Cache a token reference, frozen, as it is shared once cached.
+
+        :returns: the reference to hand out: the frozen one if cached
+
+        """
+        size = CONF.token.cache_size
+        expires = token_ref.get('expires')
+        if size <= 0 or not isinstance(expires, datetime.datetime):
+            return token_ref
+        valid_until = min(expires, timeutils.utcnow() + datetime.timedelta(
+            seconds=CONF.token.cache_time))
+        token_ref = utils.freeze(token_ref)
+        with self._lock:
+            if generation != self.generation:
+                return token_ref
+            evicted = self._entries.set(key, token_ref, valid_until, size)
+        if evicted:
+            self.stats.incr('evictions', evicted)
+        return token_ref
+
+    def delete(self, key):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key)
+
+    def delete_matching(self, match):
+        """Evict the entries whose token reference satisfies ``match``."""
+        with self._lock:
+            self.generation += 1
+            for key, token_ref in self._entries.items():
+                if match(token_ref):
+                    self._entries.pop(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+_token_cache = _TokenCache()
+
+
+def invalidate_token_cache():
+    """Empty the validated token cache of this process."""
+    _token_cache.clear()
+
+
+class _WriteBehindQueue(object):
+    """Tokens created through a Manager but not yet written to its driver.
+
+    Holds up to ``[token] write_behind_queue_size`` tokens, by unique id; a
+    token created while the queue is full is written at once instead. A
+    green thread writes the queued tokens every ``[token]
+    write_behind_interval`` seconds, ``[token] write_behind_batch_size`` at
+    a time through the driver's ``create_tokens``. A batch that fails with
+    a conflict or an integrity error is written again one token at a time,
+    and the tokens rejected on their own are logged and dropped; a batch
+    that fails otherwise, say while the database is unreachable, stays
+    queued for the next attempt. Queued, written,
+    overflowed and dropped tokens, failed writes and the time writes take
+    are recorded under the ``token_write_behind`` metrics collector.
+
+    """
+
+    def __init__(self, manager):
+        self.manager = manager
+        self._lock = threading.Lock()
+        # held for the whole of a write, so two writes never insert the
+        # same token
+        self._flush_lock = threading.Lock()
+        self._entries = utils.LRUCache()
+        self._flusher = None
+        self.stats = metrics.collector('token_write_behind')
+        _write_behind_queues[id(self)] = self
+
+    def put(self, token_id, data):
+        """Queue a token, or write it at once if the queue is full.
+
+        :returns: the token reference, as the driver would return it
+
+        """
+        token_ref = copy.deepcopy(data)
+        if not token_ref.get('expires'):
+            token_ref['expires'] = default_expire_time()
+        if not token_ref.get('user_id'):
+            token_ref['user_id'] = token_ref['user']['id']
+        key = unique_id(token_id)
+        token_ref['id'] = key
+        token_ref = utils.freeze(token_ref)
+        with self._lock:
+            if len(self._entries) >= CONF.token.write_behind_queue_size:
+                queued = False
+            else:
+                self._entries.set(key, (token_id, token_ref))
+                queued = True
+                if self._flusher is None:
+                    self._flusher = self._spawn(self._run)
+        if not queued:
+            self.stats.incr('overflow')
+            return self.manager.driver.create_token(token_id, data)
+        self.stats.incr('queued')
+        return token_ref
+
+    def get(self, key):
+        """Return a queued, unexpired token reference, or None."""
+        entry = self._entries.peek(key)
+        if entry is None or timeutils.utcnow() >= entry[1]['expires']:
+            return None
+        return entry[1]
+
+    def flush(self):
+        """Write every queued token.
+
+        Stops at the first batch that fails other than for good, which
+        stays queued for the next attempt.
+
+        :returns: the number of tokens written
+
+        """
+        written = 0
+        with self._flush_lock:
+            while self._entries:
+                with self._lock:
+                    batch = self._entries.items(
+                        CONF.token.write_behind_batch_size)
+                start = time.time()
+                done, dropped = [], []
+                try:
+                    self._write(batch, done, dropped)
+                except Exception:
+                    self.stats.incr('errors')
+                    LOG.exception(_('Failed to write %d queued tokens, '
+                                    'they stay queued.'),
+                                  len(batch) - len(done) - len(dropped))
+                    failed = True
+                else:
+                    failed = False
+                self.stats.timing('flush_time', time.time() - start)
+                self.stats.incr('flushed', len(done))
+                self._dequeue(done + dropped)
+                written += len(done)
+                if failed:
+                    break
+        return written
+
+    def _dequeue(self, entries):
+        with self._lock:
+            for key, entry in entries:
+                # unless queued again while it was being written
+                if self._entries.peek(key) is entry:
+                    self._entries.pop(key)
+
+    def _write(self, batch, done, dropped):
+        """Write a batch of queued tokens.
+
+        A batch the driver rejects for good is written again one token at a
+        time, to find the tokens it rejects. Written tokens are appended to
+        ``done``, rejected ones to ``dropped``; other errors are raised.
+
+        """
+        try:
+            self.manager.driver.create_tokens(
+                [entry for key, entry in batch])
+        except exception.NotImplemented:
+            self._write_each(batch, done, dropped)
+        except _PERMANENT_WRITE_ERRORS:
+            self.stats.incr('errors')
+            LOG.warning(_('Failed to write %d queued tokens, writing them '
+                          'one at a time.'), len(batch))
+            self._write_each(batch, done, dropped)
+        else:
+            done.extend(batch)
+
+    def _write_each(self, batch, done, dropped):
+        driver = self.manager.driver
+        for key, entry in batch:
+            token_id, token_ref = entry
+            try:
+                driver.create_token(token_id, token_ref)
+            except _PERMANENT_WRITE_ERRORS:
+                if self._stored(token_id):
+                    # written before, by a write that then failed
+                    done.append((key, entry))
+                    continue
+                self.stats.incr('dropped')
+                LOG.exception(_('Dropped a queued token of user %(user_id)s '
+                                'expiring at %(expires)s, which the backend '
+                                'rejected.'),
+                              {'user_id': token_ref['user_id'],
+                               'expires': token_ref['expires']})
+                dropped.append((key, entry))
+            else:
+                done.append((key, entry))
+
+    def _stored(self, token_id):
+        try:
+            self.manager.driver.get_token(token_id)
+        except exception.TokenNotFound:
+            return False
+        return True
+
+    def discard(self, match):
+        """Drop the queued tokens whose reference satisfies ``match``."""
+        with self._lock:
+            for key, (token_id, token_ref) in self._entries.items():
+                if match(token_ref):
+                    self._entries.pop(key)
+
+    def clear(self):
+        """Drop every queued token without writing it."""
+        with self._lock:
+            self._entries.clear()
+
+    def _spawn(self, func):
+        # imported here: eventlet must not be imported before wsgi_server,
+        # which configures it
+        import eventlet
+        return eventlet.spawn(func)
+
+    def _run(self):
+        # runs while tokens are queued; the next token queued starts it
+        # again
+        import eventlet
+        while True:
+            eventlet.sleep(CONF.token.write_behind_interval)
+            self.flush()
+            with self._lock:
+                if not self._entries:
+                    self._flusher = None
+                    return
+
+
+# errors for which writing a token again cannot succeed
+_PERMANENT_WRITE_ERRORS = (exception.Conflict, sql.IntegrityError)
+
+# by id, as Python 2.6 has no weakref.WeakSet
+_write_behind_queues = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def flush_write_behind():
+    """Write the tokens queued by every Manager of this process."""
+    for queue in _write_behind_queues.values():
+        queue.flush()
+
+
+def discard_write_behind():
+    """Drop the tokens queued by every Manager of this process."""
+    for queue in _write_behind_queues.values():
+        queue.clear()
+
+
 def unique_id(token_id):
     """Return a unique ID for a token.
 
     The returned value is useful as the primary key of a database table,
     memcache store, or other lookup table.
 
-    :returns: Given a PKI token, returns it's hashed value. Otherwise, returns
-              the passed-in value (such as a UUID token ID or an existing
-              hash).
+    :returns: Given a PKI or compact token, returns it's hashed value.
+              Otherwise, returns the passed-in value (such as a UUID token
+              ID or an existing hash).
     """
+    if compact.is_compact(token_id):
+        return hashlib.md5(token_id).hexdigest()
     return cms.cms_hash_token(token_id)
 
 
@@ -57,7 +389,7 @@ def default_expire_time():
     return timeutils.utcnow() + expire_delta
 
 
-def validate_auth_info(self, context, user_ref, tenant_ref):
+def validate_auth_info(self, context, user_ref, tenant_ref, domains=None):
     """Validate user and tenant auth info.
 
     Validate the user and tenant auth into in order to ensure that user and
@@ -69,6 +401,7 @@ def validate_auth_info(self, context, user_ref, tenant_ref):
     :params context: keystone's request context
     :params user_ref: the authenticating user
     :params tenant_ref: the scope of authorization, if any
+    :params domains: domain refs by id already looked up, if any
     :raises Unauthorized: if any of the user, user's domain, tenant or
             tenant's domain are either disabled or otherwise invalid
     """
@@ -78,10 +411,13 @@ def validate_auth_info(self, context, user_ref, tenant_ref):
         LOG.warning(msg)
         raise exception.Unauthorized(msg)
 
+    def get_domain(domain_id):
+        if domains and domain_id in domains:
+            return domains[domain_id]
+        return self.identity_api.get_domain(context, domain_id)
+
     # If the user's domain is disabled don't allow them to authenticate
-    user_domain_ref = self.identity_api.get_domain(
-        context,
-        user_ref['domain_id'])
+    user_domain_ref = get_domain(user_ref['domain_id'])
     if user_domain_ref and not user_domain_ref.get('enabled', True):
         msg = 'Domain is disabled: %s' % user_domain_ref['id']
         LOG.warning(msg)
@@ -95,9 +431,7 @@ def validate_auth_info(self, context, user_ref, tenant_ref):
             raise exception.Unauthorized(msg)
 
         # If the project's domain is disabled don't allow them to authenticate
-        project_domain_ref = self.identity_api.get_domain(
-            context,
-            tenant_ref['domain_id'])
+        project_domain_ref = get_domain(tenant_ref['domain_id'])
         if (project_domain_ref and
                 not project_domain_ref.get('enabled', True)):
             msg = 'Domain is disabled: %s' % project_domain_ref['id']
@@ -105,6 +439,21 @@ def validate_auth_info(self, context, user_ref, tenant_ref):
             raise exception.Unauthorized(msg)
 
 
+def _revokes(event, token_ref, key):
+    """Whether a revocation event applies to a compact token."""
+    if event.get('token_id'):
+        return event['token_id'] == key
+    if token_ref['issued_at'] > event['issued_before']:
+        return False
+    if event.get('trust_id'):
+        if token_ref.get('trust_id') != event['trust_id']:
+            return False
+    elif token_ref['user_id'] != event['user_id']:
+        return False
+    tenant = token_ref.get('tenant') or {}
+    return not event.get('tenant_id') or tenant.get('id') == event['tenant_id']
+
+
 @dependency.provider('token_api')
 class Manager(manager.Manager):
     """Default pivot point for the Token backend.
@@ -116,6 +465,248 @@ class Manager(manager.Manager):
 
     def __init__(self):
         super(Manager, self).__init__(CONF.token.driver)
+        self._write_behind = _WriteBehindQueue(self)
+        self._rehydrator = None
+
+    def create_token(self, context, token_id, data):
+        """Create a token, queueing its write if ``[token] write_behind``.
+
+        Queued tokens are written within ``[token] write_behind_interval``
+        seconds, and when the process exits normally; a process that dies
+        loses the tokens it has not written yet. They are validated from
+        the queue meanwhile, but only by this process, so write-behind suits
+        deployments where tokens are validated by the process that issued
+        them, or can be issued again, such as with UUID tokens behind a
+        sticky load balancer.
+
+        With ``[token] slim_records``, the token is stored as a slim record
+        (see :mod:`keystone.token.records`), which is filled in again when
+        the token is read.
+
+        """
+        stored = records.slim(data) if CONF.token.slim_records else data
+        if CONF.token.write_behind:
+            token_ref = self._write_behind.put(token_id, stored)
+        else:
+            token_ref = self.driver.create_token(token_id, stored)
+        if stored is not data and token_ref is not None:
+            token_ref = records.restore(token_ref, data)
+        return token_ref
+
+    def get_token(self, context, token_id):
+        """Return a token reference, from the cache if it is there.
+
+        The reference may be shared with other callers, in which case it
+        cannot be modified; modify a copy instead.
+
+        """
+        if token_id is None:
+            return self.driver.get_token(token_id)
+        key = unique_id(token_id)
+        token_ref = _token_cache.get(key)
+        if token_ref is None:
+            generation = _token_cache.generation
+            if self._is_compact(token_id):
+                token_ref = self._get_compact_token(token_id, key)
+            else:
+                token_ref = self._write_behind.get(key)
+            if token_ref is None:
+                token_ref = self.driver.get_token(token_id)
+            if records.is_slim(token_ref):
+                token_ref = self._rehydrate(context, token_id, token_ref)
+            token_ref = _token_cache.set(key, token_ref, generation)
+        return token_ref
+
+    def create_compact_token(self, context, data):
+        """Issue a compact token, without storing it.
+
+        :param data: the token, as passed to create_token, without its id
+        :returns: the id of the compact token
+
+        """
+        if not CONF.signing.compact_keys:
+            raise exception.UnexpectedError(
+                _('No [signing] compact_keys to issue compact tokens with.'))
+        data = dict(data)
+        if not data.get('expires'):
+            data['expires'] = default_expire_time()
+        return compact.encode(records.slim(data),
+                              CONF.signing.compact_keys[0])
+
+    def _is_compact(self, token_id):
+        # compact tokens are only valid while there are keys to check them
+        return bool(CONF.signing.compact_keys) and compact.is_compact(token_id)
+
+    def _get_compact_token(self, token_id, key):
+        token_ref = compact.decode(token_id, CONF.signing.compact_keys)
+        if timeutils.utcnow() >= token_ref['expires']:
+            raise exception.TokenNotFound(token_id=token_id)
+        for event in self._list_revocation_events():
+            if _revokes(event, token_ref, key):
+                raise exception.TokenNotFound(token_id=token_id)
+        return token_ref
+
+    def _list_revocation_events(self):
+        now = timeutils.utcnow()
+        generation = _revocation_list['generation']
+        cached = _revocation_events
+        if (cached['generation'] != generation or
+                now >= cached['valid_until']):
+            events = self.driver.list_revocation_events()
+            cached.update(generation=generation, events=events,
+                          valid_until=now + datetime.timedelta(
+                              seconds=CONF.token.revocation_events_cache_time))
+        return cached['events']
+
+    def _rehydrate(self, context, token_id, token_ref):
+        if self._rehydrator is None:
+            self._rehydrator = records.Rehydrator()
+        try:
+            return self._rehydrator.rehydrate(context, token_ref)
+        except exception.NotFound:
+            # the token's user, tenant or roles are gone, and so is the
+            # token
+            raise exception.TokenNotFound(token_id=token_id)
+
+    def delete_token(self, context, token_id):
+        if self._is_compact(token_id):
+            key = unique_id(token_id)
+            try:
+                token_ref = self._get_compact_token(token_id, key)
+                self.driver.create_revocation_event(
+                    {'token_id': key,
+                     'issued_before': timeutils.utcnow(),
+                     'expires': token_ref['expires']})
+            finally:
+                _token_cache.delete(key)
+                invalidate_revocation_list()
+            return
+        self._write_behind.flush()
+        key = unique_id(token_id)
+        try:
+            return self.driver.delete_token(token_id)
+        finally:
+            # left queued if the flush failed
+            self._write_behind.discard(lambda ref: ref['id'] == key)
+            _token_cache.delete(key)
+            invalidate_revocation_list()
+
+    def delete_tokens(self, context, user_id, tenant_id=None, trust_id=None):
+        def match(token_ref):
+            # evicting every token of the user, whatever its tenant, is
+            # cheaper than deciding which ones the driver revoked
+            if trust_id:
+                return token_ref.get('trust_id') == trust_id
+            user = token_ref.get('user') or {}
+            return user_id in (token_ref.get('user_id'), user.get('id'))
+
+        if CONF.signing.compact_keys:
+            # compact tokens are not stored, so cannot be revoked one by one
+            now = timeutils.utcnow()
+            self.driver.create_revocation_event(
+                {'user_id': None if trust_id else user_id,
+                 'tenant_id': tenant_id,
+                 'trust_id': trust_id,
+                 'issued_before': now,
+                 'expires': now + datetime.timedelta(
+                     seconds=CONF.token.expiration)})
+        self._write_behind.flush()
+        try:
+            return self.driver.delete_tokens(user_id,
+                                             tenant_id=tenant_id,
+                                             trust_id=trust_id)
+        finally:
+            self._write_behind.discard(match)
+            _token_cache.delete_matching(match)
+            invalidate_revocation_list()
+
+    def list_tokens(self, context, user_id, tenant_id=None, trust_id=None):
+        self._write_behind.flush()
+        return self.driver.list_tokens(user_id, tenant_id=tenant_id,
+                                       trust_id=trust_id)
+
+    def get_signed_revocation_list(self, context, since=None):
+        """Return the signed revocation list, its ETag and a cursor.
+
+        The list is cached until a token is revoked through this process,
+        one of its entries expires, or ``[token] revocation_cache_time``
+        seconds pass (which bounds how long revocations made by other
+        processes go unnoticed). If ``since`` is given, only the tokens
+        revoked at or after that time are listed; the last few such deltas
+        are cached the same way, by ``since``. A list whose content was
+        signed recently, such as an empty delta, reuses that signature
+        instead of signing again.
+
+        The cursor is the time, truncated to whole seconds, up to which the
+        returned list is complete, less ``[token] revocation_cursor_overlap``
+        seconds; passing it back as ``since`` fetches everything revoked
+        afterwards. Drivers stamp a revocation before committing it, with
+        the clock of the node that made it, so the overlap keeps tokens
+        stamped late or by a lagging clock from being skipped. Tokens
+        revoked during the overlap are listed again by the next delta.
+
+        :param since: naive UTC datetime.datetime, or None for the full list
+        :returns: (signed_text, etag, cursor)
+
+        """
+        now = timeutils.utcnow()
+        generation = _revocation_list['generation']
+        with _revocation_lock:
+            if since is None:
+                cached = _revocation_list['cached']
+                if cached and now >= cached['valid_until']:
+                    cached = None
+            else:
+                cached = _revocation_list['deltas'].get(since)
+        if cached and cached['generation'] == generation:
+            return cached['signed'], cached['etag'], cached['cursor']
+
+        cursor = timeutils.isotime(now - datetime.timedelta(
+            seconds=CONF.token.revocation_cursor_overlap))
+        tokens = self.driver.list_revoked_tokens(since=since)
+        json_data, etag, valid_until = self._format_revocation_list(tokens,
+                                                                    now)
+        with _revocation_lock:
+            signed_text = _revocation_list['signatures'].get(etag)
+        if signed_text is None:
+            signed_text = cms.cms_sign_text(json_data,
+                                            CONF.signing.certfile,
+                                            CONF.signing.keyfile)
+
+        entry = {'signed': signed_text,
+                 'etag': etag,
+                 'cursor': cursor,
+                 'generation': generation,
+                 'valid_until': valid_until}
+        with _revocation_lock:
+            _revocation_list['signatures'].set(etag, signed_text,
+                                               size=_REVOCATION_CACHE_SIZE)
+            if since is None:
+                _revocation_list['cached'] = entry
+            else:
+                _revocation_list['deltas'].set(since, entry,
+                                               expires=valid_until,
+                                               size=_REVOCATION_CACHE_SIZE)
+        return signed_text, etag, cursor
+
+    def _format_revocation_list(self, tokens, now):
+        """Serialize revoked tokens for signing.
+
+        :returns: (json_data, etag, valid_until), where valid_until is the
+                  time after which the list must be rebuilt
+
+        """
+        valid_until = now + datetime.timedelta(
+            seconds=CONF.token.revocation_cache_time)
+        for t in tokens:
+            expires = t['expires']
+            if isinstance(expires, datetime.datetime):
+                valid_until = min(valid_until, expires)
+            if not (expires and isinstance(expires, unicode)):
+                t['expires'] = timeutils.isotime(expires)
+        json_data = json.dumps({'revoked': tokens})
+        etag = '"%s"' % hashlib.sha1(json_data).hexdigest()
+        return json_data, etag, valid_until
 
 
 class Driver(object):
@@ -155,6 +746,19 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
+    def create_tokens(self, tokens):
+        """Create several tokens.
+
+        Optional: tokens are created one at a time by drivers that do not
+        write several at once.
+
+        :param tokens: (token_id, data) pairs, as passed to create_token
+        :type tokens: list
+        :returns: None.
+
+        """
+        raise exception.NotImplemented()
+
     def delete_token(self, token_id):
         """Deletes a token by id.
 
@@ -206,15 +810,46 @@ class Driver(object):
         """
         raise exception.NotImplemented()
 
-    def list_revoked_tokens(self):
+    def list_revoked_tokens(self, since=None):
         """Returns a list of all revoked tokens
 
+        :param since: only list tokens revoked at or after this time
+        :type since: naive UTC datetime.datetime
         :returns: list of token_id's
 
         """
         raise exception.NotImplemented()
 
+    def create_revocation_event(self, event):
+        """Revoke the compact tokens an event matches.
+
+        Compact tokens are not stored. They are revoked by recording an
+        event matching either a token, by its unique id, or the tokens of a
+        user or trust, optionally within a tenant, issued up to a time.
+
+        :param event: dictionary with ``token_id``, ``user_id``,
+                      ``tenant_id`` and ``trust_id``, any of which may be
+                      None, ``issued_before``, and ``expires``, after
+                      which the event may be dropped
+        :type event: dict
+        :returns: None.
+
+        """
+        raise exception.NotImplemented()
+
+    def list_revocation_events(self):
+        """Returns the revocation events that have not expired.
+
+        :returns: list of events, as passed to create_revocation_event
+
+        """
+        raise exception.NotImplemented()
+
     def flush_expired_tokens(self):
         """Archive or delete tokens that have expired.
+
+        :returns: the number of tokens removed, or None if the driver does
+                  not count them
+
         """
         raise exception.NotImplemented()
@@ -0,0 +1,127 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Periodic flushing of expired tokens inside keystone-all.
+
+When ``[token] reaper_enabled`` is set, ``keystone-all`` runs a green thread
+that calls the token driver's ``flush_expired_tokens`` every ``[token]
+reaper_interval`` seconds. A token store shared through the database is
+flushed by one process at a time: each run first takes or renews the
+``token_reaper`` lease, so only its holder does the work. Runs, their
+duration, the time between them and the tokens flushed are recorded under
+the ``token_reaper`` metrics collector.
+
+"""
+
+import os
+import socket
+import time
+
+import eventlet
+
+from keystone.common import dependency
+from keystone.common import logging
+from keystone.common import metrics
+from keystone.common import sql
+from keystone.common.sql import lease
+from keystone import config
+from keystone import exception
+
+
+CONF = config.CONF
+config.register_bool('reaper_enabled', group='token', default=False)
+config.register_int('reaper_interval', group='token', default=600)
+LOG = logging.getLogger(__name__)
+
+LEASE_NAME = 'token_reaper'
+
+
+@dependency.requires('token_api')
+class Reaper(object):
+    def __init__(self):
+        self.interval = CONF.token.reaper_interval
+        self.holder = '%s:%d' % (socket.gethostname(), os.getpid())
+        self.lease = lease.Lease()
+        self.stats = metrics.collector('token_reaper')
+        self._last_run = None
+
+    def is_shared(self):
+        """Whether the token store is shared through the database."""
+        return isinstance(self.token_api.driver, sql.Base)
+
+    def _elected(self):
+        if not self.is_shared():
+            # every process flushes a store of its own
+            return True
+        # held across two intervals, so a holder that stops running is
+        # replaced after at most that long; a run may take up to
+        # flush_max_runtime on top, which start() requires to be set
+        duration = 2 * self.interval + CONF.token.flush_max_runtime
+        return self.lease.acquire(LEASE_NAME, self.holder, duration)
+
+    def run_once(self):
+        """Flush expired tokens if this process holds the lease.
+
+        :returns: the number of tokens flushed, or None if another process
+                  holds the lease
+
+        """
+        if not self._elected():
+            self.stats.incr('skipped')
+            return None
+        start = time.time()
+        if self._last_run is not None:
+            self.stats.timing('interval', start - self._last_run)
+        self._last_run = start
+        try:
+            flushed = self.token_api.driver.flush_expired_tokens() or 0
+        except Exception:
+            self.stats.incr('errors')
+            raise
+        self.stats.timing('run_time', time.time() - start)
+        self.stats.incr('runs')
+        self.stats.incr('tokens_flushed', flushed)
+        return flushed
+
+    def run(self):
+        while True:
+            eventlet.sleep(self.interval)
+            try:
+                self.run_once()
+            except exception.NotImplemented:
+                LOG.warning(_('The token driver does not flush expired '
+                              'tokens; stopping the token reaper.'))
+                return
+            except Exception:
+                LOG.exception(_('Failed to flush expired tokens.'))
+
+
+def start():
+    """Start the token reaper in a green thread, if it is enabled.
+
+    :raises: keystone.exception.UnexpectedError if the token store is
+             shared through the database but ``[token] flush_max_runtime``
+             does not bound how long a run, and so the lease, lasts
+
+    """
+    if not CONF.token.reaper_enabled:
+        return None
+    token_reaper = Reaper()
+    if token_reaper.is_shared() and CONF.token.flush_max_runtime <= 0:
+        raise exception.UnexpectedError(
+            _('The token reaper requires [token] flush_max_runtime to be '
+              'set, so that no run outlives its lease.'))
+    return eventlet.spawn(token_reaper.run)
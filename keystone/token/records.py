@@ -0,0 +1,172 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Slim token records.
+
+A token is normally stored with the full user and tenant references it was
+issued for and, for v3 tokens, the whole token body including the service
+catalog. A slim record keeps only what cannot be looked up again: ids,
+scope, role ids, authentication methods, extras, trust and timestamps.
+The rest is looked up when the token is read back, which gives the same
+token reference as the full record did.
+
+Slim records are marked with a ``slim`` key holding the version of their
+schema; records without it are full records and are read as they are.
+
+"""
+
+from keystone import catalog
+from keystone import exception
+from keystone import identity
+
+
+SLIM_VERSION = 1
+
+# the parts of a v3 token body that are looked up again
+_LOOKED_UP = ('user', 'project', 'domain', 'roles', 'catalog')
+
+
+def _ids(ref):
+    if not ref:
+        return ref
+    # whether domain_id is there is kept: the v2 token controller leaves it
+    # out of the user and tenant, and so must rehydration
+    ids = {'id': ref['id']}
+    if 'domain_id' in ref:
+        ids['domain_id'] = ref['domain_id']
+    return ids
+
+
+def slim(data):
+    """Return the slim record of a token, as passed to create_token."""
+    record = dict((k, v) for k, v in data.iteritems()
+                  if k not in ('user', 'tenant', 'token_data'))
+    record['slim'] = SLIM_VERSION
+    record['user'] = _ids(data['user'])
+    if 'tenant' in data:
+        record['tenant'] = _ids(data['tenant'])
+    if data.get('token_data'):
+        token = data['token_data']['token']
+        body = dict((k, v) for k, v in token.iteritems()
+                    if k not in _LOOKED_UP)
+        for key in ('user', 'project', 'domain'):
+            if key in token:
+                body[key] = _ids(token[key])
+        if 'roles' in token:
+            body['roles'] = [_ids(role) for role in token['roles']]
+        record['token_data'] = {'token': body}
+    return record
+
+
+def is_slim(token_ref):
+    return token_ref.get('slim') is not None
+
+
+def restore(token_ref, data):
+    """Return a stored slim record filled in from the data it came from."""
+    token_ref = dict(token_ref)
+    del token_ref['slim']
+    for key in ('user', 'tenant', 'token_data'):
+        if key in data:
+            token_ref[key] = data[key]
+    return token_ref
+
+
+class Rehydrator(object):
+    """Turns slim records back into full token references."""
+
+    def __init__(self):
+        self.identity_api = identity.Manager()
+        self.catalog_api = catalog.Manager()
+
+    def rehydrate(self, context, token_ref):
+        """Return the full token reference of a slim record.
+
+        :raises: keystone.exception.NotFound if the user, tenant, domain or
+                 one of the roles of the token no longer exists
+
+        """
+        if token_ref['slim'] != SLIM_VERSION:
+            raise exception.UnexpectedError(
+                _('Unknown token record version: %s') % token_ref['slim'])
+        token_ref = dict(token_ref)
+        del token_ref['slim']
+        if token_ref.get('token_data'):
+            token = self._token_body(context, token_ref['token_data']['token'])
+            token_ref['token_data'] = {'token': token}
+            # as the v3 token factory stores them
+            token_ref['user'] = token['user']
+            if 'tenant' in token_ref:
+                token_ref['tenant'] = token.get('project')
+            return token_ref
+
+        user_ref = self.identity_api.get_user(context,
+                                              token_ref['user']['id'])
+        token_ref['user'] = self._as_stored(user_ref, token_ref['user'])
+        if token_ref.get('tenant'):
+            project_ref = self.identity_api.get_project(
+                context, token_ref['tenant']['id'])
+            token_ref['tenant'] = self._as_stored(project_ref,
+                                                  token_ref['tenant'])
+        return token_ref
+
+    def _as_stored(self, ref, ids):
+        if 'domain_id' not in ids:
+            ref.pop('domain_id', None)
+        return ref
+
+    def _token_body(self, context, body):
+        token = dict(body)
+        domains = {}
+
+        def get_domain(domain_id):
+            if domain_id not in domains:
+                domain_ref = self.identity_api.get_domain(context, domain_id)
+                domains[domain_id] = {'id': domain_ref['id'],
+                                      'name': domain_ref['name']}
+            return dict(domains[domain_id])
+
+        user_ref = self.identity_api.get_user(context, body['user']['id'])
+        token['user'] = {'id': user_ref['id'],
+                         'name': user_ref['name'],
+                         'domain': get_domain(user_ref['domain_id'])}
+        project_id = None
+        if 'project' in body:
+            project_ref = self.identity_api.get_project(
+                context, body['project']['id'])
+            project_id = project_ref['id']
+            token['project'] = {'id': project_ref['id'],
+                                'name': project_ref['name'],
+                                'domain': get_domain(
+                                    project_ref['domain_id'])}
+        if 'domain' in body:
+            token['domain'] = get_domain(body['domain']['id'])
+        if 'roles' in body:
+            role_refs = self.identity_api.get_roles(
+                context, [role['id'] for role in body['roles']])
+            token['roles'] = [{'id': role_ref['id'],
+                               'name': role_ref['name']}
+                              for role_ref in role_refs]
+        if 'project' in body or 'domain' in body:
+            user_id = user_ref['id']
+            if 'OS-TRUST:trust' in body:
+                user_id = body['OS-TRUST:trust']['trustor_user']['id']
+            try:
+                token['catalog'] = self.catalog_api.get_v3_catalog(
+                    context, user_id, project_id)
+            except exception.NotImplemented:
+                token['catalog'] = {}
+        return token
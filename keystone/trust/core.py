@@ -37,6 +37,8 @@ class Manager(manager.Manager):
 
     """
 
+    request_cache = ('get_trust',)
+
     def __init__(self):
         super(Manager, self).__init__(CONF.trust.driver)
 
@@ -17,6 +17,8 @@ import datetime
 import uuid
 
 from keystone import auth
+from keystone.common import cms
+from keystone.common import metrics
 from keystone import config
 from keystone import exception
 from keystone.openstack.common import timeutils
@@ -25,6 +27,7 @@ from keystone import token
 from keystone import trust
 
 import default_fixtures
+import test_backend
 
 
 CONF = config.CONF
@@ -787,6 +790,438 @@ class TokenExpirationTest(AuthTest):
         self._maintain_token_expiration()
 
 
+class RevocationListTest(AuthTest):
+    def setUp(self):
+        super(RevocationListTest, self).setUp()
+        self.token_manager = token.Manager()
+        token.core._revocation_list['cached'] = None
+        token.core._revocation_list['deltas'].clear()
+        token.core._revocation_list['signatures'].clear()
+        self.sign_calls = []
+        self.list_calls = []
+
+        def fake_sign(text, *args):
+            self.sign_calls.append(text)
+            return 'signed-%d' % len(self.sign_calls)
+
+        def fake_list(since=None,
+                      orig=self.token_manager.driver.list_revoked_tokens):
+            self.list_calls.append(since)
+            return orig(since=since)
+
+        self.stubs.Set(cms, 'cms_sign_text', fake_sign)
+        self.stubs.Set(self.token_manager.driver, 'list_revoked_tokens',
+                       fake_list)
+
+    def _create_token(self, expires=None):
+        return test_backend.create_token_sample_data(
+            self.token_manager, user_id=self.user_foo['id'], expires=expires,
+            context={})
+
+    def test_cached_until_revocation(self):
+        cached = self.token_manager.get_signed_revocation_list({})
+        signed, etag, cursor = cached
+        self.assertEqual(cached,
+                         self.token_manager.get_signed_revocation_list({}))
+        self.assertEqual(len(self.list_calls), 1)
+        self.assertEqual(len(self.sign_calls), 1)
+
+        self.token_manager.delete_token({}, self._create_token())
+        new_signed, new_etag, new_cursor = (
+            self.token_manager.get_signed_revocation_list({}))
+        self.assertNotEqual(new_etag, etag)
+        self.assertNotEqual(new_signed, signed)
+        self.assertEqual(len(self.sign_calls), 2)
+
+    def test_unchanged_list_is_not_signed_again(self):
+        signed, etag, cursor = self.token_manager.get_signed_revocation_list(
+            {})
+
+        # nothing to revoke, but the cache is invalidated all the same
+        self.token_manager.delete_tokens({}, uuid.uuid4().hex)
+        self.assertEqual(
+            (signed, etag),
+            self.token_manager.get_signed_revocation_list({})[:2])
+        self.assertEqual(len(self.list_calls), 2)
+        self.assertEqual(len(self.sign_calls), 1)
+
+    def test_expired_entry_forces_rebuild(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow() + datetime.timedelta(seconds=10)
+        self.token_manager.delete_token({}, self._create_token(expires))
+        self.token_manager.get_signed_revocation_list({})
+        self.token_manager.get_signed_revocation_list({})
+        self.assertEqual(len(self.list_calls), 1)
+
+        timeutils.advance_time_seconds(11)
+        self.token_manager.get_signed_revocation_list({})
+        self.assertEqual(len(self.list_calls), 2)
+
+    def test_cache_time(self):
+        self.opt_in_group('token', revocation_cache_time=0)
+        self.token_manager.get_signed_revocation_list({})
+        self.token_manager.get_signed_revocation_list({})
+        self.assertEqual(len(self.list_calls), 2)
+        self.assertEqual(len(self.sign_calls), 1)
+
+    def test_delta_since_cursor(self):
+        timeutils.set_time_override()
+        old_token_id = self._create_token()
+        self.token_manager.delete_token({}, old_token_id)
+        timeutils.advance_time_seconds(
+            CONF.token.revocation_cursor_overlap + 5)
+        signed, etag, cursor = self.token_manager.get_signed_revocation_list(
+            {})
+        self.assertIn(old_token_id, self.sign_calls[-1])
+
+        token_id = self._create_token()
+        self.token_manager.delete_token({}, token_id)
+        since = timeutils.normalize_time(timeutils.parse_isotime(cursor))
+        delta = self.token_manager.get_signed_revocation_list({}, since=since)
+        self.assertEqual(self.list_calls[-1], since)
+        self.assertIn(token_id, self.sign_calls[-1])
+        self.assertNotIn(old_token_id, self.sign_calls[-1])
+        self.assertEqual(delta[2], timeutils.isotime(
+            timeutils.utcnow() - datetime.timedelta(
+                seconds=CONF.token.revocation_cursor_overlap)))
+
+        # served from the cache until the next revocation
+        self.assertEqual(
+            delta,
+            self.token_manager.get_signed_revocation_list({}, since=since))
+        self.assertEqual(len(self.list_calls), 2)
+        self.token_manager.delete_token({}, self._create_token())
+        self.token_manager.get_signed_revocation_list({}, since=since)
+        self.assertEqual(len(self.list_calls), 3)
+
+    def test_cursor_overlaps_late_revocations(self):
+        timeutils.set_time_override()
+        token_id = self._create_token()
+        cursor = self.token_manager.get_signed_revocation_list({})[2]
+
+        # stamped by another node a moment before this list was built, but
+        # committed after
+        timeutils.advance_time_seconds(-1)
+        self.token_manager.driver.delete_token(token_id)
+        timeutils.advance_time_seconds(1)
+        since = timeutils.normalize_time(timeutils.parse_isotime(cursor))
+        self.token_manager.get_signed_revocation_list({}, since=since)
+        self.assertIn(token_id, self.sign_calls[-1])
+
+    def test_empty_deltas_share_a_signature(self):
+        timeutils.set_time_override()
+        for i in range(3):
+            since = timeutils.utcnow()
+            delta = self.token_manager.get_signed_revocation_list(
+                {}, since=since)
+            timeutils.advance_time_seconds(1)
+        self.assertEqual(len(self.list_calls), 3)
+        self.assertEqual(len(self.sign_calls), 1)
+        self.assertEqual(delta[0], 'signed-1')
+
+
+class TokenCacheTest(AuthTest):
+    def setUp(self):
+        super(TokenCacheTest, self).setUp()
+        self.opt_in_group('token', cache_size=1000)
+        self.token_manager = token.Manager()
+        self.stats = metrics.collector('token_cache')
+        self.stats.reset()
+        self.get_calls = []
+
+        def fake_get(token_id, orig=self.token_manager.driver.get_token):
+            self.get_calls.append(token_id)
+            return orig(token_id)
+
+        self.stubs.Set(self.token_manager.driver, 'get_token', fake_get)
+
+    def _create_token(self, expires=None, user_id=None, trust_id=None):
+        return test_backend.create_token_sample_data(
+            self.token_manager, trust_id=trust_id,
+            user_id=user_id or self.user_foo['id'], expires=expires,
+            context={})
+
+    def test_cache_hit(self):
+        token_id = self._create_token()
+        token_ref = self.token_manager.get_token({}, token_id)
+        self.assertIs(self.token_manager.get_token({}, token_id), token_ref)
+        self.assertIs(token.Manager().get_token({}, token_id), token_ref)
+        self.assertEqual(self.get_calls, [token_id])
+        self.assertRaises(TypeError, token_ref.__setitem__, 'id', 'x')
+        stats = self.stats.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_entries_expire(self):
+        timeutils.set_time_override()
+        self.opt_in_group('token', cache_time=60)
+        short_id = self._create_token(
+            timeutils.utcnow() + datetime.timedelta(seconds=10))
+        long_id = self._create_token()
+        self.token_manager.get_token({}, short_id)
+        self.token_manager.get_token({}, long_id)
+
+        timeutils.advance_time_seconds(10)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, short_id)
+        self.token_manager.get_token({}, long_id)
+        timeutils.advance_time_seconds(50)
+        self.token_manager.get_token({}, long_id)
+        self.assertEqual(self.get_calls, [short_id, long_id, short_id,
+                                          long_id])
+
+    def test_least_recently_used_is_evicted(self):
+        self.opt_in_group('token', cache_size=2)
+        token_ids = [self._create_token() for i in range(3)]
+        for token_id in token_ids[:2] + token_ids[:1] + token_ids[2:]:
+            self.token_manager.get_token({}, token_id)
+        self.token_manager.get_token({}, token_ids[0])
+        self.token_manager.get_token({}, token_ids[1])
+        self.assertEqual(self.get_calls, token_ids + token_ids[1:2])
+        self.assertEqual(self.stats.get_stats()['evictions'], 2)
+
+    def test_revocation_evicts(self):
+        token_id = self._create_token()
+        other_user_id = self._create_token(user_id=self.user_two['id'])
+        trust_token_id = self._create_token(user_id=self.user_two['id'],
+                                            trust_id='trust')
+        for cached_id in (token_id, other_user_id, trust_token_id):
+            self.token_manager.get_token({}, cached_id)
+
+        self.token_manager.delete_token({}, token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+        self.token_manager.delete_tokens({}, self.user_two['id'],
+                                         trust_id='trust')
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, trust_token_id)
+        self.token_manager.get_token({}, other_user_id)
+        self.token_manager.delete_tokens({}, self.user_two['id'])
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, other_user_id)
+
+    def test_disabled(self):
+        self.opt_in_group('token', cache_size=0)
+        token_id = self._create_token()
+        self.token_manager.get_token({}, token_id)
+        self.token_manager.get_token({}, token_id)
+        self.assertEqual(self.get_calls, [token_id, token_id])
+        self.assertEqual(self.stats.get_stats(), {})
+
+        # not shared, so handed out as the driver returned it
+        driver_ref = {'id': token_id, 'expires': None}
+        self.stubs.Set(self.token_manager.driver, 'get_token',
+                       lambda token_id: driver_ref)
+        self.assertIs(self.token_manager.get_token({}, token_id), driver_ref)
+
+
+class SlimTokenRecordTest(AuthTest):
+    def setUp(self):
+        super(SlimTokenRecordTest, self).setUp()
+        self.token_manager = token.Manager()
+
+    def _authenticate(self):
+        body_dict = _build_user_auth(username='FOO', password='foo2',
+                                     tenant_name='BAR')
+        token_data = self.controller.authenticate({}, body_dict)
+        return token_data['access']['token']['id']
+
+    def _validate(self, token_id):
+        return self.controller.validate_token(dict(is_admin=True,
+                                                   query_string={}),
+                                              token_id=token_id)
+
+    def test_v2_token(self):
+        fat_id = self._authenticate()
+        self.opt_in_group('token', slim_records=True)
+        slim_id = self._authenticate()
+
+        stored = self.token_api.get_token(slim_id)
+        self.assertEqual(stored['user'], {'id': self.user_foo['id']})
+        self.assertEqual(stored['tenant'], {'id': self.tenant_bar['id']})
+        self.assertEqualTokens(self._validate(fat_id),
+                               self._validate(slim_id))
+
+    def test_v3_token(self):
+        helper = auth.token_factory.TokenDataHelper({})
+        token_data = helper.get_token_data(
+            self.user_foo['id'], ['password'], {},
+            project_id=self.tenant_bar['id'])
+        data = {'id': 'fat',
+                'expires': timeutils.utcnow() + datetime.timedelta(1),
+                'user': token_data['token']['user'],
+                'tenant': token_data['token']['project'],
+                'metadata': {'roles': [self.role_admin['id']]},
+                'token_data': token_data}
+        fat_ref = self.token_manager.create_token({}, 'fat', data)
+        self.opt_in_group('token', slim_records=True)
+        slim_ref = self.token_manager.create_token({}, 'slim',
+                                                   dict(data, id='slim'))
+        self.assertEqual(dict(slim_ref, id='fat'), fat_ref)
+
+        stored = self.token_api.get_token('slim')
+        self.assertNotIn('catalog', stored['token_data']['token'])
+        self.assertEqual(stored['token_data']['token']['roles'],
+                         [{'id': role['id']}
+                          for role in token_data['token']['roles']])
+        # full records written earlier are read as they are
+        self.assertEqual(self.token_manager.get_token({}, 'fat'), fat_ref)
+        self.assertEqual(dict(self.token_manager.get_token({}, 'slim'),
+                              id='fat'), fat_ref)
+
+    def test_token_of_deleted_user(self):
+        self.opt_in_group('token', slim_records=True)
+        token_id = self._authenticate()
+        self.identity_api.delete_user(self.user_foo['id'])
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+
+
+class CompactTokenTest(AuthTest):
+    def setUp(self):
+        super(CompactTokenTest, self).setUp()
+        self.opt_in_group('signing', token_format='COMPACT',
+                          compact_keys=['key-one'])
+        self.token_manager = token.Manager()
+
+    def _authenticate(self, tenant_name='BAR'):
+        body_dict = _build_user_auth(username='FOO', password='foo2',
+                                     tenant_name=tenant_name)
+        token_data = self.controller.authenticate({}, body_dict)
+        return token_data['access']['token']['id']
+
+    def _validate(self, token_id):
+        return self.controller.validate_token(dict(is_admin=True,
+                                                   query_string={}),
+                                              token_id=token_id)
+
+    def test_round_trip(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow().replace(microsecond=0)
+        data = {'expires': expires,
+                'user': {'id': u'non-hex user'},
+                'tenant': {'id': uuid.uuid4().hex},
+                'metadata': {'roles': [uuid.uuid4().hex, u'r\xf4le'],
+                             'trust_id': 'trust',
+                             'trustee_user_id': 'trustee'},
+                'trust_id': 'trust'}
+        token_id = token.compact.encode(token.records.slim(data), 'key')
+        self.assertTrue(token.compact.is_compact(token_id))
+        self.assertFalse(token.compact.is_compact(uuid.uuid4().hex))
+
+        record = token.compact.decode(token_id, ['other', 'key'])
+        self.assertEqual(record['user'], data['user'])
+        self.assertEqual(record['tenant'], data['tenant'])
+        self.assertEqual(record['metadata'], data['metadata'])
+        self.assertEqual(record['expires'], expires)
+        self.assertEqual(record['trust_id'], 'trust')
+
+    def test_v3_round_trip(self):
+        helper = auth.token_factory.TokenDataHelper({})
+        token_data = helper.get_token_data(
+            self.user_foo['id'], ['password', 'token'], {'k': 'v'},
+            project_id=self.tenant_bar['id'])
+        data = {'expires': timeutils.utcnow() + datetime.timedelta(1),
+                'user': token_data['token']['user'],
+                'token_data': token_data}
+        record = token.compact.decode(
+            token.compact.encode(token.records.slim(data), 'key'), ['key'])
+        body = record['token_data']['token']
+        self.assertEqual(body['methods'], ['password', 'token'])
+        self.assertEqual(body['extras'], {'k': 'v'})
+        self.assertEqual(body['project'], {'id': self.tenant_bar['id']})
+        self.assertEqual(body['roles'],
+                         [{'id': role['id']}
+                          for role in token_data['token']['roles']])
+
+    def test_token_is_not_stored(self):
+        token_id = self._authenticate()
+        self.assertTrue(token.compact.is_compact(token_id))
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+
+        self.opt_in_group('signing', token_format='UUID')
+        uuid_id = self._authenticate()
+        self.assertEqualTokens(self._validate(token_id),
+                               self._validate(uuid_id))
+
+    def test_rescope(self):
+        unscoped_id = self._authenticate(tenant_name=None)
+        body_dict = _build_user_auth(token={'id': unscoped_id},
+                                     tenant_name='BAR')
+        token_data = self.controller.authenticate({}, body_dict)
+        token_ref = self.token_manager.get_token(
+            {}, token_data['access']['token']['id'])
+        self.assertEqual(token_ref['tenant']['id'], self.tenant_bar['id'])
+
+    def test_delete_token(self):
+        token_id = self._authenticate()
+        other_id = self._authenticate(tenant_name=None)
+        self.token_manager.delete_token({}, token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.delete_token, {}, token_id)
+        self.token_manager.get_token({}, other_id)
+
+    def test_revocation_by_another_process(self):
+        timeutils.set_time_override()
+        token_id = self._authenticate()
+        self.token_manager.get_token({}, token_id)
+        # revoked through the driver, which this Manager does not notice
+        self.token_manager.driver.create_revocation_event(
+            {'token_id': token.unique_id(token_id),
+             'issued_before': timeutils.utcnow(),
+             'expires': timeutils.utcnow() + datetime.timedelta(hours=1)})
+        self.token_manager.get_token({}, token_id)
+        timeutils.advance_time_seconds(
+            CONF.token.revocation_events_cache_time)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+
+    def test_delete_tokens(self):
+        timeutils.set_time_override()
+        token_id = self._authenticate()
+        other_tenant_id = self._authenticate(tenant_name=None)
+        timeutils.advance_time_seconds(1)
+        self.token_manager.delete_tokens({}, self.user_foo['id'],
+                                         tenant_id=self.tenant_bar['id'])
+        timeutils.advance_time_seconds(1)
+        later_id = self._authenticate()
+
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+        self.token_manager.get_token({}, other_tenant_id)
+        self.token_manager.get_token({}, later_id)
+
+    def test_tampered_token(self):
+        token_id = self._authenticate()
+        last = 'A' if token_id[-1] != 'A' else 'B'
+        for bad_id in (token_id[:-1] + last, token_id[:-2], token_id + '!',
+                       token_id + '=', token_id + '==', token_id + '\n',
+                       token_id[:8] + '\n' + token_id[8:]):
+            self.assertRaises(exception.TokenNotFound,
+                              self.token_manager.get_token, {}, bad_id)
+
+    def test_key_rotation(self):
+        token_id = self._authenticate()
+        self.opt_in_group('signing', compact_keys=['key-two', 'key-one'])
+        new_id = self._authenticate()
+        self.token_manager.get_token({}, token_id)
+
+        self.opt_in_group('signing', compact_keys=['key-two'])
+        token.invalidate_token_cache()
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+        self.token_manager.get_token({}, new_id)
+
+    def test_expired_token(self):
+        timeutils.set_time_override()
+        token_id = self._authenticate()
+        timeutils.advance_time_seconds(CONF.token.expiration)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_manager.get_token, {}, token_id)
+
+
 class NonDefaultAuthTest(test.TestCase):
 
     def test_add_non_default_auth_method(self):
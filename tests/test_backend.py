@@ -254,6 +254,20 @@ class IdentityTests(object):
                           self.identity_api.get_role,
                           role_id=uuid.uuid4().hex)
 
+    def test_get_roles(self):
+        role_ids = [self.role_member['id'], self.role_admin['id'],
+                    self.role_other['id']]
+        role_refs = self.identity_api.get_roles(role_ids)
+        self.assertEqual([x['id'] for x in role_refs], role_ids)
+        role_ref_dict = dict((x, role_refs[1][x]) for x in role_refs[1])
+        self.assertDictEqual(role_ref_dict, self.role_admin)
+        self.assertEqual(self.identity_api.get_roles([]), [])
+
+    def test_get_roles_404(self):
+        self.assertRaises(exception.RoleNotFound,
+                          self.identity_api.get_roles,
+                          [self.role_admin['id'], uuid.uuid4().hex])
+
     def test_create_duplicate_role_name_fails(self):
         role = {'id': 'fake1',
                 'name': 'fake1name'}
@@ -2049,21 +2063,52 @@ class IdentityTests(object):
         self.assertEquals(len(user_projects), 2)
 
 
+def create_token_id():
+    # Token must start with MII here otherwise it fails the asn1 test
+    # and is not hashed in a SQL backend.
+    token_id = "MII"
+    for i in range(1, 20):
+        token_id += uuid.uuid4().hex
+    return token_id
+
+
+def create_token_sample_data(token_api, tenant_id=None, trust_id=None,
+                             user_id="testuserid", expires=None,
+                             context=None):
+    """Create a token and return the id it is stored under.
+
+    :param token_api: a token driver or, if a context is given, a token
+                      Manager
+
+    """
+    token_id = create_token_id()
+    data = {'id': token_id, 'a': 'b',
+            'user': {'id': user_id}}
+    if tenant_id is not None:
+        data['tenant'] = {'id': tenant_id, 'name': tenant_id}
+    if tenant_id is NULL_OBJECT:
+        data['tenant'] = None
+    if trust_id is not None:
+        data['trust_id'] = trust_id
+    if expires is not None:
+        data['expires'] = expires
+    if context is None:
+        new_token = token_api.create_token(token_id, data)
+    else:
+        new_token = token_api.create_token(context, token_id, data)
+    return new_token['id']
+
+
 class TokenTests(object):
     def _create_token_id(self):
-        # Token must start with MII here otherwise it fails the asn1 test
-        # and is not hashed in a SQL backend.
-        token_id = "MII"
-        for i in range(1, 20):
-            token_id += uuid.uuid4().hex
-        return token_id
+        return create_token_id()
 
     def test_token_crud(self):
         token_id = self._create_token_id()
         data = {'id': token_id, 'a': 'b',
                 'trust_id': None,
                 'user': {'id': 'testuserid'}}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = self.token_api.create_token(token_id, data).copy()
         expires = data_ref.pop('expires')
         data_ref.pop('user_id')
         self.assertTrue(isinstance(expires, datetime.datetime))
@@ -2071,7 +2116,7 @@ class TokenTests(object):
         data.pop('id')
         self.assertDictEqual(data_ref, data)
 
-        new_data_ref = self.token_api.get_token(token_id)
+        new_data_ref = self.token_api.get_token(token_id).copy()
         expires = new_data_ref.pop('expires')
         self.assertTrue(isinstance(expires, datetime.datetime))
         new_data_ref.pop('user_id')
@@ -2086,18 +2131,10 @@ class TokenTests(object):
                           self.token_api.delete_token, token_id)
 
     def create_token_sample_data(self, tenant_id=None, trust_id=None,
-                                 user_id="testuserid"):
-        token_id = self._create_token_id()
-        data = {'id': token_id, 'a': 'b',
-                'user': {'id': user_id}}
-        if tenant_id is not None:
-            data['tenant'] = {'id': tenant_id, 'name': tenant_id}
-        if tenant_id is NULL_OBJECT:
-            data['tenant'] = None
-        if trust_id is not None:
-            data['trust_id'] = trust_id
-        new_token = self.token_api.create_token(token_id, data)
-        return new_token['id']
+                                 user_id="testuserid", expires=None):
+        return create_token_sample_data(self.token_api, tenant_id=tenant_id,
+                                        trust_id=trust_id, user_id=user_id,
+                                        expires=expires)
 
     def test_delete_tokens(self):
         tokens = self.token_api.list_tokens('testuserid')
@@ -2208,7 +2245,7 @@ class TokenTests(object):
                 'expires': expire_time,
                 'trust_id': None,
                 'user': {'id': 'testuserid'}}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = self.token_api.create_token(token_id, data).copy()
         data_ref.pop('user_id')
         self.assertDictEqual(data_ref, data)
         self.assertRaises(exception.TokenNotFound,
@@ -2218,9 +2255,9 @@ class TokenTests(object):
         token_id = uuid.uuid4().hex
         data = {'id': token_id, 'id_hash': token_id, 'a': 'b', 'expires': None,
                 'user': {'id': 'testuserid'}}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = self.token_api.create_token(token_id, data).copy()
         self.assertIsNotNone(data_ref['expires'])
-        new_data_ref = self.token_api.get_token(token_id)
+        new_data_ref = self.token_api.get_token(token_id).copy()
 
         # MySQL doesn't store microseconds, so discard them before testing
         data_ref['expires'] = data_ref['expires'].replace(microsecond=0)
@@ -2229,6 +2266,34 @@ class TokenTests(object):
 
         self.assertEqual(data_ref, new_data_ref)
 
+    def test_revocation_events(self):
+        timeutils.set_time_override()
+        now = timeutils.utcnow().replace(microsecond=0)
+        events = [{'token_id': uuid.uuid4().hex, 'user_id': None,
+                   'tenant_id': None, 'trust_id': None,
+                   'issued_before': now,
+                   'expires': now + datetime.timedelta(seconds=10)},
+                  {'token_id': None, 'user_id': 'testuserid',
+                   'tenant_id': uuid.uuid4().hex, 'trust_id': None,
+                   'issued_before': now,
+                   'expires': now + datetime.timedelta(seconds=20)}]
+        for event in events:
+            self.token_api.create_revocation_event(event)
+
+        def listed():
+            listed = self.token_api.list_revocation_events()
+            return sorted((dict((k, event[k]) for k in events[0])
+                           for event in listed),
+                          key=lambda event: event['expires'])
+
+        self.assertEqual(listed(), events)
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(listed(), events[1:])
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(listed(), [])
+        self.token_api.create_revocation_event(events[0])
+        self.assertEqual(self.token_api.list_revocation_events(), [])
+
     def check_list_revoked_tokens(self, token_ids):
         revoked_ids = [x['id'] for x in self.token_api.list_revoked_tokens()]
         for token_id in token_ids:
@@ -2261,6 +2326,22 @@ class TokenTests(object):
         self.check_list_revoked_tokens([self.delete_token()
                                         for x in xrange(2)])
 
+    def test_list_revoked_tokens_since(self):
+        timeutils.set_time_override()
+        old_token_id = self.delete_token()
+        timeutils.advance_time_seconds(5)
+        since = timeutils.utcnow().replace(microsecond=0)
+        new_token_id = self.delete_token()
+
+        revoked_ids = [x['id']
+                       for x in self.token_api.list_revoked_tokens(since)]
+        self.assertIn(new_token_id, revoked_ids)
+        self.assertNotIn(old_token_id, revoked_ids)
+
+        timeutils.advance_time_seconds(5)
+        self.assertEqual(
+            self.token_api.list_revoked_tokens(timeutils.utcnow()), [])
+
     def test_flush_expired_token(self):
         token_id = uuid.uuid4().hex
         expire_time = timeutils.utcnow() - datetime.timedelta(minutes=1)
@@ -2268,7 +2349,7 @@ class TokenTests(object):
                 'expires': expire_time,
                 'trust_id': None,
                 'user': {'id': 'testuserid'}}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = self.token_api.create_token(token_id, data).copy()
         data_ref.pop('user_id')
         self.assertDictEqual(data_ref, data)
 
@@ -2278,7 +2359,7 @@ class TokenTests(object):
                 'expires': expire_time,
                 'trust_id': None,
                 'user': {'id': 'testuserid'}}
-        data_ref = self.token_api.create_token(token_id, data)
+        data_ref = self.token_api.create_token(token_id, data).copy()
         data_ref.pop('user_id')
         self.assertDictEqual(data_ref, data)
 
@@ -13,6 +13,7 @@
 # WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 # License for the specific language governing permissions and limitations
 # under the License.
+import datetime
 import uuid
 
 import nose.exc
@@ -21,6 +22,7 @@ from keystone import catalog
 from keystone.catalog.backends import kvs as catalog_kvs
 from keystone import exception
 from keystone import identity
+from keystone.openstack.common import timeutils
 from keystone import test
 from keystone.token.backends import kvs as token_kvs
 from keystone.trust.backends import kvs as trust_kvs
@@ -75,6 +77,48 @@ class KvsToken(test.TestCase, test_backend.TokenTests):
         super(KvsToken, self).setUp()
         self.token_api = token_kvs.Token(db={})
 
+    def test_token_indexes(self):
+        trust_id = uuid.uuid4().hex
+        token_id = self.create_token_sample_data(trust_id=trust_id)
+        db = self.token_api.db
+        self.assertIn(token_id, db['usertokens-testuserid'])
+        self.assertIn(token_id, db['trusttokens-%s' % trust_id])
+
+        # tokens are found through the indexes, not by scanning the store
+        db['token-%s' % uuid.uuid4().hex] = db['token-%s' % token_id]
+        self.assertEqual(self.token_api.list_tokens('testuserid'),
+                         [token_id])
+
+        self.token_api.delete_token(token_id)
+        self.assertNotIn('usertokens-testuserid', db)
+        self.assertNotIn('trusttokens-%s' % trust_id, db)
+        self.assertIn(token_id, db['revoked-tokens'])
+
+    def test_flush_expired_tokens_updates_indexes(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        expired_id = self.create_token_sample_data(expires=expires)
+        revoked_id = self.create_token_sample_data(expires=expires)
+        self.token_api.delete_token(revoked_id)
+        live_id = self.create_token_sample_data()
+
+        timeutils.advance_time_seconds(120)
+        self.token_api.flush_expired_tokens()
+        db = self.token_api.db
+        self.assertNotIn('token-%s' % expired_id, db)
+        self.assertNotIn('revoked-token-%s' % revoked_id, db)
+        self.assertNotIn('revoked-tokens', db)
+        self.assertEqual(db['usertokens-testuserid'].keys(), [live_id])
+        self.assertEqual(len(db['token-expiry-heap']), 1)
+
+    def test_get_token_is_not_copied(self):
+        token_id = self.create_token_sample_data()
+        token_ref = self.token_api.get_token(token_id)
+        self.assertIs(token_ref, self.token_api.get_token(token_id))
+        self.assertRaises(TypeError, token_ref.__setitem__, 'id', 'x')
+        self.assertRaises(TypeError, token_ref['user'].__setitem__, 'id', 'x')
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+
 
 class KvsTrust(test.TestCase, test_backend.TrustTests):
     def setUp(self):
@@ -588,6 +588,22 @@ class LDAPIdentity(test.TestCase, test_backend.IdentityTests):
         self.assertEqual(len(res), 1, "Expected 1 entry (user_1)")
         self.assertEqual(res[0]['id'], user_1_id, "Expected user 1 id")
 
+    def test_get_roles_in_one_search(self):
+        queries = []
+
+        def search_s(conn, dn, scope, query=None, fields=None,
+                     orig=fakeldap.FakeLdap.search_s):
+            queries.append(query)
+            return orig(conn, dn, scope, query, fields)
+
+        self.stubs.Set(fakeldap.FakeLdap, 'search_s', search_s)
+        role_ids = [self.role_member['id'], self.role_admin['id'],
+                    self.role_member['id']]
+        role_refs = self.identity_api.get_roles(role_ids)
+        self.assertEqual([x['id'] for x in role_refs], role_ids)
+        self.assertEqual(len(queries), 1)
+        self.assertIn('(|', queries[0])
+
     def test_list_domains(self):
         domains = self.identity_api.list_domains()
         self.assertEquals(
@@ -695,3 +711,16 @@ class LDAPIdentityEnabledEmulation(LDAPIdentity):
     def test_user_enable_attribute_mask(self):
         raise nose.exc.SkipTest(
             "Enabled emulation conflicts with enabled mask")
+
+
+class FakeLdapQuery(test.TestCase):
+    def test_or_filter(self):
+        attrs = {'cn': ['admin'], 'objectclass': ['keystoneRole']}
+        self.assertTrue(
+            fakeldap._match_query('(|(cn=member)(cn=admin))', attrs))
+        self.assertFalse(
+            fakeldap._match_query('(|(cn=member)(cn=other))', attrs))
+        self.assertTrue(fakeldap._match_query(
+            '(&(|(cn=member)(cn=admin))(objectclass=groupOfNames))', attrs))
+        self.assertFalse(fakeldap._match_query(
+            '(&(|(cn=member)(cn=admin))(objectclass=person))', attrs))
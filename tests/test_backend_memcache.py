@@ -14,12 +14,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import calendar
+import contextlib
+import copy
+import datetime
 import uuid
 
 import memcache
 
-from keystone.common import utils
+from keystone import config
 from keystone import exception
+from keystone.openstack.common import jsonutils
 from keystone.openstack.common import timeutils
 from keystone import test
 from keystone.token.backends import memcache as token_memcache
@@ -27,22 +32,27 @@ from keystone.token.backends import memcache as token_memcache
 import test_backend
 
 
+CONF = config.CONF
+
+
 class MemcacheClient(object):
     """Replicates a tiny subset of memcached client interface."""
 
     def __init__(self, *args, **kwargs):
         """Ignores the passed in args."""
         self.cache = {}
+        self.cas_ids = {}
+        self.calls = []
 
-    def add(self, key, value):
-        if self.get(key):
+    def add(self, key, value, time=0):
+        if self.get(key) is not None:
             return False
-        return self.set(key, value)
+        return self.set(key, value, time=time)
 
     def append(self, key, value):
         existing_value = self.get(key)
         if existing_value:
-            self.set(key, existing_value + value)
+            self.set(key, existing_value + value, time=self.cache[key][1])
             return True
         return False
 
@@ -52,16 +62,56 @@ class MemcacheClient(object):
 
     def get(self, key):
         """Retrieves the value for a key or None."""
+        self.calls.append('get')
+        return self._get(key)
+
+    def _get(self, key):
         self.check_key(key)
         obj = self.cache.get(key)
-        now = utils.unixtime(timeutils.utcnow())
+        now = calendar.timegm(timeutils.utcnow().utctimetuple())
         if obj and (obj[1] == 0 or obj[1] > now):
-            return obj[0]
+            # like memcached, hand out a copy rather than the stored object
+            return copy.deepcopy(obj[0])
+
+    def get_multi(self, keys):
+        """Retrieves the values of the keys that are set."""
+        self.calls.append('get_multi')
+        values = dict((key, self._get(key)) for key in keys)
+        return dict((k, v) for k, v in values.iteritems() if v is not None)
+
+    def gets(self, key):
+        """Retrieves the value for a key and remembers its version."""
+        value = self.get(key)
+        if value is not None:
+            self.cas_ids[key] = self.cache[key][2]
+        return value
+
+    def cas(self, key, value, time=0):
+        """Sets the value unless it changed since it was fetched by gets."""
+        if key in self.cas_ids and self.cas_ids[key] != self.cache[key][2]:
+            return False
+        return self.set(key, value, time=time)
+
+    def reset_cas(self):
+        self.cas_ids = {}
+
+    @contextlib.contextmanager
+    def acquire(self):
+        yield self
+        self.reset_cas()
+
+    def incr(self, key, delta=1):
+        value = self.get(key)
+        if value is None:
+            return None
+        self.set(key, value + delta, time=self.cache[key][1])
+        return value + delta
 
     def set(self, key, value, time=0):
         """Sets the value for a key."""
         self.check_key(key)
-        self.cache[key] = (value, time)
+        version = self.cache[key][2] + 1 if key in self.cache else 0
+        self.cache[key] = (value, time, version)
         return True
 
     def delete(self, key):
@@ -72,6 +122,12 @@ class MemcacheClient(object):
             #NOTE(bcwaldon): python-memcached always returns the same value
             pass
 
+    def delete_multi(self, keys):
+        self.calls.append('delete_multi')
+        for key in keys:
+            self.delete(key)
+        return True
+
 
 class MemcacheToken(test.TestCase, test_backend.TokenTests):
     def setUp(self):
@@ -101,3 +157,169 @@ class MemcacheToken(test.TestCase, test_backend.TokenTests):
     def test_flush_expired_token(self):
         with self.assertRaises(exception.NotImplemented):
             self.token_api.flush_expired_tokens()
+
+    def _revoke_token(self, expires):
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id, 'a': 'b', 'expires': expires,
+                'user': {'id': 'testuserid'}}
+        self.token_api.create_token(token_id, data)
+        self.token_api.delete_token(token_id)
+        return token_id
+
+    def _revoked_ids(self):
+        return [x['id'] for x in self.token_api.list_revoked_tokens()]
+
+    def test_revocation_list_is_sharded_by_expiry(self):
+        self.opt_in_group('memcache', revocation_shard_interval=60)
+        timeutils.set_time_override()
+        now = timeutils.utcnow()
+        soon = now + datetime.timedelta(minutes=1)
+        later = now + datetime.timedelta(minutes=10)
+        token_ids = [self._revoke_token(soon), self._revoke_token(later)]
+
+        shards = [k for k in self.token_api.client.cache
+                  if k.startswith('revocation-list-')]
+        self.assertEqual(len(shards), 2)
+        self.assertNotIn('revocation-list', self.token_api.client.cache)
+        self.assertEqual(sorted(self._revoked_ids()), sorted(token_ids))
+
+        # the shard holding the first token is dropped by memcache
+        timeutils.advance_time_seconds(150)
+        self.assertEqual(self._revoked_ids(), token_ids[1:])
+        shards = [k for k in self.token_api.client.cache
+                  if k.startswith('revocation-list-')
+                  and self.token_api.client.get(k)]
+        self.assertEqual(len(shards), 1)
+
+    def test_expired_revocations_are_pruned(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow() + datetime.timedelta(seconds=10)
+        token_id = self._revoke_token(expires)
+        self.assertEqual(self._revoked_ids(), [token_id])
+
+        timeutils.advance_time_seconds(10)
+        self.assertEqual(self._revoked_ids(), [])
+
+    def test_revocation_beyond_token_expiration(self):
+        expires = timeutils.utcnow() + datetime.timedelta(days=7)
+        token_id = self._revoke_token(expires)
+        self.opt_in_group('token', expiration=60)
+        self.assertEqual(self._revoked_ids(), [token_id])
+
+    def test_revocation_horizon_moves_back(self):
+        self.opt_in_group('token', expiration=60)
+        timeutils.set_time_override()
+        self._revoke_token(timeutils.utcnow() + datetime.timedelta(days=7))
+        self.assertIsNotNone(
+            self.token_api.client.get('revocation-horizon'))
+
+        timeutils.advance_time_seconds(
+            7 * 86400 + CONF.memcache.revocation_shard_interval)
+        self.assertIsNone(self.token_api.client.get('revocation-horizon'))
+        self.assertEqual(self._revoked_ids(), [])
+
+        expires = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        token_id = self._revoke_token(expires)
+        self.assertEqual(self.token_api.client.get('revocation-horizon'),
+                         self.token_api._revocation_shard(expires))
+        self.assertEqual(self._revoked_ids(), [token_id])
+
+    def test_revocation_shards_ignore_the_local_timezone(self):
+        self.set_timezone('Asia/Tokyo')
+        expires = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        self._revoke_token(expires)
+        shard = self.token_api.client.get('revocation-horizon')
+        shard_expires = self.token_api.client.cache[
+            'revocation-list-%d' % shard][1]
+        self.assertTrue(shard_expires >=
+                        calendar.timegm(expires.utctimetuple()))
+        self.assertTrue(shard_expires <=
+                        calendar.timegm(expires.utctimetuple()) +
+                        CONF.memcache.revocation_shard_interval)
+
+    def test_revocation_events_are_sharded_by_expiry(self):
+        self.opt_in_group('memcache', revocation_shard_interval=60)
+        timeutils.set_time_override()
+        now = timeutils.utcnow()
+        for minutes in (1, 10):
+            self.token_api.create_revocation_event(
+                {'user_id': uuid.uuid4().hex, 'issued_before': now,
+                 'expires': now + datetime.timedelta(minutes=minutes)})
+        shards = [key for key in self.token_api.client.cache
+                  if key.startswith('revocation-events-')
+                  and key != 'revocation-events-horizon']
+        self.assertEqual(len(shards), 2)
+        for key in shards:
+            # each shard is dropped by memcache once its events expire
+            self.assertNotEqual(self.token_api.client.cache[key][1], 0)
+        self.assertEqual(len(self.token_api.list_revocation_events()), 2)
+
+        timeutils.advance_time_seconds(150)
+        self.assertEqual(len(self.token_api.list_revocation_events()), 1)
+        self.assertEqual(len([key for key in shards
+                              if self.token_api.client.get(key)]), 1)
+
+    def test_legacy_revocation_list(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow() + datetime.timedelta(minutes=1)
+        legacy_id = uuid.uuid4().hex
+        self.token_api.client.set(
+            'revocation-list',
+            jsonutils.dumps({'id': legacy_id, 'a': 'b', 'expires': expires,
+                             'user': {'id': 'testuserid'}}))
+        token_id = self._revoke_token(expires)
+        self.assertEqual(sorted(self._revoked_ids()),
+                         sorted([legacy_id, token_id]))
+        self.assertIsNotNone(self.token_api.client.get('revocation-list'))
+
+        timeutils.advance_time_seconds(60)
+        self.assertEqual(self._revoked_ids(), [])
+        self.assertIsNone(self.token_api.client.get('revocation-list'))
+
+    def _create_user_token(self, expires=None):
+        token_id = uuid.uuid4().hex
+        data = {'id': token_id, 'a': 'b', 'expires': expires,
+                'user': {'id': 'testuserid'}}
+        self.token_api.create_token(token_id, data)
+        return token_id
+
+    def _user_index_ids(self):
+        record = self.token_api.client.get('usertokens-testuserid')
+        return [token_id for token_id, expires
+                in self.token_api._parse_user_index(record)]
+
+    def test_user_index_is_compacted(self):
+        timeutils.set_time_override()
+        expires = timeutils.utcnow() + datetime.timedelta(seconds=10)
+        short_id = self._create_user_token(expires)
+        long_id = self._create_user_token()
+        self.assertEqual(self._user_index_ids(), [short_id, long_id])
+
+        timeutils.advance_time_seconds(10)
+        new_id = self._create_user_token()
+        self.assertEqual(self._user_index_ids(), [long_id, new_id])
+
+    def test_legacy_user_index_is_converted(self):
+        live_id = self._create_user_token()
+        self.token_api.client.set(
+            'usertokens-testuserid',
+            '%s,%s' % (jsonutils.dumps(live_id),
+                       jsonutils.dumps(uuid.uuid4().hex)))
+        self.assertEqual(self.token_api.list_tokens('testuserid'), [live_id])
+
+        new_id = self._create_user_token()
+        self.assertEqual(self._user_index_ids(), [live_id, new_id])
+        record = self.token_api.client.get('usertokens-testuserid')
+        self.assertTrue(all(expires for token_id, expires
+                            in self.token_api._parse_user_index(record)))
+
+    def test_delete_tokens_is_batched(self):
+        token_ids = [self._create_user_token() for i in range(5)]
+        self.token_api.client.calls = []
+        self.token_api.delete_tokens('testuserid')
+
+        calls = self.token_api.client.calls
+        self.assertEqual(calls.count('get_multi'), 1)
+        self.assertEqual(calls.count('delete_multi'), 1)
+        self.assertEqual(self.token_api.list_tokens('testuserid'), [])
+        self.assertEqual(sorted(self._revoked_ids()), sorted(token_ids))
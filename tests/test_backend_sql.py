@@ -14,16 +14,28 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import datetime
+import os
+import shutil
+import tempfile
 import uuid
 
+import sqlalchemy
+
 from keystone import catalog
+from keystone.common import metrics
 from keystone.common import sql
+from keystone.common import utils
 from keystone import config
 from keystone import exception
 from keystone import identity
+from keystone.openstack.common import timeutils
 from keystone import policy
 from keystone import test
 from keystone import token
+from keystone.token.backends import partitioned_sql
+from keystone.token.backends import sharded_sql
+from keystone.token.backends import sql as token_sql
 from keystone import trust
 
 import default_fixtures
@@ -236,13 +248,521 @@ class SqlIdentity(SqlTests, test_backend.IdentityTests):
         self.assertEqual(arbitrary_value, ref[arbitrary_key])
         self.assertEqual(arbitrary_value, ref['extra'][arbitrary_key])
 
+    def test_get_roles_in_one_query(self):
+        statements = []
+        sqlalchemy.event.listen(
+            self.engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement))
+        role_refs = self.identity_api.get_roles(
+            [self.role_admin['id'], self.role_member['id'],
+             self.role_admin['id']])
+        self.assertEqual([x['id'] for x in role_refs],
+                         [self.role_admin['id'], self.role_member['id'],
+                          self.role_admin['id']])
+        self.assertEqual(len(statements), 1)
+
+
+class SqlPasswordCache(SqlTests):
+    def setUp(self):
+        super(SqlPasswordCache, self).setUp()
+        self.opt_in_group('identity', password_cache_size=2)
+        self.stats = metrics.collector('password_cache')
+        self.stats.reset()
+        self.checks = []
+
+        def fake_check(password, hashed, orig=utils.check_password):
+            self.checks.append(password)
+            return orig(password, hashed)
+
+        self.stubs.Set(utils, 'check_password', fake_check)
+
+    def _authenticate(self, user, password=None):
+        return self.identity_api.authenticate_user(
+            user_id=user['id'], password=password or user['password'])
+
+    def test_repeat_authentication_skips_hashing(self):
+        self._authenticate(self.user_foo)
+        self._authenticate(self.user_foo)
+        for i in range(2):
+            self.assertRaises(AssertionError, self._authenticate,
+                              self.user_foo, 'wrong')
+        self.assertEqual(self.checks, ['foo2', 'wrong', 'wrong'])
+        stats = self.stats.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+    def test_entries_expire(self):
+        timeutils.set_time_override()
+        self._authenticate(self.user_foo)
+        timeutils.advance_time_seconds(CONF.identity.password_cache_time)
+        self._authenticate(self.user_foo)
+        self.assertEqual(len(self.checks), 2)
+
+    def test_least_recently_used_is_evicted(self):
+        for user in (self.user_foo, self.user_two, self.user_foo,
+                     self.user_badguy, self.user_foo, self.user_two):
+            self._authenticate(user)
+        self.assertEqual(self.checks, ['foo2', 'two2', 'bad', 'two2'])
+
+    def test_update_user_evicts(self):
+        self._authenticate(self.user_foo)
+        self.identity_api.update_user(self.user_foo['id'], {'name': 'fooz'})
+        self._authenticate(self.user_foo)
+        self.assertEqual(len(self.checks), 2)
+
+        self.identity_api.update_user(self.user_foo['id'],
+                                      {'password': 'new'})
+        self.assertRaises(AssertionError, self._authenticate, self.user_foo)
+        self._authenticate(self.user_foo, 'new')
+
+    def test_password_is_not_kept(self):
+        self._authenticate(self.user_foo)
+        entries = identity.core._password_cache._entries
+        self.assertEqual(len(entries), 1)
+        self.assertNotIn('foo2', repr(entries))
+
+    def test_disabled(self):
+        self.opt_in_group('identity', password_cache_size=0)
+        self._authenticate(self.user_foo)
+        self._authenticate(self.user_foo)
+        self.assertEqual(len(self.checks), 2)
+
+
+class SqlAuthScope(SqlTests):
+    def setUp(self):
+        super(SqlAuthScope, self).setUp()
+        self.domain = {'id': uuid.uuid4().hex, 'name': uuid.uuid4().hex,
+                       'enabled': True}
+        self.identity_api.create_domain(self.domain['id'], self.domain)
+        self.groups = []
+        for role_id in ('other', 'browser'):
+            group = {'id': uuid.uuid4().hex, 'name': uuid.uuid4().hex,
+                     'domain_id': DEFAULT_DOMAIN_ID}
+            self.identity_api.create_group(group['id'], group)
+            self.identity_api.add_user_to_group(self.user_foo['id'],
+                                                group['id'])
+            self.identity_api.create_grant(role_id, group_id=group['id'],
+                                           project_id=self.tenant_bar['id'])
+            self.identity_api.create_grant(role_id, group_id=group['id'],
+                                           domain_id=self.domain['id'])
+            self.groups.append(group)
+        self.identity_api.create_grant('admin', user_id=self.user_foo['id'],
+                                       project_id=self.tenant_bar['id'])
+        self.identity_api.create_grant('writer',
+                                       user_id=self.user_foo['id'],
+                                       domain_id=self.domain['id'])
+
+    def _resolve_by_driver_calls(self, *args, **kwargs):
+        return identity.Driver.resolve_auth_scope(self.identity_api, *args,
+                                                  **kwargs)
+
+    def assertScopesEqual(self, scope, expected):
+        self.assertEqual(sorted(scope.pop('roles')),
+                         sorted(expected.pop('roles')))
+        self.assertEqual(scope, expected)
+
+    def test_project_scope(self):
+        scope = self.identity_api.resolve_auth_scope(
+            self.user_foo['id'], project_id=self.tenant_bar['id'])
+        self.assertEqual(scope['user']['id'], self.user_foo['id'])
+        self.assertNotIn('password', scope['user'])
+        self.assertEqual(scope['project']['id'], self.tenant_bar['id'])
+        self.assertIsNone(scope['domain'])
+        self.assertEqual(scope['domains'].keys(), [DEFAULT_DOMAIN_ID])
+        self.assertTrue(scope['member'])
+        self.assertIn('admin', scope['metadata']['roles'])
+        self.assertNotIn('other', scope['metadata']['roles'])
+        self.assertEqual(set(scope['roles']),
+                         set(scope['metadata']['roles'] +
+                             ['other', 'browser']))
+        self.assertScopesEqual(scope, self._resolve_by_driver_calls(
+            self.user_foo['id'], project_id=self.tenant_bar['id']))
+
+    def test_project_scope_without_grants(self):
+        scope = self.identity_api.resolve_auth_scope(
+            self.user_two['id'], project_id=self.tenant_bar['id'])
+        self.assertFalse(scope['member'])
+        self.assertEqual(scope['metadata'], {})
+        self.assertEqual(scope['roles'], [])
+        self.assertScopesEqual(scope, self._resolve_by_driver_calls(
+            self.user_two['id'], project_id=self.tenant_bar['id']))
+
+    def test_domain_scope(self):
+        scope = self.identity_api.resolve_auth_scope(
+            self.user_foo['id'], domain_id=self.domain['id'])
+        self.assertIsNone(scope['project'])
+        self.assertEqual(scope['domain'], self.domain)
+        self.assertEqual(sorted(scope['domains'].keys()),
+                         sorted([DEFAULT_DOMAIN_ID, self.domain['id']]))
+        self.assertFalse(scope['member'])
+        self.assertEqual(set(scope['roles']),
+                         set(['writer', 'other', 'browser']))
+        self.assertScopesEqual(scope, self._resolve_by_driver_calls(
+            self.user_foo['id'], domain_id=self.domain['id']))
+
+    def test_unscoped(self):
+        scope = self.identity_api.resolve_auth_scope(self.user_foo['id'])
+        self.assertIsNone(scope['project'])
+        self.assertIsNone(scope['domain'])
+        self.assertEqual(scope['roles'], [])
+        self.assertScopesEqual(scope, self._resolve_by_driver_calls(
+            self.user_foo['id']))
+
+    def test_not_found(self):
+        for driver in (self.identity_api.resolve_auth_scope,
+                       self._resolve_by_driver_calls):
+            self.assertRaises(exception.UserNotFound, driver,
+                              uuid.uuid4().hex)
+            self.assertRaises(exception.ProjectNotFound, driver,
+                              self.user_foo['id'],
+                              project_id=uuid.uuid4().hex)
+            self.assertRaises(exception.DomainNotFound, driver,
+                              self.user_foo['id'],
+                              domain_id=uuid.uuid4().hex)
+
+    def test_single_query(self):
+        statements = []
+        sqlalchemy.event.listen(
+            self.engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement))
+        self.identity_api.resolve_auth_scope(
+            self.user_foo['id'], project_id=self.tenant_bar['id'])
+        self.identity_api.resolve_auth_scope(
+            self.user_foo['id'], domain_id=self.domain['id'])
+        self.assertEqual(len(statements), 2)
+
 
 class SqlTrust(SqlTests, test_backend.TrustTests):
     pass
 
 
 class SqlToken(SqlTests, test_backend.TokenTests):
-    pass
+    def _create_tokens(self, count, expires):
+        for i in range(count):
+            self.create_token_sample_data(expires=expires)
+
+    def test_tenant_id_column(self):
+        tenant_id = uuid.uuid4().hex
+        token_id = uuid.uuid4().hex
+        self.token_api.create_token(token_id, {'id': token_id,
+                                               'tenant': {'id': tenant_id},
+                                               'user': {'id': 'user'}})
+        session = self.token_api.get_session()
+        token_ref = session.query(token_sql.TokenModel).get(token_id)
+        self.assertEqual(token_ref.tenant_id, tenant_id)
+        self.assertNotIn('tenant_id', self.token_api.get_token(token_id))
+
+        # the tenant filters run in SQL, without decoding extra
+        self.stubs.Set(token_sql.TokenModel, 'to_dict', None)
+        self.assertEqual(self.token_api.list_tokens('user', tenant_id),
+                         [token_id])
+        self.token_api.delete_tokens('user', tenant_id=uuid.uuid4().hex)
+        self.assertEqual(self.token_api.list_tokens('user'), [token_id])
+        self.token_api.delete_tokens('user', tenant_id=tenant_id)
+        self.assertEqual(self.token_api.list_tokens('user'), [])
+
+    def test_revocation_does_not_load_tokens(self):
+        token_ids = [uuid.uuid4().hex for i in range(3)]
+        for token_id in token_ids:
+            self.token_api.create_token(token_id, {'id': token_id,
+                                                   'user': {'id': 'user'}})
+
+        self.stubs.Set(token_sql.TokenModel, 'to_dict', None)
+        self.token_api.delete_token(token_ids[0])
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.delete_token, token_ids[0])
+        self.token_api.delete_tokens('user')
+        revoked = self.token_api.list_revoked_tokens()
+        self.assertEqual(sorted(ref['id'] for ref in revoked),
+                         sorted(token_ids))
+
+    def test_flush_expired_tokens_in_batches(self):
+        self.opt_in_group('token', flush_batch_size=2, flush_batch_pause=0.5)
+        pauses = []
+        self.stubs.Set(token_sql.time, 'sleep', pauses.append)
+        now = timeutils.utcnow()
+        self._create_tokens(5, now - datetime.timedelta(minutes=1))
+        self._create_tokens(1, now + datetime.timedelta(minutes=1))
+
+        self.assertEqual(self.token_api.flush_expired_tokens(), 5)
+        self.assertEqual(pauses, [0.5, 0.5])
+        self.assertEqual(len(self.token_api.list_tokens('testuserid')), 1)
+        self.assertEqual(self.token_api.flush_expired_tokens(), 0)
+
+    def test_flush_expired_tokens_stops_after_max_runtime(self):
+        self.opt_in_group('token', flush_batch_size=2, flush_max_runtime=10)
+        clock = [1000.0]
+        self.stubs.Set(token_sql.time, 'time', lambda: clock[0])
+        self.stubs.Set(token_sql.time, 'sleep',
+                       lambda seconds: clock.__setitem__(0, clock[0] + 6))
+        self._create_tokens(7, timeutils.utcnow() -
+                            datetime.timedelta(minutes=1))
+
+        # batches run at 0, 6 and 12 seconds, then the limit has passed
+        self.assertEqual(self.token_api.flush_expired_tokens(), 6)
+        self.assertEqual(self.token_api.flush_expired_tokens(), 1)
+
+    def test_flush_expired_tokens_unbatched(self):
+        self.opt_in_group('token', flush_batch_size=0)
+        self._create_tokens(3, timeutils.utcnow() -
+                            datetime.timedelta(minutes=1))
+        self.assertEqual(self.token_api.flush_expired_tokens(), 3)
+
+
+class SqlWriteBehindToken(SqlTests):
+    def setUp(self):
+        super(SqlWriteBehindToken, self).setUp()
+        self.opt_in_group('token', write_behind=True,
+                          write_behind_interval=0.01)
+        self.stats = metrics.collector('token_write_behind')
+        self.stats.reset()
+
+    def _create_token(self, user_id='user'):
+        return test_backend.create_token_sample_data(
+            self.token_man, user_id=user_id, context={})
+
+    def test_queued_tokens_are_validated(self):
+        token_id = self._create_token()
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+        token_ref = self.token_man.get_token({}, token_id)
+        self.assertEqual(token_ref['user_id'], 'user')
+
+        token.flush_write_behind()
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+        stats = self.stats.get_stats()
+        self.assertEqual((stats['queued'], stats['flushed']), (1, 1))
+
+    def test_tokens_are_written_in_batches(self):
+        self.opt_in_group('token', write_behind_batch_size=2)
+        batches = []
+
+        def fake_create_tokens(tokens, orig=self.token_api.create_tokens):
+            batches.append(len(tokens))
+            return orig(tokens)
+
+        self.stubs.Set(self.token_api, 'create_tokens', fake_create_tokens)
+        token_ids = [self._create_token() for i in range(5)]
+        # the green thread writes everything queued, then stops
+        self.token_man._write_behind._flusher.wait()
+        self.assertEqual(batches, [2, 2, 1])
+        self.assertEqual(sorted(self.token_api.list_tokens('user')),
+                         sorted(token_ids))
+
+    def test_revocation_writes_queued_tokens(self):
+        token_id = self._create_token()
+        other_id = self._create_token(user_id='other')
+        self.assertEqual(self.token_man.list_tokens({}, 'other'), [other_id])
+        self.token_man.delete_token({}, token_id)
+        revoked = self.token_api.list_revoked_tokens()
+        self.assertEqual([ref['id'] for ref in revoked], [token_id])
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_man.get_token, {}, token_id)
+
+    def test_full_queue_writes_through(self):
+        self.opt_in_group('token', write_behind_queue_size=1)
+        queued_id = self._create_token()
+        written_id = self._create_token()
+        self.token_api.get_token(written_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, queued_id)
+        self.assertEqual(self.stats.get_stats()['overflow'], 1)
+
+    def test_rejected_tokens_are_dropped(self):
+        token_ids = [self._create_token() for i in range(3)]
+
+        def reject(tokens):
+            raise exception.Conflict(type='token', details='rejected')
+
+        def reject_one(token_id, data, orig=self.token_api.create_token):
+            if token.unique_id(token_id) == token_ids[1]:
+                reject([])
+            return orig(token_id, data)
+
+        self.stubs.Set(self.token_api, 'create_tokens', reject)
+        self.stubs.Set(self.token_api, 'create_token', reject_one)
+        self.assertEqual(self.token_man._write_behind.flush(), 2)
+        for token_id in token_ids[::2]:
+            self.token_api.get_token(token_id)
+        # dropped, not queued again
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_man.get_token, {}, token_ids[1])
+        self.assertEqual(self.token_man._write_behind.flush(), 0)
+        stats = self.stats.get_stats()
+        self.assertEqual((stats['errors'], stats['dropped'], stats['flushed']),
+                         (1, 1, 2))
+
+    def test_tokens_written_before_are_not_dropped(self):
+        token_ids = [self._create_token() for i in range(3)]
+        self.token_api.create_token(token_ids[1], {'id': token_ids[1],
+                                                   'user': {'id': 'user'}})
+        self.assertEqual(self.token_man._write_behind.flush(), 3)
+        self.assertEqual(sorted(self.token_api.list_tokens('user')),
+                         sorted(token_ids))
+        self.assertNotIn('dropped', self.stats.get_stats())
+
+    def test_failed_writes_stay_queued(self):
+        def fail(tokens):
+            raise exception.UnexpectedError()
+
+        token_id = self._create_token()
+        orig = self.token_api.create_tokens
+        self.stubs.Set(self.token_api, 'create_tokens', fail)
+        self.assertEqual(self.token_man._write_behind.flush(), 0)
+        self.assertEqual(self.stats.get_stats()['errors'], 1)
+        self.token_man.get_token({}, token_id)
+
+        self.stubs.Set(self.token_api, 'create_tokens', orig)
+        self.token_man._write_behind._flusher.wait()
+        self.token_api.get_token(token_id)
+
+    def test_revocation_discards_tokens_left_queued(self):
+        def fail(tokens):
+            raise exception.UnexpectedError()
+
+        token_id = self._create_token()
+        other_id = self._create_token(user_id='other')
+        self.stubs.Set(self.token_api, 'create_tokens', fail)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_man.delete_token, {}, token_id)
+        self.token_man.delete_tokens({}, 'other')
+        for revoked_id in (token_id, other_id):
+            self.assertRaises(exception.TokenNotFound,
+                              self.token_man.get_token, {}, revoked_id)
+
+
+class SqlPartitionedToken(SqlTests, test_backend.TokenTests):
+    def setUp(self):
+        super(SqlPartitionedToken, self).setUp()
+        self.token_api = self.token_man.driver = partitioned_sql.Token()
+
+    def _partitions(self):
+        return sorted(name for name in self.engine.table_names()
+                      if name.startswith('token_'))
+
+    def test_tokens_are_partitioned_by_expiry(self):
+        self.opt_in_group('token', partition_interval=60, expiration=120)
+        timeutils.set_time_override(datetime.datetime(2013, 1, 1))
+        now = timeutils.utcnow()
+        token_ids = [self.create_token_sample_data(
+                     expires=now + datetime.timedelta(seconds=s))
+                     for s in (30, 90, 150)]
+        self.token_api.delete_token(token_ids[2])
+        self.assertEqual(self.token_api.list_tokens('testuserid'),
+                         token_ids[:2])
+        self.assertEqual([ref['id'] for ref in
+                          self.token_api.list_revoked_tokens()],
+                         token_ids[2:])
+        # created ahead for tokens expiring up to three minutes from now
+        self.assertEqual(len(self._partitions()), 4)
+
+        # a partition is dropped a minute after its last token expired
+        timeutils.advance_time_seconds(100)
+        self.token_api.flush_expired_tokens()
+        self.assertEqual(len(self._partitions()), 4)
+        timeutils.advance_time_seconds(20)
+        self.token_api.flush_expired_tokens()
+        self.assertEqual(len(self._partitions()), 3)
+        self.assertEqual([ref['id'] for ref in
+                          self.token_api.list_revoked_tokens()],
+                         token_ids[2:])
+
+    def test_partitions_ignore_the_local_timezone(self):
+        self.set_timezone('EST+05')
+        when = datetime.datetime(2013, 1, 1, 12, 30)
+        interval, bucket = self.token_api._partition(when)
+        self.assertTrue(partitioned_sql._partition_end(
+            (interval, bucket - 1)) <= when)
+        self.assertTrue(when < partitioned_sql._partition_end(
+            (interval, bucket)))
+
+    def test_changing_the_interval_keeps_live_tables(self):
+        timeutils.set_time_override(datetime.datetime(2013, 1, 1))
+        token_id = self.create_token_sample_data(
+            expires=timeutils.utcnow() + datetime.timedelta(minutes=30))
+
+        self.opt_in_group('token', partition_interval=60, expiration=120)
+        self.token_api = partitioned_sql.Token()
+        timeutils.advance_time_seconds(600)
+        self.token_api.flush_expired_tokens()
+        self.assertEqual(self.token_api.list_tokens('testuserid'), [token_id])
+        self.token_api.delete_tokens('testuserid')
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+
+    def test_known_tables_are_not_looked_up(self):
+        self.opt_in_group('token', expiration=7200)
+        self.token_api.list_tokens('testuserid')
+        statements = []
+        sqlalchemy.event.listen(
+            self.engine, 'before_cursor_execute',
+            lambda conn, cursor, statement, *args: statements.append(
+                statement))
+        token_id = self.create_token_sample_data(
+            expires=timeutils.utcnow() + datetime.timedelta(hours=1))
+        self.token_api.list_tokens('testuserid')
+        self.token_api.get_token(token_id)
+        self.token_api.list_revoked_tokens()
+        self.token_api.delete_tokens('testuserid')
+        self.assertEqual(
+            [s for s in statements
+             if 'sqlite_master' in s or s.startswith('PRAGMA')], [])
+
+    def test_tables_created_by_other_processes_are_read(self):
+        other = partitioned_sql.Token()
+        self.token_api.list_tokens('testuserid')
+        token_id = test_backend.create_token_sample_data(other)
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+        self.token_api.delete_token(token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          other.get_token, token_id)
+
+
+class SqlShardedToken(SqlTests, test_backend.TokenTests):
+    def setUp(self):
+        super(SqlShardedToken, self).setUp()
+        self.shard_dir = tempfile.mkdtemp()
+        self.opt_in_group('token', shard_connections=[
+            'sqlite:///%s' % os.path.join(self.shard_dir, 'shard%d.db' % i)
+            for i in range(3)])
+        self.token_api = self.token_man.driver = sharded_sql.Token()
+        for shard in self.token_api.shards:
+            token_sql.TokenModel.__table__.create(shard.get_engine())
+
+    def tearDown(self):
+        for shard in self.token_api.shards:
+            shard.get_engine().dispose()
+        shutil.rmtree(self.shard_dir)
+        super(SqlShardedToken, self).tearDown()
+
+    def test_tokens_are_spread_over_shards(self):
+        token_ids = [uuid.uuid4().hex for i in range(30)]
+        for token_id in token_ids:
+            self.token_api.create_token(token_id, {'id': token_id,
+                                                   'user': {'id': 'user'}})
+        for shard in self.token_api.shards:
+            shard_tokens = shard.list_tokens('user')
+            self.assertTrue(shard_tokens)
+            for token_id in shard_tokens:
+                self.assertIs(self.token_api._shard(token_id), shard)
+        self.assertEqual(sorted(self.token_api.list_tokens('user')),
+                         sorted(token_ids))
+
+        self.token_api.delete_tokens('user')
+        self.assertEqual(len(self.token_api.list_revoked_tokens()), 30)
+
+    def test_adding_a_shard_moves_few_tokens(self):
+        token_ids = [uuid.uuid4().hex for i in range(300)]
+        before = [self.token_api.shards.index(self.token_api._shard(t))
+                  for t in token_ids]
+        connections = CONF.token.shard_connections + ['sqlite://']
+        self.opt_in_group('token', shard_connections=connections)
+        driver = sharded_sql.Token()
+        after = [driver.shards.index(driver._shard(t)) for t in token_ids]
+        moved = [(b, a) for b, a in zip(before, after) if b != a]
+        self.assertTrue(all(a == 3 for b, a in moved))
+        self.assertTrue(len(moved) < 150)
 
 
 class SqlCatalog(SqlTests, test_backend.CatalogTests):
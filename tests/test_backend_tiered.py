@@ -0,0 +1,132 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from keystone import exception
+from keystone.openstack.common import timeutils
+from keystone.token.backends import memcache as token_memcache
+from keystone.token.backends import tiered
+
+import test_backend
+import test_backend_memcache
+import test_backend_sql
+
+
+class TieredToken(test_backend_sql.SqlTests, test_backend.TokenTests):
+    def setUp(self):
+        super(TieredToken, self).setUp()
+        self.opt_in_group('token', tier_local_size=100)
+        self.durable = self.token_api
+        self.shared = token_memcache.Token(
+            client=test_backend_memcache.MemcacheClient())
+        self.token_api = self.token_man.driver = tiered.Token(
+            shared=self.shared, durable=self.durable)
+
+    def _unavailable(self, tier):
+        def fail(token_id):
+            raise AssertionError('token read from the wrong tier')
+        self.stubs.Set(tier, 'get_token', fail)
+
+    def _tier(self):
+        return tiered.Token(shared=self.shared, durable=self.durable)
+
+    def test_written_through_to_every_tier(self):
+        token_id = self.create_token_sample_data()
+        for tier in (self.shared, self.durable):
+            self.assertEqual(tier.get_token(token_id)['id'], token_id)
+
+    def test_read_from_the_first_tier_holding_the_token(self):
+        token_id = self.create_token_sample_data()
+        self._unavailable(self.shared)
+        self._unavailable(self.durable)
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+
+    def test_reads_fill_the_tiers_above(self):
+        token_id = test_backend.create_token_sample_data(self.durable)
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+        self._unavailable(self.durable)
+        self.assertEqual(self.shared.get_token(token_id)['id'], token_id)
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+
+    def test_revocation_reaches_every_tier(self):
+        token_id = self.create_token_sample_data()
+        other_id = self.create_token_sample_data()
+        self.token_api.delete_token(token_id)
+        self.token_api.delete_tokens('testuserid')
+        for tier in (self.token_api, self.shared, self.durable):
+            for revoked_id in (token_id, other_id):
+                self.assertRaises(exception.TokenNotFound,
+                                  tier.get_token, revoked_id)
+
+    def test_revocation_racing_a_fill_is_not_lost(self):
+        token_id = test_backend.create_token_sample_data(self.durable)
+        create_token = self.shared.create_token
+
+        def revoke_during_fill(token_id, data):
+            self.durable.delete_token(token_id)
+            return create_token(token_id, data)
+
+        self.stubs.Set(self.shared, 'create_token', revoke_during_fill)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.shared.get_token, token_id)
+
+    def test_revocation_by_another_process_reaches_local_tier(self):
+        other = self._tier()
+        token_id = self.create_token_sample_data()
+        other_id = self.create_token_sample_data()
+        self.token_api.get_token(token_id)
+        self.token_api.get_token(other_id)
+        other.delete_token(token_id)
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, token_id)
+        other.delete_tokens('testuserid')
+        self.assertRaises(exception.TokenNotFound,
+                          self.token_api.get_token, other_id)
+
+    def test_revocation_marker_lost_from_memcache(self):
+        token_id = self.create_token_sample_data()
+        self.token_api.get_token(token_id)
+        self.shared.client.delete(self.token_api.revocation_marker_key)
+        self._unavailable(self.shared)
+        self.assertRaises(AssertionError, self.token_api.get_token, token_id)
+
+    def test_local_entries_expire(self):
+        timeutils.set_time_override()
+        self.opt_in_group('token', tier_local_time=30)
+        token_id = self.create_token_sample_data()
+        self._unavailable(self.shared)
+        self.assertEqual(self.token_api.get_token(token_id)['id'], token_id)
+        timeutils.advance_time_seconds(30)
+        self.assertRaises(AssertionError, self.token_api.get_token, token_id)
+
+    def test_local_tier_is_bounded(self):
+        self.opt_in_group('token', tier_local_size=2)
+        token_ids = [self.create_token_sample_data() for i in range(3)]
+        self._unavailable(self.shared)
+        for token_id in token_ids[1:]:
+            self.assertEqual(self.token_api.get_token(token_id)['id'],
+                             token_id)
+        self.assertRaises(AssertionError,
+                          self.token_api.get_token, token_ids[0])
+
+    def test_local_tier_off_by_default(self):
+        self.opt_in_group('token', tier_local_size=0)
+        token_id = self.create_token_sample_data()
+        self._unavailable(self.shared)
+        self.assertRaises(AssertionError, self.token_api.get_token, token_id)
+        self.assertIsNone(
+            self.shared.client.get(self.token_api.revocation_marker_key))
@@ -0,0 +1,197 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+import shutil
+import signal
+import subprocess
+
+import nose.exc
+
+from keystone.common import cms
+from keystone.common import metrics
+from keystone.common import worker_pool
+from keystone import config
+from keystone import test
+
+
+CONF = config.CONF
+
+
+class CmsSignerTestCase(test.TestCase):
+    def setUp(self):
+        super(CmsSignerTestCase, self).setUp()
+        cms._signers.clear()
+        if cms._load_libcrypto() is None:
+            raise nose.exc.SkipTest('libcrypto is not available')
+        self.text = json.dumps({'access': {'token': {'id': 'placeholder'},
+                                           'multi': 'line\ntext'}})
+
+    def tearDown(self):
+        cms._signers.clear()
+        super(CmsSignerTestCase, self).tearDown()
+
+    def test_libcrypto_output_matches_subprocess(self):
+        expected = cms.SubprocessSigner(CONF.signing.certfile,
+                                        CONF.signing.keyfile).sign(self.text)
+        signed = cms.LibcryptoSigner(CONF.signing.certfile,
+                                     CONF.signing.keyfile).sign(self.text)
+        self.assertEqual(signed, expected)
+
+    def test_libcrypto_signature_verifies(self):
+        token = cms.cms_sign_token(self.text,
+                                   CONF.signing.certfile,
+                                   CONF.signing.keyfile)
+        self.assertEqual(cms.verify_token(token,
+                                          CONF.signing.certfile,
+                                          CONF.signing.ca_certs),
+                         self.text)
+
+    def test_signer_is_cached(self):
+        signer = cms.get_signer(CONF.signing.certfile, CONF.signing.keyfile)
+        self.assertTrue(isinstance(signer, cms.LibcryptoSigner))
+        self.assertIs(signer, cms.get_signer(CONF.signing.certfile,
+                                             CONF.signing.keyfile))
+
+    def test_configured_subprocess_signer(self):
+        self.opt_in_group('signing', signer='subprocess')
+        signer = cms.get_signer(CONF.signing.certfile, CONF.signing.keyfile)
+        self.assertTrue(isinstance(signer, cms.SubprocessSigner))
+
+    def test_unknown_signer_falls_back_to_subprocess(self):
+        self.opt_in_group('signing', signer='bogus')
+        signer = cms.get_signer(CONF.signing.certfile, CONF.signing.keyfile)
+        self.assertTrue(isinstance(signer, cms.SubprocessSigner))
+
+    def test_missing_credentials(self):
+        signer = cms.LibcryptoSigner('/nonexistent/cert.pem',
+                                     '/nonexistent/key.pem')
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+
+    def test_reload_changed_credentials(self):
+        tmpdir = test.testsdir('tmp')
+        if not os.path.exists(tmpdir):
+            os.mkdir(tmpdir)
+        self.addCleanup(shutil.rmtree, tmpdir)
+        certfile = os.path.join(tmpdir, 'signing_cert.pem')
+        keyfile = os.path.join(tmpdir, 'signing_key.pem')
+        shutil.copy(CONF.signing.certfile, certfile)
+        shutil.copy(CONF.signing.keyfile, keyfile)
+
+        signer = cms.LibcryptoSigner(certfile, keyfile)
+        signer.sign(self.text)
+
+        # a broken key on disk must be noticed rather than masked by the
+        # previously loaded one
+        with open(keyfile, 'w') as f:
+            f.write('garbage')
+        os.utime(keyfile, (1, 1))
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+
+
+class PoolSignerTestCase(test.TestCase):
+    def setUp(self):
+        super(PoolSignerTestCase, self).setUp()
+        cms._signers.clear()
+        self.opt_in_group('signing', signer='pool', worker_pool_size=2)
+        self.stats = metrics.collector('signing')
+        self.stats.reset()
+        self.text = json.dumps({'access': {'token': {'id': 'placeholder'}}})
+
+    def tearDown(self):
+        for signer in cms._signers.values():
+            signer.close()
+        cms._signers.clear()
+        super(PoolSignerTestCase, self).tearDown()
+
+    def _get_signer(self):
+        signer = cms.get_signer(CONF.signing.certfile, CONF.signing.keyfile)
+        self.assertTrue(isinstance(signer, cms.PoolSigner))
+        return signer
+
+    def test_pool_output_matches_subprocess(self):
+        expected = cms.SubprocessSigner(CONF.signing.certfile,
+                                        CONF.signing.keyfile).sign(self.text)
+        self.assertEqual(self._get_signer().sign(self.text), expected)
+        self.assertEqual(self._get_signer().sign(self.text), expected)
+
+    def test_pool_records_stats(self):
+        self._get_signer().sign(self.text)
+        stats = self.stats.get_stats()
+        self.assertEqual(stats['signed'], 1)
+        self.assertEqual(stats['queue_wait']['count'], 1)
+        self.assertEqual(stats['sign']['count'], 1)
+
+    def test_dead_worker_is_replaced(self):
+        signer = self._get_signer()
+        pool = signer._pool
+        workers = [pool._idle.get() for i in range(pool.size)]
+        for worker in workers:
+            worker.kill()
+            pool._idle.put(worker)
+
+        cms.verify_token(cms.cms_to_token(signer.sign(self.text)),
+                         CONF.signing.certfile,
+                         CONF.signing.ca_certs)
+        self.assertEqual(self.stats.get_stats()['worker_restarts'], 1)
+
+    def test_signing_error_keeps_worker(self):
+        self.opt_in_group('signing', worker_pool_size=1)
+        signer = cms.get_signer('/nonexistent/cert.pem',
+                                '/nonexistent/key.pem')
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+        self.assertNotIn('errors', self.stats.get_stats())
+
+    def test_full_queue_is_rejected(self):
+        self.opt_in_group('signing', worker_pool_size=0,
+                          worker_queue_depth=0)
+        signer = self._get_signer()
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+        self.assertEqual(self.stats.get_stats()['rejected'], 1)
+
+    def test_hub_runs_while_signing(self):
+        from eventlet import greenthread
+
+        self.stubs.Set(worker_pool, 'is_green', lambda: True)
+        self.opt_in_group('signing', worker_pool_size=1, worker_timeout=1)
+        signer = self._get_signer()
+        worker = signer._pool._idle.get()
+        os.kill(worker.process.pid, signal.SIGSTOP)
+        signer._pool._idle.put(worker)
+
+        signing = greenthread.spawn(signer.sign, self.text)
+        ticks = 0
+        while not signing.dead:
+            greenthread.sleep(0.01)
+            ticks += 1
+        self.assertRaises(subprocess.CalledProcessError, signing.wait)
+        # the stalled worker held the caller for the whole timeout
+        self.assertTrue(ticks > 20, ticks)
+        self.assertEqual(self.stats.get_stats()['errors'], 1)
+
+    def test_no_free_worker_times_out(self):
+        self.opt_in_group('signing', worker_pool_size=0, worker_timeout=1)
+        signer = self._get_signer()
+        self.assertRaises(subprocess.CalledProcessError,
+                          signer.sign, self.text)
+        self.assertEqual(self.stats.get_stats()['timeouts'], 1)
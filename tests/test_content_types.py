@@ -793,8 +793,63 @@ class JsonTestCase(RestfulTestCase, CoreApiTests):
             expected_status=200)
         self.assertValidRevocationListResponse(r)
 
+    def test_fetch_revocation_list_if_none_match(self):
+        token = self.get_scoped_token()
+        r = self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked',
+            token=token,
+            expected_status=200)
+        etag = r.headers['ETag']
+        signed = r.result['signed']
+
+        self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked',
+            token=token,
+            headers={'If-None-Match': etag},
+            expected_status=304)
+
+        # revoking a token changes the list
+        self.admin_request(
+            method='DELETE',
+            path='/v2.0/tokens/%s' % self.get_scoped_token(),
+            token=token,
+            expected_status=204)
+        r = self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked',
+            token=token,
+            headers={'If-None-Match': etag},
+            expected_status=200)
+        self.assertNotEqual(r.headers['ETag'], etag)
+        self.assertNotEqual(r.result['signed'], signed)
+
+    def test_fetch_revocation_list_since_cursor(self):
+        token = self.get_scoped_token()
+        r = self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked',
+            token=token,
+            expected_status=200)
+        self.assertValidRevocationListResponse(r)
+
+        r = self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked?since=%s' % r.result['cursor'],
+            token=token,
+            expected_status=200)
+        self.assertValidRevocationListResponse(r)
+
+        self.admin_request(
+            method='GET',
+            path='/v2.0/tokens/revoked?since=yesterday',
+            token=token,
+            expected_status=400)
+
     def assertValidRevocationListResponse(self, response):
         self.assertIsNotNone(response.result['signed'])
+        self.assertIsNotNone(response.result['cursor'])
 
     def test_create_update_user_json_invalid_enabled_type(self):
         # Enforce usage of boolean for 'enabled' field in JSON
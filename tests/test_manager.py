@@ -0,0 +1,124 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from keystone.common import manager
+from keystone.common import metrics
+from keystone import exception
+from keystone import test
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.things = {'a': {'id': 'a', 'tags': []}}
+        self.calls = []
+
+    def get_thing(self, thing_id):
+        self.calls.append(('get_thing', thing_id))
+        try:
+            return self.things[thing_id]
+        except KeyError:
+            raise exception.NotFound(target=thing_id)
+
+    def list_things(self, ids=None):
+        self.calls.append(('list_things', ids))
+        return self.things.values()
+
+    def get_report(self):
+        self.calls.append(('get_report',))
+        return {'things': len(self.things)}
+
+    def update_thing(self, thing_id, thing):
+        self.calls.append(('update_thing', thing_id))
+        self.things[thing_id] = thing
+
+
+class FakeManager(manager.Manager):
+    request_cache = ('get_thing', 'list_things')
+
+    def __init__(self):
+        super(FakeManager, self).__init__('%s.FakeDriver' % __name__)
+
+    @manager.invalidates_request_cache
+    def create_thing(self, context, thing_id, thing):
+        self.driver.things[thing_id] = thing
+
+
+class RequestCacheTest(test.TestCase):
+    def setUp(self):
+        super(RequestCacheTest, self).setUp()
+        self.manager = FakeManager()
+        self.driver = self.manager.driver
+        self.stats = metrics.collector('request_cache')
+        self.stats.reset()
+
+    def test_reads_are_remembered_for_the_request(self):
+        context = {}
+        self.manager.get_thing(context, 'a')
+        self.manager.get_thing(context, thing_id='a')
+        self.manager.get_thing(context, 'a')
+        self.manager.get_thing({}, 'a')
+        self.assertEqual(self.driver.calls, [('get_thing', 'a'),
+                                             ('get_thing', 'a'),
+                                             ('get_thing', 'a')])
+        stats = self.stats.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 3))
+
+    def test_managers_share_the_request_cache(self):
+        context = {}
+        self.manager.get_thing(context, 'a')
+        FakeManager().get_thing(context, 'a')
+        self.assertEqual(len(self.driver.calls), 1)
+
+    def test_callers_cannot_change_cached_refs(self):
+        context = {}
+        self.manager.get_thing(context, 'a')['tags'].append('x')
+        self.manager.get_thing(context, 'a')['tags'].append('y')
+        self.assertEqual(self.manager.get_thing(context, 'a')['tags'], [])
+
+    def test_unlisted_reads_are_not_remembered(self):
+        context = {}
+        self.manager.get_thing(context, 'a')
+        for i in range(2):
+            self.manager.get_report(context)
+        self.manager.get_thing(context, 'a')
+        self.assertEqual(self.driver.calls, [('get_thing', 'a'),
+                                             ('get_report',),
+                                             ('get_report',)])
+
+    def test_writes_invalidate(self):
+        context = {}
+        self.manager.get_thing(context, 'a')
+        self.manager.update_thing(context, 'a', {'id': 'a', 'tags': ['x']})
+        self.assertEqual(self.manager.get_thing(context, 'a')['tags'], ['x'])
+
+        self.manager.list_things(context)
+        self.manager.create_thing(context, 'b', {'id': 'b'})
+        self.assertEqual(len(self.manager.list_things(context)), 2)
+
+    def test_errors_and_unhashable_arguments_are_not_cached(self):
+        context = {}
+        for i in range(2):
+            self.assertRaises(exception.NotFound,
+                              self.manager.get_thing, context, 'b')
+            self.manager.list_things(context, ids=['a'])
+        self.assertEqual(len(self.driver.calls), 4)
+
+    def test_disabled(self):
+        self.stubs.Set(FakeManager, 'request_cache', ())
+        context = {}
+        for i in range(2):
+            FakeManager().get_thing(context, 'a')
+        self.assertEqual(context, {})
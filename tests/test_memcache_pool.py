@@ -0,0 +1,107 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import threading
+
+from keystone.common import memcache_pool
+from keystone.common import metrics
+from keystone.common import worker_pool
+from keystone import exception
+from keystone import test
+
+import test_backend_memcache
+
+
+class MemcachePoolTestCase(test.TestCase):
+    def setUp(self):
+        super(MemcachePoolTestCase, self).setUp()
+        self.opt_in_group('memcache', pool_maxsize=2,
+                          pool_connection_get_timeout=0)
+        self.stats = metrics.collector('memcache')
+        self.stats.reset()
+        self.pool = memcache_pool.ClientPool(['127.0.0.1:11211'])
+        self.stubs.Set(self.pool, '_create', self._create)
+        self.clients = []
+
+    def _create(self):
+        self.stats.incr('connections_created')
+        client = test_backend_memcache.MemcacheClient()
+        client.disconnect_all = lambda: None
+        self.clients.append(client)
+        return client
+
+    def test_client_is_reused(self):
+        self.pool.set('key', 'value')
+        self.assertEqual(self.pool.get('key'), 'value')
+        self.assertEqual(len(self.clients), 1)
+        self.assertEqual(self.stats.get_stats()['checkout_wait']['count'], 2)
+
+    def test_pool_is_bounded(self):
+        with self.pool.acquire() as first:
+            with self.pool.acquire() as second:
+                self.assertIsNot(first, second)
+                self.assertRaises(exception.UnexpectedError,
+                                  self.pool.get, 'key')
+        self.assertEqual(len(self.clients), 2)
+        self.assertEqual(self.stats.get_stats()['timeouts'], 1)
+
+    def test_hub_runs_while_waiting(self):
+        from eventlet import greenthread
+        from eventlet import queue
+
+        self.stubs.Set(worker_pool, 'is_green', lambda: True)
+        self.opt_in_group('memcache', pool_maxsize=1,
+                          pool_connection_get_timeout=1)
+        pool = memcache_pool.ClientPool(['127.0.0.1:11211'])
+        # even where the threading module is not monkey patched
+        self.assertTrue(isinstance(pool._idle, queue.LifoQueue))
+        self.stubs.Set(pool, '_create', self._create)
+        with pool.acquire():
+            waiting = greenthread.spawn(pool.get, 'key')
+            greenthread.sleep(0)
+        self.assertIsNone(waiting.wait())
+        self.assertEqual(len(self.clients), 1)
+        self.assertNotIn('timeouts', self.stats.get_stats())
+
+    def test_failed_client_is_discarded(self):
+        def fail():
+            with self.pool.acquire():
+                raise IOError()
+
+        self.assertRaises(IOError, fail)
+        self.assertEqual(self.stats.get_stats()['errors'], 1)
+        with self.pool.acquire():
+            with self.pool.acquire():
+                pass
+        self.assertEqual(len(self.clients), 3)
+
+    def test_unknown_method(self):
+        self.assertRaises(AttributeError, getattr, self.pool, 'bogus')
+
+    def test_pools_are_shared(self):
+        pool = memcache_pool.get_pool(['127.0.0.1:11211'])
+        self.assertIs(pool, memcache_pool.get_pool(['127.0.0.1:11211']))
+        self.assertIsNot(pool, memcache_pool.get_pool(['127.0.0.1:11211'],
+                                                      cache_cas=True))
+
+    def test_client_is_not_thread_local(self):
+        client = memcache_pool._MemcacheClient(['127.0.0.1:11211'])
+        servers = []
+        thread = threading.Thread(
+            target=lambda: servers.append(client.servers))
+        thread.start()
+        thread.join()
+        self.assertIs(servers[0], client.servers)
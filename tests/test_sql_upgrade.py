@@ -26,6 +26,7 @@ To run these tests against a live database:
     all data will be lost.
 """
 import copy
+import datetime
 import json
 import uuid
 
@@ -814,6 +815,60 @@ class SqlUpgradeTests(test.TestCase):
         self.assertEqual(ref.legacy_endpoint_id, legacy_endpoint_id)
         self.assertEqual(ref.extra, '{}')
 
+    def test_upgrade_add_lease_table(self):
+        self.upgrade(27)
+        self.assertTableDoesNotExist('lease')
+        self.upgrade(28)
+        self.assertTableColumns('lease', ['name', 'holder', 'expires'])
+        self.downgrade(27)
+        self.assertTableDoesNotExist('lease')
+
+    def test_upgrade_add_tenant_id_to_token(self):
+        self.upgrade(28)
+        now = datetime.datetime.utcnow()
+        token_table = sqlalchemy.Table('token', self.metadata, autoload=True)
+        for token_id, tenant, valid in [('scoped', {'id': 'tenant'}, True),
+                                        ('unscoped', None, True),
+                                        ('revoked', {'id': 'tenant'}, False)]:
+            extra = {'tenant': tenant, 'user': {'id': 'user'}}
+            self.engine.execute(token_table.insert().values(
+                id=token_id, user_id='user', valid=valid,
+                expires=now + datetime.timedelta(days=1),
+                extra=json.dumps(extra)))
+        self.upgrade(29)
+        self.assertTableColumns('token',
+                                ['id', 'expires', 'extra', 'valid', 'trust_id',
+                                 'user_id', 'revoked_at', 'tenant_id'])
+        meta = sqlalchemy.MetaData(bind=self.engine)
+        token_table = sqlalchemy.Table('token', meta, autoload=True)
+        rows = self.engine.execute(sqlalchemy.select(
+            [token_table.c.id, token_table.c.tenant_id]))
+        self.assertEqual(dict(rows.fetchall()),
+                         {'scoped': 'tenant', 'unscoped': None,
+                          'revoked': None})
+        self.downgrade(28)
+
+    def test_upgrade_add_valid_expires_index_to_token(self):
+        self.upgrade(30)
+        meta = sqlalchemy.MetaData(bind=self.engine)
+        token_table = sqlalchemy.Table('token', meta, autoload=True)
+        indexes = dict((idx.name, [c.name for c in idx.columns])
+                       for idx in token_table.indexes)
+        self.assertEqual(indexes['ix_token_valid_expires'],
+                         ['valid', 'expires'])
+        self.assertNotIn('ix_token_valid', indexes)
+        self.downgrade(29)
+
+    def test_upgrade_add_revocation_event_table(self):
+        self.upgrade(30)
+        self.assertTableDoesNotExist('revocation_event')
+        self.upgrade(31)
+        self.assertTableColumns('revocation_event',
+                                ['id', 'token_id', 'user_id', 'tenant_id',
+                                 'trust_id', 'issued_before', 'expires'])
+        self.downgrade(30)
+        self.assertTableDoesNotExist('revocation_event')
+
     def populate_user_table(self, with_pass_enab=False,
                             with_pass_enab_domain=False):
         # Populate the appropriate fields in the user
@@ -0,0 +1,94 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import uuid
+
+from keystone.common import metrics
+from keystone.common.sql import lease
+from keystone import exception
+from keystone.openstack.common import timeutils
+from keystone.token.backends import kvs as token_kvs
+from keystone.token import reaper
+
+import test_backend
+import test_backend_sql
+
+
+class TokenReaperTestCase(test_backend_sql.SqlTests):
+    def setUp(self):
+        super(TokenReaperTestCase, self).setUp()
+        self.stats = metrics.collector('token_reaper')
+        self.stats.reset()
+        self.lease = lease.Lease()
+
+    def test_lease(self):
+        timeutils.set_time_override()
+        self.assertTrue(self.lease.acquire('lease', 'a', 60))
+        self.assertFalse(self.lease.acquire('lease', 'b', 60))
+        self.assertTrue(self.lease.acquire('lease', 'a', 60))
+
+        timeutils.advance_time_seconds(61)
+        self.assertTrue(self.lease.acquire('lease', 'b', 60))
+        self.assertFalse(self.lease.acquire('lease', 'a', 60))
+
+        self.lease.release('lease', 'a')
+        self.assertFalse(self.lease.acquire('lease', 'a', 60))
+        self.lease.release('lease', 'b')
+        self.assertTrue(self.lease.acquire('lease', 'a', 60))
+
+    def test_only_the_leader_flushes(self):
+        expires = timeutils.utcnow() - datetime.timedelta(minutes=1)
+        test_backend.create_token_sample_data(self.token_api, expires=expires)
+        leader = reaper.Reaper()
+        follower = reaper.Reaper()
+        follower.holder = uuid.uuid4().hex
+
+        self.assertEqual(leader.run_once(), 1)
+        self.assertIsNone(follower.run_once())
+        self.assertEqual(leader.run_once(), 0)
+
+        stats = self.stats.get_stats()
+        self.assertEqual(stats['runs'], 2)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['tokens_flushed'], 1)
+        self.assertEqual(stats['run_time']['count'], 2)
+        self.assertEqual(stats['interval']['count'], 1)
+
+    def test_unshared_store_is_always_flushed(self):
+        self.stubs.Set(self.token_man, 'driver', token_kvs.Token(db={}))
+        self.lease.acquire(reaper.LEASE_NAME, uuid.uuid4().hex, 60)
+        self.assertEqual(reaper.Reaper().run_once(), 0)
+
+    def test_stops_if_flushing_is_not_implemented(self):
+        def not_implemented():
+            raise exception.NotImplemented()
+
+        self.stubs.Set(reaper.eventlet, 'sleep', lambda seconds: None)
+        self.stubs.Set(self.token_api, 'flush_expired_tokens',
+                       not_implemented)
+        reaper.Reaper().run()
+        self.assertEqual(self.stats.get_stats()['errors'], 1)
+
+    def test_disabled_by_default(self):
+        self.assertIsNone(reaper.start())
+
+    def test_shared_store_requires_a_runtime_limit(self):
+        self.opt_in_group('token', reaper_enabled=True)
+        self.assertRaises(exception.UnexpectedError, reaper.start)
+
+        self.opt_in_group('token', flush_max_runtime=60)
+        reaper.start().kill()
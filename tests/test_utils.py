@@ -29,7 +29,17 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
+import datetime
+import pickle
+import time
+
+from keystone.common import crypt_pool
+from keystone.common import metrics
 from keystone.common import utils
+from keystone.common import worker_pool
+from keystone import exception
+from keystone.openstack.common import timeutils
 from keystone import test
 
 
@@ -63,3 +73,123 @@ class UtilsTestCase(test.TestCase):
         self.assertFalse(utils.auth_str_equal('a', 'aaaaa'))
         self.assertFalse(utils.auth_str_equal('aaaaa', 'a'))
         self.assertFalse(utils.auth_str_equal('ABC123', 'abc123'))
+
+    def test_frozen_dict_is_immutable(self):
+        frozen = utils.freeze({'a': {'b': [1, {'c': 2}]}})
+        self.assertRaises(TypeError, frozen.__setitem__, 'a', 1)
+        self.assertRaises(TypeError, frozen.update, {'d': 3})
+        self.assertRaises(TypeError, frozen.pop, 'a')
+        self.assertRaises(TypeError, frozen['a'].__setitem__, 'b', 1)
+        self.assertRaises(TypeError, frozen['a']['b'].append, 3)
+        self.assertRaises(TypeError, frozen['a']['b'][1].clear)
+        self.assertEqual(frozen, {'a': {'b': [1, {'c': 2}]}})
+
+    def test_frozen_dict_copies_are_mutable(self):
+        frozen = utils.freeze({'a': {'b': [1]}})
+        shallow = copy.copy(frozen)
+        shallow['d'] = 3
+        deep = copy.deepcopy(frozen)
+        deep['a']['b'].append(2)
+        self.assertEqual(deep, {'a': {'b': [1, 2]}})
+        self.assertEqual(frozen, {'a': {'b': [1]}})
+        unpickled = pickle.loads(pickle.dumps(frozen))
+        self.assertIs(type(unpickled), dict)
+        self.assertEqual(unpickled, frozen)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = utils.LRUCache()
+        for key in 'abc':
+            self.assertEqual(cache.set(key, key.upper(), size=3), 0)
+        self.assertEqual(cache.get('a'), 'A')
+        self.assertEqual(cache.peek('b'), 'B')
+        self.assertEqual(cache.set('d', 'D', size=3), 1)
+        self.assertEqual(cache.items(), [('c', 'C'), ('a', 'A'), ('d', 'D')])
+        self.assertEqual(cache.items(limit=1), [('c', 'C')])
+        self.assertEqual(cache.pop('a'), 'A')
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 2)
+        cache.clear()
+        self.assertEqual(cache.items(), [])
+
+    def test_lru_cache_entries_expire(self):
+        timeutils.set_time_override()
+        cache = utils.LRUCache()
+        cache.set('a', 'A', timeutils.utcnow() + datetime.timedelta(
+            seconds=10))
+        cache.set('b', 'B')
+        timeutils.advance_time_seconds(10)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'B')
+        self.assertEqual(len(cache), 1)
+
+
+class CryptPoolTestCase(test.TestCase):
+    def setUp(self):
+        super(CryptPoolTestCase, self).setUp()
+        self.opt(crypt_workers=2)
+        self.stats = metrics.collector('crypt')
+        self.stats.reset()
+
+    def tearDown(self):
+        pool = crypt_pool._pool
+        if pool is not None:
+            pool.close()
+        crypt_pool._pool = None
+        super(CryptPoolTestCase, self).tearDown()
+
+    def test_hash(self):
+        password = u'Comment \xe7a va'
+        hashed = utils.hash_password(password)
+        self.assertTrue(isinstance(hashed, str))
+        self.assertTrue(utils.check_password(password, hashed))
+        self.assertFalse(utils.check_password('Comment ?a va', hashed))
+        self.opt(crypt_workers=0)
+        self.assertTrue(utils.check_password(password, hashed))
+        stats = self.stats.get_stats()
+        self.assertEqual(stats['hash']['count'], 1)
+        self.assertEqual(stats['check']['count'], 2)
+
+    def test_ldap_hash(self):
+        hashed = utils.ldap_hash_password('secret')
+        self.assertTrue(utils.ldap_check_password('secret', hashed))
+        self.assertFalse(utils.ldap_check_password('wrong', hashed))
+
+    def test_errors_are_raised(self):
+        self.assertRaises(TypeError, utils.check_password, 'secret', None)
+        self.assertRaises(ValueError, utils.check_password, 'secret', 'x')
+
+    def test_dead_worker_is_replaced(self):
+        hashed = utils.hash_password('secret')
+        pool = crypt_pool.get_pool()
+        workers = [pool._pool._idle.get() for i in range(pool.size)]
+        for worker in workers:
+            worker.kill()
+            pool._pool._idle.put(worker)
+
+        self.assertTrue(utils.check_password('secret', hashed))
+        self.assertEqual(self.stats.get_stats()['worker_restarts'], 1)
+
+    def test_no_free_worker_times_out(self):
+        self.opt(crypt_workers=1, crypt_worker_timeout=1)
+        crypt_pool.get_pool()._pool._idle.get().kill()
+        self.assertRaises(exception.UnexpectedError,
+                          utils.hash_password, 'secret')
+        self.assertEqual(self.stats.get_stats()['timeouts'], 1)
+
+    def test_hub_runs_while_hashing(self):
+        from eventlet import greenthread
+
+        self.stubs.Set(worker_pool, 'is_green', lambda: True)
+        self.opt(crypt_strength=200000, crypt_workers=1)
+        crypt_pool.get_pool()
+        hashing = greenthread.spawn(utils.hash_password, 'secret')
+        gaps = []
+        last = time.time()
+        while not hashing.dead:
+            greenthread.sleep(0.005)
+            now = time.time()
+            gaps.append(now - last)
+            last = now
+        self.assertTrue(utils.check_password('secret', hashing.wait()))
+        # a single hash takes far longer than this
+        self.assertTrue(max(gaps) < 0.1, max(gaps))
@@ -125,6 +125,25 @@ class TestTokenAPIs(test_v3.RestfulTestCase):
                                           CONF.signing.keyfile)
         self.assertEqual(token_signed, token_id)
 
+    def test_v3_compact_token(self):
+        self.opt_in_group('signing', token_format='COMPACT',
+                          compact_keys=['key'])
+        r = self.post('/auth/tokens', body=self.build_authentication_request(
+            user_id=self.user['id'],
+            password=self.user['password'],
+            project_id=self.project['id']))
+        headers = {'X-Subject-Token': r.headers.get('X-Subject-Token')}
+        expected = r.result
+
+        r = self.get('/auth/tokens', headers=headers)
+        self.assertValidProjectScopedTokenResponse(r)
+        # validation gives every token a new issued_at
+        del r.result['token']['issued_at']
+        del expected['token']['issued_at']
+        self.assertEqual(r.result, expected)
+        self.delete('/auth/tokens', headers=headers, expected_status=204)
+        self.head('/auth/tokens', headers=headers, expected_status=401)
+
     def test_v3_v2_intermix_non_default_domain_failed(self):
         self.opt_in_group('signing', token_format='UUID')
         auth_data = self.build_authentication_request(
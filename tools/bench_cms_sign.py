@@ -0,0 +1,70 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Compare PKI token signing throughput of the available signers.
+
+Usage: python tools/bench_cms_sign.py [iterations]
+
+Signs a token-sized document with the example PKI credentials using every
+signer in keystone.common.cms and prints tokens signed per second.
+
+"""
+
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.common import cms  # noqa
+from keystone import config  # noqa
+
+
+CERTFILE = os.path.join(ROOT, 'examples', 'pki', 'certs', 'signing_cert.pem')
+KEYFILE = os.path.join(ROOT, 'examples', 'pki', 'private', 'signing_key.pem')
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 200
+    config.CONF(args=[], project='keystone', default_config_files=[])
+    with open(os.path.join(ROOT, 'examples', 'pki', 'cms',
+                           'auth_token_scoped.json')) as f:
+        text = json.dumps(json.load(f))
+
+    results = {}
+    for name, signer_class in sorted(cms.SIGNERS.iteritems()):
+        try:
+            signer = signer_class(CERTFILE, KEYFILE)
+        except OSError as e:
+            print '%-12s unavailable: %s' % (name, e)
+            continue
+        results[name] = signer.sign(text)
+        start = time.time()
+        for i in xrange(iterations):
+            signer.sign(text)
+        elapsed = time.time() - start
+        print '%-12s %8.1f tokens/sec' % (name, iterations / elapsed)
+
+    if len(set(results.values())) > 1:
+        print 'WARNING: signers produced different output'
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
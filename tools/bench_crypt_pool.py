@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure how password checks delay other requests under eventlet.
+
+Usage: python tools/bench_crypt_pool.py [logins] [workers]
+
+Runs a login storm of concurrent green threads checking passwords, as
+keystone-all would, while another green thread serves short requests every
+few milliseconds. Prints login throughput and the percentiles of how late
+the short requests ran, hashing in process and in a pool of workers.
+
+"""
+
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.common import wsgi_server  # noqa
+wsgi_server.monkey_patch_eventlet()
+
+import eventlet  # noqa
+
+from keystone.common import crypt_pool  # noqa
+from keystone.common import utils  # noqa
+from keystone import config  # noqa
+
+
+CONCURRENCY = 20
+INTERVAL = 0.005
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def _run(logins, hashed):
+    pending = [logins]
+    lateness = []
+
+    def login():
+        while pending[0] > 0:
+            pending[0] -= 1
+            utils.check_password('secret', hashed)
+            # as writing the response would
+            eventlet.sleep(0)
+
+    def other_requests():
+        while True:
+            due = time.time() + INTERVAL
+            eventlet.sleep(INTERVAL)
+            lateness.append(time.time() - due)
+
+    probe = eventlet.spawn(other_requests)
+    start = time.time()
+    pool = eventlet.GreenPool(CONCURRENCY)
+    for i in range(CONCURRENCY):
+        pool.spawn(login)
+    pool.waitall()
+    elapsed = time.time() - start
+    probe.kill()
+    return logins / elapsed, lateness
+
+
+def main(argv):
+    logins = int(argv[1]) if len(argv) > 1 else 200
+    workers = int(argv[2]) if len(argv) > 2 else 4
+    config.CONF(args=[], project='keystone', default_config_files=[])
+    hashed = utils.hash_password('secret')
+
+    for name, size in (('in process', 0), ('%d workers' % workers, workers)):
+        config.CONF.set_override('crypt_workers', size)
+        crypt_pool.get_pool()
+        rate, lateness = _run(logins, hashed)
+        print '%-12s %7.1f logins/sec   other requests late by ' \
+              'p50 %6.1f ms  p99 %6.1f ms  max %6.1f ms' % (
+                  name, rate,
+                  _percentile(lateness, 0.5) * 1e3,
+                  _percentile(lateness, 0.99) * 1e3,
+                  max(lateness) * 1e3)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,98 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2013 OpenStack LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Measure the cost of reading a token from the KVS token backend.
+
+Usage: python tools/bench_token_get.py [iterations]
+
+Stores a scoped token the size of the example PKI token and compares
+reading it back with a deep copy, as the backend used to, against the
+current copy-free read. Prints the time and the number of objects
+allocated per read.
+
+"""
+
+import copy
+import datetime
+import gc
+import json
+import os
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+
+from keystone.common import kvs  # noqa
+from keystone import config  # noqa
+from keystone.token.backends import kvs as token_kvs  # noqa
+
+
+def _measure(get, iterations):
+    results = []
+    gc.collect()
+    gc.disable()
+    try:
+        # gc.get_count() counts container allocations; keeping the results
+        # alive stops them being reused from the free lists
+        allocated = gc.get_count()[0]
+        start = time.time()
+        for i in xrange(iterations):
+            results.append(get())
+        elapsed = time.time() - start
+        allocated = gc.get_count()[0] - allocated
+    finally:
+        gc.enable()
+    # the list of results grows in place and allocates no tracked objects
+    return elapsed / iterations, float(allocated) / iterations
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 10000
+    config.CONF(args=[], project='keystone', default_config_files=[])
+    with open(os.path.join(ROOT, 'examples', 'pki', 'cms',
+                           'auth_token_scoped.json')) as f:
+        token_data = json.load(f)
+    access = token_data['access']
+    roles = [role['name'] for role in access['user']['roles']]
+    token_id = uuid.uuid4().hex
+    data = {'id': token_id,
+            'expires': datetime.datetime.utcnow() + datetime.timedelta(1),
+            'user': access['user'],
+            'tenant': access['token']['tenant'],
+            'metadata': {'roles': roles},
+            'token_data': token_data}
+
+    driver = token_kvs.Token(db=kvs.DictKvs())
+    driver.create_token(token_id, data)
+    legacy_db = kvs.DictKvs()
+    legacy_db.set('token-%s' % token_id, copy.deepcopy(data))
+
+    benchmarks = [
+        ('deepcopy', lambda: copy.deepcopy(
+            legacy_db.get('token-%s' % token_id))),
+        ('copy-free', lambda: driver.get_token(token_id)),
+    ]
+    for name, get in benchmarks:
+        seconds, allocated = _measure(get, iterations)
+        print '%-10s %10.2f usec/get %10.1f objects/get' % (
+            name, seconds * 1e6, allocated)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))